@@ -2,30 +2,32 @@ from __future__  import print_function  # Python 2/3 compatibility
 
 
 from gremlin_python import statics
-from gremlin_python.structure.graph import Graph
 from gremlin_python.process.graph_traversal import __
 from gremlin_python.process.strategies import *
-from gremlin_python.driver.driver_remote_connection import DriverRemoteConnection
 from gremlin_python.process.traversal import T
 import json
 import os
+import connection
+import deletion
+import instrumentation
 import validation
 
 
-neptuneEndpoint = os.environ['NeptuneEndpoint']
-neptuneEndpoint = "wss://" + neptuneEndpoint + ":8182/gremlin"
+g = connection.g
 
-graph = Graph()
-remoteConn = DriverRemoteConnection(neptuneEndpoint,'g')
-g = graph.traversal().withRemote(remoteConn)
 
+# Edges are dropped in batches, see layers/deletion.py. A delete that does not
+# finish within this invocation, or that was asked to run asynchronously,
+# continues in the aggregator worker and returns 202 with the job status.
+deleteMode = os.environ.get('DeleteMode', 'sync')
 
-def campaignDelete(campaign):
+def campaignDelete(campaign, context = None, asynchronous = False):
     
     try:
-        query = g.V(campaign).drop().iterate()
+        job = deletion.delete(campaign, 'campaign', context, asynchronous or deleteMode == 'async')
         return {
-            'statusCode': 200
+            'statusCode': {'done': 200, 'failed': 400}.get(job['status'], 202),
+            'body': json.dumps(job)
         }
  
     except Exception as e:
@@ -34,16 +36,18 @@ def campaignDelete(campaign):
             'statusCode': 400
         }
 
-    return response
-
+@instrumentation.instrumented
 def handler(event, context):
 
-    input = event["pathParameters"]
+    input = {
+        **event['pathParameters'],
+        **(event.get('queryStringParameters') or {})
+    }
 
     validationResult =  validation.validate(input, ['campaign'])
 
     if validationResult[0] is True:
-        return campaignDelete(input['campaign'])
+        return campaignDelete(input['campaign'], context, validationResult[1]['async'])
     else:
         return {
             'statusCode': 400,
@@ -2,42 +2,40 @@ from __future__  import print_function  # Python 2/3 compatibility
 
 
 from gremlin_python import statics
-from gremlin_python.structure.graph import Graph
 from gremlin_python.process.graph_traversal import __
 from gremlin_python.process.strategies import *
-from gremlin_python.driver.driver_remote_connection import DriverRemoteConnection
 from gremlin_python.process.traversal import T
 from gremlin_python.driver.protocol import GremlinServerError
 from gremlin_python.process.traversal import Cardinality
 import json
 import os
+import connection
+import instrumentation
+import interactions
+import retry
 import validation 
 
 
 
-neptuneEndpoint = os.environ['NeptuneEndpoint']
-neptuneEndpoint = 'wss://' + neptuneEndpoint + ':8182/gremlin'
-
-graph = Graph()
-remoteConn = DriverRemoteConnection(neptuneEndpoint,'g')
-g = graph.traversal().withRemote(remoteConn)
+g = connection.g
 
 
 def campaignUpdate(input):
     
     try:
-        query = g.V(input['campaign']).property(Cardinality.single,input['campaignAttribute'],__.union(__.values(input['campaignAttribute']), __.constant(input['incrementBy'])).sum()).next()
+        interactions.write(input['campaign'], {('campaignAttribute', input['campaign'], input['campaignAttribute']): input['incrementBy']})
         return {
             'statusCode': 200,
         }
     except Exception as e:
         return {
-            'statusCode': 400,
+            'statusCode': retry.statusCode(e),
             'body': str(e)
         }
         
 
 
+@instrumentation.instrumented
 def handler(event, context):
     input = {
             **event['pathParameters'],
@@ -2,23 +2,18 @@ from __future__  import print_function  # Python 2/3 compatibility
 
 
 from gremlin_python import statics
-from gremlin_python.structure.graph import Graph
 from gremlin_python.process.graph_traversal import __
 from gremlin_python.process.strategies import *
-from gremlin_python.driver.driver_remote_connection import DriverRemoteConnection
 from gremlin_python.process.traversal import T
 from gremlin_python.driver.protocol import GremlinServerError
 import json
 import os
+import connection
+import instrumentation
 import validation
 
 
-neptuneEndpoint = os.environ['NeptuneEndpoint']
-neptuneEndpoint = "wss://" + neptuneEndpoint + ":8182/gremlin"
-
-graph = Graph()
-remoteConn = DriverRemoteConnection(neptuneEndpoint,'g')
-g = graph.traversal().withRemote(remoteConn)
+g = connection.g
 
 def campaignCreate(campaign):
     
@@ -36,6 +31,7 @@ def campaignCreate(campaign):
         }
 
         
+@instrumentation.instrumented
 def handler(event, context):
     input = {**event["pathParameters"]}
 
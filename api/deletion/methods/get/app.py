@@ -0,0 +1,33 @@
+from __future__  import print_function  # Python 2/3 compatibility
+
+
+import json
+import os
+import connection
+import deletion
+import instrumentation
+
+
+g = connection.g
+
+def deletionStatus(vertex):
+    try:
+        job = deletion.status(vertex)
+        if job is None:
+            return {
+                'statusCode': 404,
+                'body': 'no delete job for ' + vertex
+            }
+        return {
+            'statusCode': 200,
+            'body': json.dumps(job)
+        }
+    except Exception as e:
+        return {
+            'statusCode': 400,
+            'body': str(e)
+        }
+
+@instrumentation.instrumented
+def handler(event, context):
+    return deletionStatus(event['pathParameters']['vertex'])
@@ -0,0 +1,96 @@
+from __future__  import print_function  # Python 2/3 compatibility
+
+
+import base64
+import json
+import os
+import connection
+import instrumentation
+import interactions
+import validation
+
+
+maxEvents = int(os.environ.get('BatchMaxEvents', '10000'))
+
+def requiredFields(item):
+    if 'action' in item and 'campaign' not in item:
+        return ['player', 'action']
+    elif 'campaign' in item and 'action' not in item:
+        return ['player', 'campaign', 'campaignAction']
+    return None
+
+def interactionBatch(events, context = None):
+    statuses = [None] * len(events)
+    documents = []
+    for i, item in enumerate(events):
+        required = requiredFields(item) if isinstance(item, dict) else None
+        if required is None:
+            statuses[i] = {'status': 400, 'error': 'must specify action or campaign and campaignAction'}
+            continue
+        validationResult = validation.validate(item, required, exists = False)
+        if validationResult[0] is True:
+            documents.append((i, validationResult[1]))
+        else:
+            statuses[i] = {'status': 400, 'error': validationResult[0]}
+
+    # one existence query for every player, targetPlayer and campaign in the batch
+    existence = validation.existenceCheckAll([document for i, document in documents])
+    valid = []
+    for (i, document), errors in zip(documents, existence):
+        if errors:
+            statuses[i] = {'status': 400, 'error': errors}
+        else:
+            valid.append((i, document))
+    documents = valid
+
+    deltas = interactions.combine([document for i, document in documents])
+    # stops before the function times out; the events it did not get to are
+    # returned as unprocessed so the caller can send them again
+    results = interactions.applyDeltas(deltas, context = context)
+    unprocessed = []
+    for i, document in documents:
+        key = interactions.eventKey(document)
+        if key not in results:
+            statuses[i] = {'status': 503, 'error': 'not written before the time limit'}
+            unprocessed.append(i)
+        elif results[key] is None:
+            statuses[i] = {'status': 200}
+        else:
+            statuses[i] = {'status': 400, 'error': results[key]}
+
+    return {
+        'statusCode': 200,
+        'body': json.dumps({
+            'received': len(events),
+            'writes': sum(error is None for error in results.values()),
+            'items': statuses,
+            'unprocessed': unprocessed
+        })
+    }
+
+@instrumentation.instrumented
+def handler(event, context):
+    body = event.get('body') or ''
+    if event.get('isBase64Encoded'):
+        body = base64.b64decode(body).decode('utf-8')
+
+    try:
+        events = interactions.parseEvents(body)
+    except ValueError as e:
+        return {
+            'statusCode': 400,
+            'body': 'body must be a JSON array or JSON lines of interactions: ' + str(e)
+        }
+
+    if not isinstance(events, list) or len(events) == 0:
+        return {
+            'statusCode': 400,
+            'body': 'body must contain at least one interaction'
+        }
+    elif len(events) > maxEvents:
+        return {
+            'statusCode': 400,
+            'body': 'at most ' + str(maxEvents) + ' interactions per request'
+        }
+
+    return interactionBatch(events, context)
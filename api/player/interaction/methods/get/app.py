@@ -8,38 +8,39 @@ from __future__  import print_function  # Python 2/3 compatibility
 
 
 from gremlin_python import statics
-from gremlin_python.structure.graph import Graph
 from gremlin_python.process.graph_traversal import __
 from gremlin_python.process.strategies import *
-from gremlin_python.driver.driver_remote_connection import DriverRemoteConnection
 from gremlin_python.process.traversal import T
 import json
 import os
+import connection
+import instrumentation
+import paging
+import timebuckets
 import validation
 
 
-neptuneEndpoint = os.environ['NeptuneEndpoint']
-neptuneEndpoint = "wss://" + neptuneEndpoint + ":8182/gremlin"
-
-graph = Graph()
-remoteConn = DriverRemoteConnection(neptuneEndpoint,'g')
-g = graph.traversal().withRemote(remoteConn)
+g = connection.reader
 
 def interactions(input):
-    query = g.V(input['player'])
+    # a caller that passes the X-Written-At of its own PUT reads from the
+    # writer until the replicas have caught up
+    query = connection.forRead(input.get('writtenAt')).V(input['player'])
     if input['bidirectional']:
         query = query.bothE()
     else:
         query = query.outE()
     if 'targetPlayer' in input:
-        query = query.where(__.otherV().hasId(input['targetPlayer'])).elementMap()
+        query = query.where(__.otherV().hasId(input['targetPlayer']))
     else:
-        query = query.where(__.and_(__.inV().hasLabel("player"), __.outV().hasLabel("player"))).elementMap()
+        query = query.where(__.and_(__.inV().hasLabel("player"), __.outV().hasLabel("player")))
+    # ordered so that cursor offsets are stable between pages
+    query = query.order().by(T.id)
 
     try:
         return {
             'statusCode': 200,
-            'body': str(query.toList())
+            'body': paging.page(query, input.get('limit'), input.get('cursor'), columnar = input['format'] == 'columnar', project = timebuckets.elementMap(edge = True))
         }
     except Exception as e:
         return {
@@ -47,6 +48,7 @@ def interactions(input):
             'body': str(e)
         }
 
+@instrumentation.instrumented
 def handler(event, context):
     if event['queryStringParameters'] is not None:
         input = {
@@ -2,75 +2,76 @@ from __future__  import print_function  # Python 2/3 compatibility
 
 
 from gremlin_python import statics
-from gremlin_python.structure.graph import Graph
 from gremlin_python.process.graph_traversal import __
 from gremlin_python.process.strategies import *
-from gremlin_python.driver.driver_remote_connection import DriverRemoteConnection
 from gremlin_python.process.traversal import T
 from gremlin_python.process.traversal import Cardinality
 
 import json
 import os
+import connection
+import eventqueue
+import instrumentation
+import interactions
+import resultcache
+import retry
 import validation 
 
-neptuneEndpoint = os.environ['NeptuneEndpoint']
-neptuneEndpoint = "wss://" + neptuneEndpoint + ":8182/gremlin"
+g = connection.g
 
-graph = Graph()
-remoteConn = DriverRemoteConnection(neptuneEndpoint,'g')
-g = graph.traversal().withRemote(remoteConn)
+# 'async' validates and enqueues the event for the aggregator worker instead of
+# writing it to the graph before responding
+writeMode = os.environ.get('InteractionWriteMode', 'sync')
+
+def enqueue(input, fields):
+    try:
+        eventqueue.queue().send([eventqueue.event({field: input[field] for field in fields if field in input})])
+        return {
+            'statusCode': 202
+        }
+
+    except Exception as e:
+        return {
+            'statusCode': 400,
+            'body': str(e)
+        }
 
 
 def interactionEdge(input):
+    # action vertex, action_edge, interaction_edge and the player's action
+    # properties are all written by one traversal, i.e. one round trip
     try:
-        query = g.V(input['action']).fold().coalesce(
-            __.unfold(),
-            __.addV('action').property(T.id,input['action'])
-        ).as_('a').V(input['player']).coalesce(
-            __.outE('action_edge').where(__.inV().has(T.id, input['action'])).property('count',__.union(__.values('count'), __.constant(1)).sum()),
-            __.addE('action_edge').to('a').property('count',1)
-        ).next()
-
-        if 'targetPlayer' in input:
-            try:
-                query = g.V(input['targetPlayer']).as_('a').V(input['player']).coalesce(
-                    __.outE('interaction_edge').where(__.inV().has(T.id, input['targetPlayer'])).property(input['action'],__.union(__.values(input['action']), __.constant(1)).sum()),
-                    __.addE('interaction_edge').to('a').property(input['action'],1)
-                ).next()
-            except Exception as e:
-                print(e)
-
-        query = g.V(input['action']).valueMap().unfold().next()
-        for key, value in query.items():
-            print(key, type(value[0]))
-            query = g.V(input['player']).property(Cardinality.single,key,__.union(__.values(key), __.constant(value[0])).sum()).next()
-
+        key = interactions.eventKey(input)
+        interactions.write(input['player'], {key: 1})
+        resultcache.invalidate(interactions.cacheTags([key]))
         return {
-            'statusCode': 200
+            'statusCode': 200,
+            'headers': {'X-Written-At': str(connection.writtenAt())}
         }
 
     except Exception as e:
         return {
-            'statusCode': 400,
+            'statusCode': retry.statusCode(e),
             'body': str(e)
         }
 
 def campaignEdge(input):
     try:
-        query = g.V(input['campaign']).as_('a').V(input['player']).coalesce(
-                __.outE('campaign_edge').where(__.inV().has(T.id, input['campaign'])).property(input['campaignAction'],__.union(__.values(input['campaignAction']), __.constant(1)).sum()),
-                __.addE('campaign_edge').to('a').property(input['campaignAction'],1)
-            ).next()
+        # keyed on the campaign, which every player's event for it contends on
+        interactions.write(input['campaign'], {interactions.eventKey(input): 1})
+        resultcache.invalidate([input['player']])
         return {
-            'statusCode': 200
+            'statusCode': 200,
+            'headers': {'X-Written-At': str(connection.writtenAt())}
         }
 
     except Exception as e:
         return {
-            'statusCode': 400,
+            'statusCode': retry.statusCode(e),
             'body': str(e)
         }
 
+@instrumentation.instrumented
 def handler(event, context):
     if event['queryStringParameters'] is not None:
         input = {
@@ -84,6 +85,8 @@ def handler(event, context):
         validationResult =  validation.validate(input, ['action'])
 
         if validationResult[0] is True:
+            if writeMode == 'async':
+                return enqueue(input, ['player', 'action', 'targetPlayer'])
             return interactionEdge(input)
         else:
             return {
@@ -94,6 +97,8 @@ def handler(event, context):
         validationResult =  validation.validate(input, ['campaign', 'campaignAction'])
 
         if validationResult[0] is True:
+            if writeMode == 'async':
+                return enqueue(input, ['player', 'campaign', 'campaignAction'])
             return campaignEdge(input)
         else:
             return {
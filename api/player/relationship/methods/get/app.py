@@ -2,42 +2,74 @@ from __future__  import print_function  # Python 2/3 compatibility
 
 
 from gremlin_python import statics
-from gremlin_python.structure.graph import Graph
 from gremlin_python.process.graph_traversal import __
 from gremlin_python.process.strategies import *
-from gremlin_python.driver.driver_remote_connection import DriverRemoteConnection
 from gremlin_python.process.traversal import T
 import json
 import os
+import connection
+import instrumentation
 import validation
 
 
-neptuneEndpoint = os.environ['NeptuneEndpoint']
-neptuneEndpoint = "wss://" + neptuneEndpoint + ":8182/gremlin"
+g = connection.reader
 
-graph = Graph()
-remoteConn = DriverRemoteConnection(neptuneEndpoint,'g')
-g = graph.traversal().withRemote(remoteConn)
+maxOrder = int(os.environ.get('RelationshipMaxOrder', '6'))
 
+# Most players expanded from at each hop. A well connected player reaches most
+# of the graph within three hops, so the frontier is capped by default.
+defaultFanOut = int(os.environ.get('RelationshipFanOut', '1000'))
 
+# Breadth first search, one query per hop. Each hop expands the whole frontier
+# at once, drops vertices already visited and dedups on the server, so every
+# player is expanded at most once however many paths lead to it. Only players
+# are kept in the frontier: the action vertices are reached by a large share of
+# all players and would spend the fan out on vertices that are never reported.
+def relationship(player, order, fanOut = None, limit = None, countOnly = False):
+    fanOut = fanOut or defaultFanOut
+    try:
+        visited = {player}
+        frontier = [player]
+        found = []
+        counts = []
+        truncated = False
+        for hop in range(1, order + 1):
+            if not frontier:
+                break
+            step = g.V(*frontier).out().hasLabel('player').dedup().not_(__.hasId(*visited))
 
+            if countOnly and hop == order:
+                # the last frontier is never expanded, so only its size is needed
+                counts.append(step.count().next())
+                break
 
-def relationship(player, order):
-    try:
-        if order==1:
-            edges = g.V(player).outE().inV().hasLabel('player').toSet()
-            
-        elif order==2:
-            edges = g.V(player).outE().inV().outE().inV().hasLabel('player').toSet()
-            
-        elif order==3:
-            edges = g.V(player).outE().inV().outE().inV().outE().inV().hasLabel('player').toSet()
-        else: 
-            edges = "relationshipOrder must be 1, 2, 3"
-    
+            # one more than the cap, to tell a full hop from a truncated one
+            reached = step.limit(fanOut + 1).id().toList()
+            if len(reached) > fanOut:
+                reached = reached[:fanOut]
+                truncated = True
+            visited.update(reached)
+            frontier = reached
+            counts.append(len(reached))
+            if not countOnly:
+                found.extend({'player': vertexId, 'hop': hop} for vertexId in reached)
+                if limit is not None and len(found) >= limit:
+                    truncated = truncated or len(found) > limit or hop < order
+                    found = found[:limit]
+                    break
+
+        result = {
+            'player': player,
+            'relationshipOrder': order,
+            'counts': counts,
+            'count': sum(counts),
+            'truncated': truncated
+        }
+        if not countOnly:
+            result['players'] = found
         return {
             'statusCode': 200,
-            'body': str(edges)
+            'body': json.dumps(result)
         }
     except Exception as e:
         return {
@@ -45,20 +77,24 @@ def relationship(player, order):
             'body': str(e)
         }
 
+@instrumentation.instrumented
 def handler(event, context):
     input = {
         **event['pathParameters'],
-        **event['queryStringParameters']
+        **(event['queryStringParameters'] or {})
         }
     input_validation = validation.validate(input)
-    
+
     if input_validation[0] is True:
-        return relationship(input_validation[1]['player'], input_validation[1]['relationshipOrder'])
+        document = input_validation[1]
+        if document['relationshipOrder'] > maxOrder:
+            return {
+                'statusCode': 400,
+                'body': 'relationshipOrder must be between 1 and ' + str(maxOrder)
+            }
+        return relationship(document['player'], document['relationshipOrder'], document.get('fanOut'), document.get('limit'), document['countOnly'])
     else:
         return {
             'statusCode': 400,
             'body': str(input_validation[0])
         }
-    
-
-
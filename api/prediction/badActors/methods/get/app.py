@@ -2,48 +2,54 @@ from __future__  import print_function
 
 
 from gremlin_python import statics
-from gremlin_python.structure.graph import Graph
 from gremlin_python.process.graph_traversal import __
 from gremlin_python.process.strategies import *
-from gremlin_python.driver.driver_remote_connection import DriverRemoteConnection
 from gremlin_python.process.traversal import T
 from gremlin_python.process.traversal import P
+from gremlin_python.process.traversal import Column
 import json
 import os
+import actionprofile
+import connection
+import instrumentation
+import paging
+import reputation
+import resultcache
 import validation
 
 
-neptuneEndpoint = os.environ['NeptuneEndpoint']
-neptuneEndpoint = "wss://" + neptuneEndpoint + ":8182/gremlin"
-
-graph = Graph()
-remoteConn = DriverRemoteConnection(neptuneEndpoint,'g')
-g = graph.traversal().withRemote(remoteConn)
+g = connection.reader
 
 # Find users that a given user has not directly interacted with, but that they might want to interact with based on common interactions.
 
-def badActors(startingPlayer, relatedPlayer, relatedAction):
+def badActors(relatedPlayer, relatedAction, limit = None, cursor = None, window = None):
     
     try:
-        query = g.V()                           \
-            .hasLabel('player')                 \
-            .has('ea_reputation',P.lt(0))       \
-            .aggregate(startingPlayer)          \
-            .out('interaction_edge')            \
-            .where(                             \
-                __.out('action_edge')           \
-                .hasId(relatedAction)           \
-                .in_('action_edge')             \
-                .where(                         \
-                    P.within(startingPlayer)    \
-                )                               \
-            ).as_(relatedPlayer)                \
-            .path()                             \
-            .by(__.id())                        \
-            .toList()                           
+        # starts from the negative reputation index rather than every player
+        # and filters on the act_ properties rather than the action vertex;
+        # ordered by the pair of ids and paged on it, so a page starts after
+        # the last pair of the one before instead of sorting it again
+        last = paging.decodeKeyCursor(cursor)
+        flagged = reputation.flaggedPlayers(g) if last is None else reputation.flaggedPlayers(g).has(T.id, P.gte(last[0]))
+        query = flagged                                         \
+            .where(actionprofile.took(relatedAction, window))   \
+            .as_('flagged')                                     \
+            .out('interaction_edge')                            \
+            .where(actionprofile.took(relatedAction, window))   \
+            .as_(relatedPlayer)                                 \
+            .select('flagged', relatedPlayer)                   \
+            .by(__.id())
+        if last is not None:
+            query = query.where(paging.after(['flagged', relatedPlayer], last))
+        query = query                                           \
+            .order()                                            \
+            .by(__.select('flagged'))                           \
+            .by(__.select(relatedPlayer))                       \
+            .select(Column.values)
+        instrumentation.capture(query)
         return {
             'statusCode': 200,
-            'body': str(query)
+            'body': paging.page(query, limit, cursor, sortKey = list)
         }
         
 
@@ -54,6 +60,7 @@ def badActors(startingPlayer, relatedPlayer, relatedAction):
         }
 
 
+@instrumentation.instrumented
 def handler(event, context):
     if event['queryStringParameters'] is not None:
         input = {
@@ -67,7 +74,11 @@ def handler(event, context):
     validation_result = validation.validate(input, required = ['player','targetPlayer','action'])
 
     if validation_result[0] is True:
-        return badActors(input['player'],input['targetPlayer'],input['action'])
+        # spans every flagged player, so tagged with the endpoint and action
+        # rather than players; see interactions.cacheTags()
+        tags = [resultcache.endpointTag('badActors'), resultcache.endpointTag('badActors', input['action'])]
+        params = {field: validation_result[1].get(field) for field in ['player', 'targetPlayer', 'action', 'limit', 'cursor', 'window']}
+        return resultcache.response('badActors', params, lambda: badActors(input['targetPlayer'], input['action'], validation_result[1].get('limit'), validation_result[1].get('cursor'), validation_result[1].get('window')), tags)
     else:
         return {
             'statusCode': 400,
@@ -0,0 +1,86 @@
+from __future__  import print_function  # Python 2/3 compatibility
+
+
+import base64
+import json
+import os
+import instrumentation
+import paging
+import segmentation
+import serializer
+import validation
+
+
+maxCohorts = int(os.environ.get('SegmentationMaxCohorts', '100'))
+
+# Sizes, and optionally members and bitsets, of many cohorts at once. The
+# cohorts are evaluated together over the players' attribute columns (see
+# layers/segmentation.py), which workers/segmentation publishes, so no
+# traversal runs.
+def cohorts(definitions, members = 0, offset = 0, bitset = False):
+    try:
+        columns = segmentation.columns()
+        found = segmentation.evaluate(definitions, columns)
+        items = {}
+        for name, cohort in found.items():
+            item = {'size': cohort.size}
+            if members:
+                item['members'] = cohort.members(columns.ids, offset, min(members, paging.maxLimit))
+            if bitset:
+                item['bitset'] = cohort.encoded()
+            items[name] = item
+        return {
+            'statusCode': 200,
+            'body': json.dumps({
+                'players': len(columns),
+                'refreshedAt': int(columns.refreshedAt),
+                'cohorts': items
+            }, separators = serializer.separators)
+        }
+    except segmentation.Unavailable as e:
+        # the segmentation worker has not published the columns yet
+        return {
+            'statusCode': 503,
+            'body': str(e)
+        }
+    except Exception as e:
+        return {
+            'statusCode': 400,
+            'body': str(e)
+        }
+
+@instrumentation.instrumented
+def handler(event, context):
+    body = event.get('body') or ''
+    if event.get('isBase64Encoded'):
+        body = base64.b64decode(body).decode('utf-8')
+
+    try:
+        input = json.loads(body)
+    except ValueError as e:
+        return {
+            'statusCode': 400,
+            'body': 'body must be a JSON object: ' + str(e)
+        }
+
+    if not isinstance(input, dict):
+        return {
+            'statusCode': 400,
+            'body': 'body must be a JSON object with cohorts'
+        }
+
+    validationResult = validation.validate(input, ['cohorts'], exists = False)
+
+    if validationResult[0] is True:
+        document = validationResult[1]
+        if len(document['cohorts']) > maxCohorts:
+            return {
+                'statusCode': 400,
+                'body': 'at most ' + str(maxCohorts) + ' cohorts per request'
+            }
+        return cohorts(document['cohorts'], document.get('members', 0), document.get('offset', 0), document['bitset'])
+    else:
+        return {
+            'statusCode': 400,
+            'body': str(validationResult[0])
+        }
@@ -2,31 +2,108 @@ from __future__  import print_function  # Python 2/3 compatibility
 
 
 from gremlin_python import statics
-from gremlin_python.structure.graph import Graph
 from gremlin_python.process.graph_traversal import __
 from gremlin_python.process.strategies import *
-from gremlin_python.driver.driver_remote_connection import DriverRemoteConnection
 from gremlin_python.process.traversal import T
 from gremlin_python.process.traversal import P
+from gremlin_python.process.traversal import Column
+from gremlin_python.process.traversal import Operator
+from gremlin_python.process.traversal import Order
 import json
 import os
+import connection
+import instrumentation
+import interactions
+import resultcache
+import serializer
+import timebuckets
 import validation
 
 
-neptuneEndpoint = os.environ['NeptuneEndpoint']
-neptuneEndpoint = "wss://" + neptuneEndpoint + ":8182/gremlin"
+g = connection.reader
 
-graph = Graph()
-remoteConn = DriverRemoteConnection(neptuneEndpoint,'g')
-g = graph.traversal().withRemote(remoteConn)
+topK = int(os.environ.get('RecommendationTopK', '20'))
+maxTopK = int(os.environ.get('RecommendationMaxTopK', '100'))
 
-# Find users that a given user has not directly interacted with, but that they might want to interact with based on common interactions.
-def collaborativeFilter(player):
+# Interaction edges followed from each vertex. Popular players have thousands;
+# a random sample of them keeps the two hop expansion bounded.
+sampleSize = int(os.environ.get('RecommendationSampleSize', '200'))
+
+# Weight of each action count on an interaction edge. Negative interactions
+# (reports, griefing, ...) do not make a recommendation.
+defaultWeights = {
+    'action_chat': 1,
+    'action_partyjoin': 5,
+    'action_randomheal': 3,
+    'action_endorse': 10
+}
+weights = json.loads(os.environ.get('RecommendationWeights') or 'null') or defaultWeights
+
+# Results per player, kept in the prediction cache until the player writes a
+# new interaction (which bumps interactions.versionProperty on the player and
+# invalidates the player's entries) or the entry expires. The version is
+# checked as well, since writes in other containers cannot reach this cache.
+cacheTtl = float(os.environ.get('RecommendationCacheTtl', '300'))
+
+def edgeWeight(window = None):
+    # with a window, the action counts are replaced by their decayed counts
+    # within it (see timebuckets.py)
+    if window is None:
+        terms = [__.values(action).math('_ * ' + str(weight)) for action, weight in weights.items()]
+    else:
+        terms = [term for action, weight in weights.items() for term in timebuckets.decayed(action, window, weight)]
+    return __.coalesce(__.union(*terms).sum(), __.constant(0))
+
+def sampledInteractions():
+    return __.outE('interaction_edge').sample(sampleSize)
+
+# Find users that a given user has not directly interacted with, but that they
+# might want to interact with based on common interactions. A candidate's score
+# is the sum over the paths player -> friend -> candidate of the product of the
+# two edges' weights.
+def recommendations(player, k, window = None):
+    query = g.withSack(1.0).V(player).as_('user')                                       \
+        .local(sampledInteractions()).sack(Operator.mult).by(edgeWeight(window)).inV()  \
+        .aggregate('friends')                                                           \
+        .local(sampledInteractions()).sack(Operator.mult).by(edgeWeight(window)).inV()  \
+        .where(P.neq('user')).where(P.without('friends'))                               \
+        .group().by(T.id).by(__.sack().sum())                                           \
+        .unfold().where(__.select(Column.values).is_(P.gt(0)))                          \
+        .order().by(Column.values, Order.desc).by(Column.keys)                          \
+        .limit(k)
+    instrumentation.capture(query)
+    return [{'id': vertexId, 'score': score} for entry in query.toList() for vertexId, score in entry.items()]
+
+def version(player):
+    return g.V(player).values(interactions.versionProperty).fold().next()
+
+def cachedRecommendations(player, k, window = None):
+    # profile=true is always computed, so that there is a traversal to profile
+    if instrumentation.profiling():
+        return recommendations(player, k, window), False
+    params = {'player': player, 'window': window}
+    entry = resultcache.cache().get('collaborativeFilter', params)
+    current = None
+    # the version is only read for an entry that could answer the request
+    if entry is not None and entry['k'] >= k:
+        current = version(player)
+        if entry['version'] == current:
+            return entry['items'][:k], True
+    if current is None:
+        current = version(player)
+    items = recommendations(player, k, window)
+    resultcache.cache().put('collaborativeFilter', params, {'version': current, 'k': k, 'items': items}, [player], cacheTtl)
+    return items, False
+
+def collaborativeFilter(player, k = None, columnar = False, window = None):
     try:
-        query = g.V(player).as_('user').out().aggregate('friends').out().where(P.neq('user')).where(P.without('friends')).groupCount().by(__.id()).toList()
+        items, cached = cachedRecommendations(player, min(k or topK, maxTopK), window)
         return {
             'statusCode': 200,
-            'body': str(query)
+            'body': json.dumps({
+                'items': serializer.columnar(items) if columnar else items,
+                'cached': cached
+            }, separators = serializer.separators)
         }
     except Exception as e:
         return {
@@ -34,6 +111,7 @@ def collaborativeFilter(player):
             'body': str(e)
         }
 
+@instrumentation.instrumented
 def handler(event, context):
     if event['queryStringParameters'] is not None:
         input = {
@@ -48,12 +126,10 @@ def handler(event, context):
     validationResult =  validation.validate(input, required = ['player'])
 
     if validationResult[0] is True:
-        return collaborativeFilter(input['player'])
+        document = validationResult[1]
+        return collaborativeFilter(input['player'], document.get('limit'), document['format'] == 'columnar', document.get('window'))
     else:
         return {
             'statusCode': 400,
             'body': str(validationResult[0])
         }
-
-
-
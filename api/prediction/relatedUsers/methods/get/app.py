@@ -2,31 +2,50 @@ from __future__  import print_function  # Python 2/3 compatibility
 
 
 from gremlin_python import statics
-from gremlin_python.structure.graph import Graph
 from gremlin_python.process.graph_traversal import __
 from gremlin_python.process.strategies import *
-from gremlin_python.driver.driver_remote_connection import DriverRemoteConnection
 from gremlin_python.process.traversal import T
 from gremlin_python.process.traversal import P
 import json
 import os
+import actionprofile
+import connection
+import instrumentation
+import paging
+import resultcache
 import validation
 
 
-neptuneEndpoint = os.environ['NeptuneEndpoint']
-neptuneEndpoint = "wss://" + neptuneEndpoint + ":8182/gremlin"
+g = connection.reader
 
-graph = Graph()
-remoteConn = DriverRemoteConnection(neptuneEndpoint,'g')
-g = graph.traversal().withRemote(remoteConn)
+badActions = ['action_report','action_badimage','action_badlanguage','action_badname','action_sharepii']
+
+def path(row):
+    # the path player -> target -> action -> player the query used to traverse
+    return [row['player'], 'interaction_edge', row['target'], 'action_edge', row['action'], 'action_edge', row['player']]
+
+def sortKey(row):
+    return [row['player'], row['target'], row['action']]
 
 # Find users that a given user has not directly interacted with, but that they might want to interact with based on common interactions.
-def relatedUsers(player, playerAttribute):
+def relatedUsers(player, playerAttribute, limit = None, cursor = None, window = None):
     try:
-        query = g.V().hasLabel('player').has(playerAttribute,P.lt(0)).as_(player).outE('interaction_edge').inV().outE('action_edge').inV().hasId('action_report','action_badimage','action_badlanguage','action_badname','action_sharepii').inE('action_edge').outV().where(__.is_(P.eq(player))).path().by(__.id()).by(T.label).toList()
+        # one row per bad action taken by both players, read from the act_
+        # properties instead of going through the action vertices, in a stable
+        # order and paged on it, so a page starts after the last row of the
+        # one before instead of sorting it again
+        last = paging.decodeKeyCursor(cursor)
+        players = g.V().hasLabel('player') if last is None else g.V().hasLabel('player').has(T.id, P.gte(last[0]))
+        query = players.has(playerAttribute,P.lt(0)).where(actionprofile.tookAny(badActions, window)).as_('player').out('interaction_edge').as_('target').union(*[
+            __.where(actionprofile.took(action, window)).where(__.select('player').where(actionprofile.took(action, window))).constant(action) for action in badActions
+        ]).as_('action').select('player', 'target', 'action').by(__.id()).by(__.id()).by()
+        if last is not None:
+            query = query.where(paging.after(['player', 'target', 'action'], last))
+        query = query.order().by(__.select('player')).by(__.select('target')).by(__.select('action'))
+        instrumentation.capture(query)
         return {
             'statusCode': 200,
-            'body': str(query)
+            'body': paging.page(query, limit, cursor, convert = path, sortKey = sortKey)
         }
     except Exception as e:
         return {
@@ -35,6 +54,7 @@ def relatedUsers(player, playerAttribute):
         }
 
 
+@instrumentation.instrumented
 def handler(event, context):
     if event['queryStringParameters'] is not None:
         input = {
@@ -49,7 +69,10 @@ def handler(event, context):
     validationResult =  validation.validate(input, required = ['player', 'playerAttribute'])
 
     if validationResult[0] is True:
-        return relatedUsers(input['player'], input['playerAttribute'])
+        # spans every player, so tagged with the endpoint rather than players;
+        # see interactions.cacheTags()
+        params = {field: validationResult[1].get(field) for field in ['player', 'playerAttribute', 'limit', 'cursor', 'window']}
+        return resultcache.response('relatedUsers', params, lambda: relatedUsers(input['player'], input['playerAttribute'], validationResult[1].get('limit'), validationResult[1].get('cursor'), validationResult[1].get('window')), [resultcache.endpointTag('relatedUsers')])
     else:
         return {
             'statusCode': 400,
@@ -0,0 +1,126 @@
+from __future__  import print_function  # Python 2/3 compatibility
+
+
+from gremlin_python import statics
+from gremlin_python.process.graph_traversal import __
+from gremlin_python.process.strategies import *
+from gremlin_python.process.traversal import T
+from gremlin_python.process.traversal import P
+import base64
+import json
+import os
+import time
+import actionprofile
+import connection
+import instrumentation
+import serializer
+import validation
+
+
+g = connection.reader
+
+maxPlayers = int(os.environ.get('BatchMaxPlayers', '10000'))
+
+# Players evaluated per traversal. Chunks stop being started once less than
+# TriadicClosureTimeMargin milliseconds (plus the time the last chunk took) are
+# left before the function times out; the remaining players are returned as
+# unprocessed so the caller can send them again.
+chunkSize = int(os.environ.get('TriadicClosureChunkSize', '200'))
+timeMargin = float(os.environ.get('TriadicClosureTimeMargin', '2000'))
+
+# For each player and each of the actions the player took, the players it
+# interacted with that took the same action. The actions are read from the
+# act_ properties of both players, or their buckets covering `window`, so no
+# action vertex is traversed.
+def triadicClosureChunk(players, actions, window = None):
+    names = [actionprofile.propertyNames(action, window) for action in actions]
+    read = [name for actionNames in names for name in actionNames]
+    query = g.V(*players).hasLabel('player').where(actionprofile.tookAny(actions, window)).as_('player')    \
+        .out('interaction_edge').where(actionprofile.tookAny(actions, window))                             \
+        .project('player', 'bad_actor', 'playerActions', 'badActorActions')                                \
+        .by(__.select('player').id())                                                                      \
+        .by(T.id)                                                                                          \
+        .by(__.select('player').valueMap(*read))                                                           \
+        .by(__.valueMap(*read))
+    instrumentation.capture(query)
+    results = {}
+    for row in query.toList():
+        for action, actionNames in zip(actions, names):
+            if took(row['playerActions'], actionNames) and took(row['badActorActions'], actionNames):
+                results.setdefault(row['player'], {}).setdefault(action, []).append(row['bad_actor'])
+    for found in results.values():
+        for badActors in found.values():
+            badActors.sort()
+    return results
+
+def took(valueMap, names):
+    return sum(valueMap.get(name, [0])[0] for name in names) > 0
+
+def remainingMillis(context):
+    if context is None or not hasattr(context, 'get_remaining_time_in_millis'):
+        return float('inf')
+    return context.get_remaining_time_in_millis()
+
+def triadicClosureBatch(players, actions, context = None, window = None):
+    try:
+        players = list(dict.fromkeys(players))
+        actions = list(dict.fromkeys(actions))
+        items = {}
+        done = 0
+        elapsed = 0
+        while done < len(players) and remainingMillis(context) > timeMargin + elapsed:
+            chunk = players[done:done + chunkSize]
+            started = time.monotonic()
+            found = triadicClosureChunk(chunk, actions, window)
+            elapsed = (time.monotonic() - started) * 1000
+            for player in chunk:
+                items[player] = found.get(player, {})
+            done += len(chunk)
+        return {
+            'statusCode': 200,
+            'body': json.dumps({
+                'items': items,
+                'unprocessed': players[done:]
+            }, separators = serializer.separators)
+        }
+    except Exception as e:
+        return {
+            'statusCode': 400,
+            'body': str(e)
+        }
+
+@instrumentation.instrumented
+def handler(event, context):
+    body = event.get('body') or ''
+    if event.get('isBase64Encoded'):
+        body = base64.b64decode(body).decode('utf-8')
+
+    try:
+        input = json.loads(body)
+    except ValueError as e:
+        return {
+            'statusCode': 400,
+            'body': 'body must be a JSON object: ' + str(e)
+        }
+
+    if not isinstance(input, dict):
+        return {
+            'statusCode': 400,
+            'body': 'body must be a JSON object with players and actions'
+        }
+
+    validationResult = validation.validate(input, ['players', 'actions'], exists = False)
+
+    if validationResult[0] is True:
+        document = validationResult[1]
+        if len(document['players']) > maxPlayers:
+            return {
+                'statusCode': 400,
+                'body': 'at most ' + str(maxPlayers) + ' players per request'
+            }
+        return triadicClosureBatch(document['players'], document['actions'], context, document.get('window'))
+    else:
+        return {
+            'statusCode': 400,
+            'body': str(validationResult[0])
+        }
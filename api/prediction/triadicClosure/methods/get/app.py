@@ -2,30 +2,41 @@ from __future__  import print_function  # Python 2/3 compatibility
 
 
 from gremlin_python import statics
-from gremlin_python.structure.graph import Graph
 from gremlin_python.process.graph_traversal import __
 from gremlin_python.process.strategies import *
-from gremlin_python.driver.driver_remote_connection import DriverRemoteConnection
 from gremlin_python.process.traversal import T
 from gremlin_python.process.traversal import P
 import json
 import os
+import actionprofile
+import connection
+import instrumentation
+import paging
+import resultcache
 import validation
 
 
-neptuneEndpoint = os.environ['NeptuneEndpoint']
-neptuneEndpoint = "wss://" + neptuneEndpoint + ":8182/gremlin"
+g = connection.reader
 
-graph = Graph()
-remoteConn = DriverRemoteConnection(neptuneEndpoint,'g')
-g = graph.traversal().withRemote(remoteConn)
+# A player with more interaction neighbours than this has its results tagged
+# with the action instead, which any write of the action invalidates.
+maxNeighbourTags = int(os.environ.get('TriadicClosureMaxTags', '1000'))
 
-def triadicClosure(player, action):
+def cacheTags(player, action):
+    # a neighbour's write of the action changes the result as much as the
+    # player's own, so the result is tagged with the neighbours too
+    neighbours = g.V(player).out('interaction_edge').dedup().limit(maxNeighbourTags + 1).id().toList()
+    if len(neighbours) > maxNeighbourTags:
+        return [player, resultcache.endpointTag('triadicClosure', action)]
+    return [player] + neighbours
+
+def triadicClosure(player, action, limit = None, cursor = None, columnar = False, window = None):
     try:
-        query = g.V(player).out('interaction_edge').as_('bad_actors').where(__.out('action_edge').hasId(action).in_('action_edge').hasId(player)).toList()
+        query = g.V(player).where(actionprofile.took(action, window)).out('interaction_edge').where(actionprofile.took(action, window)).order().by(T.id)
+        instrumentation.capture(query)
         return {
             'statusCode': 200,
-            'body': str(query)
+            'body': paging.page(query, limit, cursor, columnar = columnar)
         }
     except Exception as e:
         return {
@@ -34,6 +45,7 @@ def triadicClosure(player, action):
         }
 
 
+@instrumentation.instrumented
 def handler(event, context):
     if event['queryStringParameters'] is not None:
         input = {
@@ -48,7 +60,9 @@ def handler(event, context):
     validationResult =  validation.validate(input, ['player','action'])
 
     if validationResult[0] is True:
-        return triadicClosure(input['player'],input['action'])
+        document = validationResult[1]
+        params = {field: document.get(field) for field in ['player', 'action', 'limit', 'cursor', 'format', 'window']}
+        return resultcache.response('triadicClosure', params, lambda: triadicClosure(input['player'], input['action'], document.get('limit'), document.get('cursor'), document['format'] == 'columnar', document.get('window')), lambda: cacheTags(input['player'], input['action']))
     else:
         return {
             'statusCode': 400,
@@ -0,0 +1,100 @@
+"""
+One Lambda function for every API route.
+
+API Gateway sends every route to router.handler, which dispatches on the
+event's `httpMethod` and `resource` to the handler of the route under
+`api/<resource>/methods/<verb>/app.py`. A route's module is imported the first
+time the route is called, so a cold start only loads the code its route needs.
+All routes share the layer modules, so one warm container keeps one Gremlin
+connection, one set of compiled validators and one prediction cache for all of
+them.
+
+The function's timeout is the longest any route needs (the batch routes). The
+other routes keep the 3 second budget they had as functions of their own
+(`RouteTimeout`): the context a handler is given reports the time left in its
+route's budget, and every Gremlin request it sends carries an
+`evaluationTimeout` that ends with the budget, so the server stops a runaway
+traversal instead of letting a cheap route hold the container for the
+function's whole timeout.
+"""
+
+import importlib.util
+import os
+import time
+
+import connection
+
+root = os.path.dirname(os.path.abspath(__file__))
+
+routes = {
+    ('PUT', '/data/player/{player}'): 'player/methods/put',
+    ('POST', '/data/player/{player}'): 'player/methods/post',
+    ('GET', '/data/player/{player}'): 'player/methods/get',
+    ('DELETE', '/data/player/{player}'): 'player/methods/delete',
+    ('PUT', '/data/campaign/{campaign}'): 'campaign/methods/put',
+    ('POST', '/data/campaign/{campaign}'): 'campaign/methods/post',
+    ('DELETE', '/data/campaign/{campaign}'): 'campaign/methods/delete',
+    ('GET', '/data/deletion/{vertex}'): 'deletion/methods/get',
+    ('PUT', '/data/player/{player}/interaction'): 'player/interaction/methods/put',
+    ('GET', '/data/player/{player}/interaction'): 'player/interaction/methods/get',
+    ('GET', '/data/player/{player}/relationship'): 'player/relationship/methods/get',
+    ('PUT', '/data/interaction/batch'): 'interaction/batch/methods/put',
+    ('GET', '/prediction/collaborativeFilter'): 'prediction/collaborativeFilter/methods/get',
+    ('GET', '/prediction/triadicClosure'): 'prediction/triadicClosure/methods/get',
+    ('POST', '/prediction/triadicClosure/batch'): 'prediction/triadicClosure/batch/methods/post',
+    ('GET', '/prediction/badActors'): 'prediction/badActors/methods/get',
+    ('GET', '/prediction/relatedUsers'): 'prediction/relatedUsers/methods/get',
+    ('POST', '/prediction/cohorts'): 'prediction/cohorts/methods/post'
+}
+
+# seconds each route may run; routes not listed get `RouteTimeout`
+routeTimeouts = {
+    ('PUT', '/data/interaction/batch'): 28,
+    ('POST', '/prediction/triadicClosure/batch'): 28
+}
+defaultTimeout = float(os.environ.get('RouteTimeout', '3'))
+
+handlers = {}
+
+
+class RouteContext(object):
+    """The Lambda context, with the time left cut to the route's budget."""
+
+    def __init__(self, context, seconds):
+        self.context = context
+        self.deadline = time.monotonic() + seconds
+
+    def get_remaining_time_in_millis(self):
+        remaining = (self.deadline - time.monotonic()) * 1000
+        if hasattr(self.context, 'get_remaining_time_in_millis'):
+            remaining = min(remaining, self.context.get_remaining_time_in_millis())
+        return max(0, int(remaining))
+
+    def __getattr__(self, name):
+        return getattr(self.context, name)
+
+
+def routeHandler(route):
+    handler = handlers.get(route)
+    if handler is None:
+        directory = routes[route]
+        # every route's module is called app, so each gets its own name
+        spec = importlib.util.spec_from_file_location('routes.' + directory.replace('/', '.'), os.path.join(root, directory, 'app.py'))
+        module = importlib.util.module_from_spec(spec)
+        spec.loader.exec_module(module)
+        handler = handlers[route] = module.handler
+    return handler
+
+def handler(event, context):
+    route = (event.get('httpMethod'), event.get('resource'))
+    if route not in routes:
+        return {
+            'statusCode': 404,
+            'body': 'no route for ' + str(event.get('httpMethod')) + ' ' + str(event.get('resource'))
+        }
+    routeContext = RouteContext(context, routeTimeouts.get(route, defaultTimeout))
+    connection.deadline = routeContext.deadline
+    try:
+        return routeHandler(route)(event, routeContext)
+    finally:
+        connection.deadline = None
@@ -0,0 +1,358 @@
+"""
+End-to-end benchmark for the API handlers, without deploying the stack.
+
+Calls each handler(event, context) in-process with API Gateway proxy events,
+as api/router.py dispatches them, against a Gremlin Server whose in-memory
+TinkerGraph stands in for Neptune. The harness can start the server itself and
+load `data/*.csv` into it. It then
+replays a request mix and reports, for each route, p50/p95/p99 latency, Gremlin
+round trips (from connection.stats(), writer and readers together) and bytes returned.
+
+    # start Gremlin Server in Docker, load data/ and replay 2000 synthetic requests
+    python benchmarks/harness.py --server docker --load --requests 2000 --output bench.json
+
+    # replay recorded requests against a running server, compared to a baseline
+    python benchmarks/harness.py --mix requests.jsonl --output bench.json --baseline main.json
+
+A mix is a JSON lines file. Each line is either an API Gateway proxy event
+(`httpMethod`, `resource`, `pathParameters`, `queryStringParameters`, `body`),
+or the same fields with `route`, e.g. "GET /prediction/badActors", in place of
+`httpMethod` and `resource`. `--write-mix` saves the synthetic mix in this form.
+
+With `--baseline`, the exit status is 1 if the p95 latency or round trips per
+request of any route grew by more than `--tolerance` percent.
+"""
+
+import argparse
+import csv
+import json
+import math
+import os
+import platform
+import random
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+
+root = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+sys.path.insert(0, os.path.join(root, 'layers'))
+
+# routes replayed, with the Lambda timeout in seconds each had before the
+# router (api/router.py) served them all
+routes = {
+    'GET /data/player/{player}': 3,
+    'POST /data/player/{player}': 3,
+    'GET /data/player/{player}/interaction': 3,
+    'PUT /data/player/{player}/interaction': 3,
+    'GET /data/player/{player}/relationship': 3,
+    'PUT /data/interaction/batch': 28,
+    'GET /prediction/collaborativeFilter': 3,
+    'GET /prediction/triadicClosure': 3,
+    'POST /prediction/triadicClosure/batch': 28,
+    'GET /prediction/badActors': 3,
+    'GET /prediction/relatedUsers': 3
+}
+
+# share of each route in the synthetic mix, roughly what the dashboards and
+# game servers send
+weights = {
+    'GET /data/player/{player}': 20,
+    'POST /data/player/{player}': 5,
+    'GET /data/player/{player}/interaction': 15,
+    'PUT /data/player/{player}/interaction': 15,
+    'GET /data/player/{player}/relationship': 5,
+    'PUT /data/interaction/batch': 2,
+    'GET /prediction/collaborativeFilter': 15,
+    'GET /prediction/triadicClosure': 10,
+    'POST /prediction/triadicClosure/batch': 2,
+    'GET /prediction/badActors': 5,
+    'GET /prediction/relatedUsers': 5
+}
+
+# the CSV labels and properties as the API names them
+loadLabels = 'Interactions=interaction_edge,EngagedIn=action_edge,CustomerMarketingInteractions=campaign_edge'
+loadProperties = 'iterations=count'
+
+badActions = ['action_sharepii', 'action_report', 'action_badlanguage', 'action_badname', 'action_badimage']
+
+
+class Context(object):
+    """The parts of the Lambda context object the handlers use."""
+
+    def __init__(self, route, timeout):
+        self.function_name = route
+        self.aws_request_id = str(random.getrandbits(64))
+        self.deadline = time.monotonic() + timeout
+
+    def get_remaining_time_in_millis(self):
+        return int((self.deadline - time.monotonic()) * 1000)
+
+
+def loadHandlers():
+    # the handlers as the router dispatches to them
+    sys.path.insert(0, os.path.join(root, 'api'))
+    import router
+    return {route: router.routeHandler(tuple(route.split(' ', 1))) for route in routes}
+
+def event(request):
+    """An API Gateway proxy event for a mix entry."""
+    if 'route' in request:
+        method, _, resource = request['route'].partition(' ')
+    else:
+        method, resource = request['httpMethod'], request['resource']
+    path = resource
+    for name, value in (request.get('pathParameters') or {}).items():
+        path = path.replace('{' + name + '}', value)
+    return {
+        'resource': resource,
+        'path': path,
+        'httpMethod': method,
+        'headers': {'Content-Type': 'application/json'},
+        'pathParameters': request.get('pathParameters'),
+        'queryStringParameters': request.get('queryStringParameters'),
+        'body': request.get('body'),
+        'isBase64Encoded': False,
+        'requestContext': {'resourcePath': resource, 'httpMethod': method, 'stage': 'bench'}
+    }
+
+def routeOf(request):
+    return request['route'] if 'route' in request else request['httpMethod'] + ' ' + request['resource']
+
+def readIds(path):
+    with open(path, newline = '') as f:
+        return [row['~id'] for row in csv.DictReader(f)]
+
+def readPairs(path):
+    with open(path, newline = '') as f:
+        return [(row['~from'], row['~to']) for row in csv.DictReader(f)]
+
+def syntheticMix(dataDir, count, rng):
+    players = readIds(os.path.join(dataDir, 'user_vertices.csv'))
+    pairs = readPairs(os.path.join(dataDir, 'interaction_edges.csv'))
+    names = list(weights)
+    mix = []
+    for route in rng.choices(names, [weights[name] for name in names], k = count):
+        player = rng.choice(players)
+        source, target = rng.choice(pairs)
+        request = {'route': route, 'pathParameters': None, 'queryStringParameters': None, 'body': None}
+        if route == 'GET /data/player/{player}/relationship':
+            request['pathParameters'] = {'player': player}
+            request['queryStringParameters'] = {'relationshipOrder': str(rng.choice([1, 2, 3]))}
+        elif route == 'GET /data/player/{player}/interaction':
+            request['pathParameters'] = {'player': player}
+            request['queryStringParameters'] = {'limit': '100'}
+        elif route == 'GET /data/player/{player}':
+            request['pathParameters'] = {'player': player}
+        elif route == 'POST /data/player/{player}':
+            request['pathParameters'] = {'player': player}
+            request['queryStringParameters'] = {'playerAttribute': rng.choice(['ea_reputation', 'ea_altruism', 'ea_mischief']), 'incrementBy': str(rng.choice([-1, 1]))}
+        elif route == 'PUT /data/player/{player}/interaction':
+            request['pathParameters'] = {'player': source}
+            request['queryStringParameters'] = {'action': rng.choice(['action_chat', 'action_partyjoin', 'action_endorse', 'action_report']), 'targetPlayer': target}
+        elif route == 'PUT /data/interaction/batch':
+            request['body'] = '\n'.join(json.dumps({'player': a, 'action': 'action_chat', 'targetPlayer': b}) for a, b in rng.sample(pairs, 50))
+        elif route == 'GET /prediction/collaborativeFilter':
+            request['queryStringParameters'] = {'player': player, 'limit': '10'}
+        elif route == 'GET /prediction/triadicClosure':
+            request['queryStringParameters'] = {'player': player, 'action': rng.choice(badActions)}
+        elif route == 'POST /prediction/triadicClosure/batch':
+            request['body'] = json.dumps({'players': rng.sample(players, 100), 'actions': badActions})
+        elif route == 'GET /prediction/badActors':
+            request['queryStringParameters'] = {'player': source, 'targetPlayer': target, 'action': rng.choice(badActions), 'limit': '100'}
+        elif route == 'GET /prediction/relatedUsers':
+            request['queryStringParameters'] = {'player': player, 'playerAttribute': 'ea_reputation', 'limit': '100'}
+        mix.append(request)
+    return mix
+
+def readMix(path):
+    with open(path) as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+def percentile(values, p):
+    # nearest rank
+    ordered = sorted(values)
+    return ordered[max(0, math.ceil(p / 100.0 * len(ordered)) - 1)]
+
+def waitForPort(host, port, timeout):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            with socket.create_connection((host, port), timeout = 1):
+                return
+        except OSError:
+            time.sleep(1)
+    raise RuntimeError('Gremlin Server did not start on %s:%d' % (host, port))
+
+def startServer(spec, port):
+    """Starts Gremlin Server and returns a function that stops it."""
+    if spec == 'docker':
+        container = subprocess.check_output(['docker', 'run', '--rm', '-d', '-p', '%d:8182' % port, 'tinkerpop/gremlin-server:3.5.8']).decode().strip()
+        stop = lambda: subprocess.call(['docker', 'stop', container], stdout = subprocess.DEVNULL)
+    else:
+        process = subprocess.Popen(spec, shell = True)
+        stop = lambda: (process.terminate(), process.wait())
+    try:
+        waitForPort('localhost', port, 120)
+        # the port opens before the script engine has warmed up
+        time.sleep(5)
+    except Exception:
+        stop()
+        raise
+    return stop
+
+def load(endpoint, files, workers):
+    with tempfile.TemporaryDirectory() as scratch:
+        subprocess.check_call([
+            sys.executable, os.path.join(root, 'tools', 'bulkload.py'), *files,
+            '--endpoint', endpoint, '--workers', str(workers),
+            '--labels', loadLabels, '--properties', loadProperties,
+            '--checkpoint', os.path.join(scratch, 'checkpoint.json')
+        ])
+    import actionprofile
+    import reputation
+    actionprofile.backfill()
+    reputation.rebuild()
+
+def requests():
+    import connection
+
+    # the writer's and every reader's requests, so reads routed to the replicas count too
+    stats = connection.stats()
+    return stats['requests'] + sum(reader['requests'] for reader in stats['readers'])
+
+def run(handlers, mix, warmup):
+    results = {}
+    for i, request in enumerate(mix):
+        route = routeOf(request)
+        if route not in handlers:
+            raise ValueError('no handler for ' + route)
+        context = Context(route, routes.get(route, 28))
+        before = requests()
+        started = time.perf_counter()
+        try:
+            response = handlers[route](event(request), context)
+        except Exception as e:
+            response = {'statusCode': 500, 'body': str(e)}
+        elapsed = (time.perf_counter() - started) * 1000
+        if i < warmup:
+            continue
+        result = results.setdefault(route, {'latencies': [], 'roundTrips': 0, 'bytes': 0, 'errors': 0, 'cacheHits': 0})
+        result['latencies'].append(elapsed)
+        result['roundTrips'] += requests() - before
+        result['bytes'] += len((response.get('body') or '').encode('utf-8'))
+        result['errors'] += response.get('statusCode', 500) >= 400
+        result['cacheHits'] += (response.get('headers') or {}).get('X-Cache') == 'hit'
+    return results
+
+def summary(results):
+    routes = {}
+    for route, result in sorted(results.items()):
+        latencies = result['latencies']
+        count = len(latencies)
+        routes[route] = {
+            'requests': count,
+            'errors': result['errors'],
+            'p50Ms': round(percentile(latencies, 50), 3),
+            'p95Ms': round(percentile(latencies, 95), 3),
+            'p99Ms': round(percentile(latencies, 99), 3),
+            'meanMs': round(sum(latencies) / count, 3),
+            'roundTrips': result['roundTrips'],
+            'roundTripsPerRequest': round(result['roundTrips'] / count, 3),
+            'bytes': result['bytes'],
+            'bytesPerRequest': round(result['bytes'] / count, 1),
+            'cacheHits': result['cacheHits']
+        }
+    return routes
+
+def compare(report, baseline, tolerance):
+    """Prints the change of each route against `baseline` and returns the regressed routes."""
+    regressed = []
+    for route, current in report['routes'].items():
+        previous = baseline.get('routes', {}).get(route)
+        if previous is None:
+            continue
+        changes = []
+        for field in ['p95Ms', 'roundTripsPerRequest']:
+            if previous[field]:
+                change = (current[field] - previous[field]) / previous[field] * 100
+                changes.append('%s %+.1f%%' % (field, change))
+                if change > tolerance:
+                    regressed.append((route, field, change))
+        print('%-44s %s' % (route, ', '.join(changes)))
+    for route, field, change in regressed:
+        print('REGRESSION %s: %s %+.1f%%' % (route, field, change))
+    return regressed
+
+def main():
+    parser = argparse.ArgumentParser(description = 'replay API requests against the handlers and report latency, round trips and bytes')
+    parser.add_argument('--endpoint', default = os.environ.get('NeptuneEndpoint', 'ws://localhost:8182/gremlin'))
+    parser.add_argument('--server', help = "start Gremlin Server: 'docker', or a command such as 'bin/gremlin-server.sh conf/gremlin-server.yaml'")
+    parser.add_argument('--load', nargs = '*', help = 'load CSV files (default data/*.csv) before the run')
+    parser.add_argument('--load-workers', type = int, default = 8)
+    parser.add_argument('--mix', help = 'JSON lines file of requests to replay (default: a synthetic mix built from data/)')
+    parser.add_argument('--write-mix', help = 'save the synthetic mix to this file')
+    parser.add_argument('--requests', type = int, default = 1000, help = 'size of the synthetic mix')
+    parser.add_argument('--warmup', type = int, default = 50, help = 'requests run before measuring')
+    parser.add_argument('--seed', type = int, default = 1234)
+    parser.add_argument('--no-cache', action = 'store_true', help = 'disable the prediction cache')
+    parser.add_argument('--output', help = 'write the report to this JSON file')
+    parser.add_argument('--baseline', help = 'report from an earlier run to compare against')
+    parser.add_argument('--tolerance', type = float, default = 20, help = 'percent growth counted as a regression')
+    args = parser.parse_args()
+
+    os.environ['NeptuneEndpoint'] = args.endpoint
+    # the handlers' metric lines would drown the report
+    os.environ.setdefault('Instrumentation', 'off')
+    if args.no_cache:
+        os.environ['PredictionCacheSize'] = '0'
+    dataDir = os.path.join(root, 'data')
+    rng = random.Random(args.seed)
+
+    stop = startServer(args.server, int(args.endpoint.rsplit(':', 1)[1].split('/')[0])) if args.server else None
+    try:
+        if args.load is not None:
+            load(args.endpoint, args.load or sorted(os.path.join(dataDir, name) for name in os.listdir(dataDir) if name.endswith('.csv')), args.load_workers)
+
+        mix = readMix(args.mix) if args.mix else syntheticMix(dataDir, args.requests + args.warmup, rng)
+        if args.write_mix:
+            with open(args.write_mix, 'w') as f:
+                f.write(''.join(json.dumps(request) + '\n' for request in mix))
+
+        import connection
+        handlers = loadHandlers()
+        began = time.monotonic()
+        results = run(handlers, mix, args.warmup)
+        report = {
+            'endpoint': args.endpoint,
+            'mix': args.mix or 'synthetic',
+            'seed': args.seed,
+            'requests': sum(len(result['latencies']) for result in results.values()),
+            'seconds': round(time.monotonic() - began, 3),
+            'python': platform.python_version(),
+            'routes': summary(results),
+            'connection': connection.stats()
+        }
+    finally:
+        if stop is not None:
+            stop()
+
+    print('%-44s %8s %9s %9s %9s %11s %11s' % ('route', 'requests', 'p50 ms', 'p95 ms', 'p99 ms', 'trips/req', 'bytes/req'))
+    for route, row in report['routes'].items():
+        print('%-44s %8d %9.2f %9.2f %9.2f %11.2f %11.1f' % (route, row['requests'], row['p50Ms'], row['p95Ms'], row['p99Ms'], row['roundTripsPerRequest'], row['bytesPerRequest']))
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent = 2, default = str)
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        if compare(report, baseline, args.tolerance):
+            return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,82 @@
+"""
+Benchmark for layers/serializer.py on the sample dataset.
+
+Builds the results the handlers receive from gremlin_python (elementMap() dicts
+keyed by T and Direction, paths and a groupCount() map) from data/*.csv, then
+compares str(), which the handlers used to return, with serializer.dumps() and
+the columnar form. Reports time per call and body size. With `--stdlib` the
+JSON is written by json.dumps() rather than orjson.
+
+    python benchmarks/serializerbench.py [--repeat 20] [--stdlib]
+"""
+
+import argparse
+import glob
+import os
+import sys
+import timeit
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'layers'))
+
+from gremlin_python.process.traversal import Direction
+from gremlin_python.process.traversal import T
+from gremlin_python.structure.graph import Path
+
+import neptunecsv
+import serializer
+
+dataDir = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'data')
+
+
+def elementMaps():
+    vertices = {}
+    with neptunecsv.Reader(os.path.join(dataDir, 'user_vertices.csv')) as reader:
+        for vertexId, label, properties in reader:
+            vertices[vertexId] = {T.id: vertexId, T.label: label, **{key: value for key, value in properties.items() if key.startswith(('ea_', 'stat_'))}}
+    edges = []
+    with neptunecsv.Reader(os.path.join(dataDir, 'interaction_edges.csv')) as reader:
+        for edgeId, label, fromId, toId, properties in reader:
+            edges.append({
+                T.id: edgeId,
+                T.label: label,
+                Direction.IN: {T.id: toId, T.label: 'player'},
+                Direction.OUT: {T.id: fromId, T.label: 'player'},
+                **properties
+            })
+    return list(vertices.values()), edges
+
+def main():
+    parser = argparse.ArgumentParser(description = 'compare str() with the JSON serializer')
+    parser.add_argument('--repeat', type = int, default = 20)
+    parser.add_argument('--stdlib', action = 'store_true', help = 'write JSON with json.dumps() even if orjson is installed')
+    args = parser.parse_args()
+    if args.stdlib:
+        serializer.orjson = None
+
+    players, edges = elementMaps()
+    paths = [Path([], [edge[Direction.OUT][T.id], edge[T.label], edge[Direction.IN][T.id]]) for edge in edges]
+    groupCount = {}
+    for edge in edges:
+        groupCount[edge[Direction.IN][T.id]] = groupCount.get(edge[Direction.IN][T.id], 0) + 1
+
+    cases = {
+        'player elementMaps (%d)' % len(players): players,
+        'interaction elementMaps (%d)' % len(edges): edges,
+        'paths (%d)' % len(paths): paths,
+        'groupCount (%d keys)' % len(groupCount): groupCount
+    }
+    print('%-32s %-10s %12s %12s' % ('result', 'encoding', 'ms/call', 'bytes'))
+    for name, value in cases.items():
+        encodings = {
+            'str': lambda: str(value),
+            'json': lambda: serializer.dumps(value)
+        }
+        if isinstance(value, list) and isinstance(value[0], dict):
+            encodings['columnar'] = lambda: serializer.text(serializer.columnar(value))
+        for encoding, encode in encodings.items():
+            seconds = min(timeit.repeat(encode, number = 1, repeat = args.repeat))
+            print('%-32s %-10s %12.2f %12d' % (name, encoding, seconds * 1000, len(encode())))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,132 @@
+"""
+Micro-benchmark for layers/validation.py.
+
+Compares the per-request cost of the baseline validate(), which built its
+schema and a Validator on every call and printed the document, with the
+precompiled validators. Existence checks are served from the validation cache
+on both sides so no Neptune connection is needed.
+
+    python benchmarks/validationbench.py [--iterations 20000]
+"""
+
+import argparse
+import contextlib
+import os
+import sys
+import timeit
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'layers'))
+os.environ.setdefault('NeptuneEndpoint', 'ws://localhost:8182/gremlin')
+os.environ.setdefault('ValidationCacheTtl', '86400')
+
+from cerberus import Validator
+
+import validation
+
+# representative inputs for the cheap GET routes and the interaction PUT
+routes = {
+    'GET player': ({'player': 'p1'}, ['player'], None),
+    'GET interaction': ({'player': 'p1', 'bidirectional': 'true'}, None, None),
+    'GET collaborativeFilter': ({'player': 'p1'}, ['player'], None),
+    'PUT interaction': ({'player': 'p1', 'targetPlayer': 'p2', 'action': 'action_chat'}, ['action'], None),
+    'POST player': ({'player': 'p1', 'playerAttribute': 'ea_reputation', 'incrementBy': '-1'}, ['playerAttribute', 'incrementBy'], None)
+}
+
+
+def existence(message):
+    # the baseline's check_with, answered from the validation cache instead
+    # of a g.V(id).next() per field
+    def check(field, value, error):
+        if value in validation.missingVertices([value]):
+            error(field, message)
+    return check
+
+playerCheck = existence('player does not exist')
+campaignCheck = existence('campaign does not exist')
+
+
+def legacyValidate(input = None, required = None, dependencies = None):
+    # the baseline validate(): its schema and a Validator built on every call
+    v = Validator()
+    v.allow_unknown = True
+    to_bool = lambda v: v.lower() in ('true', '1')
+    schema = {
+        'player': {
+            'type': 'string',
+            'check_with': playerCheck
+        },
+        'targetPlayer': {
+            'type': 'string',
+            'check_with': playerCheck,
+        },
+        'action': {
+            'type': 'string',
+            'allowed': ['action_chat', 'action_sharepii', 'action_partyjoin', 'action_randomheal', 'action_grief', 'action_badname', 'action_harass', 'action_stalk', 'action_badlanguage', 'action_endorse', 'action_report', 'action_badimage']
+        },
+        'playerAttribute': {
+            'type': 'string',
+            'allowed': ['ea_reputation', 'ea_altruism','ea_duty','ea_mischief','ea_malice','ea_atrisk']
+        },
+        'playerStat': {
+            'type': 'string',
+            'allowed': ['stat_uuid','status','stat_joinedDate','stat_lastPlayed','stat_totalSkinPurchases']
+        },
+        'incrementBy': {
+            'type': 'integer',
+            'coerce': int
+        },
+        'bidirectional': {
+            'type': 'boolean',
+            'coerce': (str, to_bool),
+            'default': False
+        },
+        'relationshipOrder': {
+            'type': 'integer',
+            'default': 1
+        },
+        'campaign': {
+            'type': 'string',
+            'check_with': campaignCheck
+        },
+        'campaignAction': {
+            'type': 'string',
+            'allowed': ['campaign_login', 'campaign_emailOpened', 'campaign_linkClicked']
+        },
+        'campaignAttribute': {
+            'type': 'string',
+            'allowed': ['stat_totalEmailOpened','stat_messagesSent','stat_messagesDelivered','stat_dailyActive','stat_newPlayers']
+        }
+    }
+    if required:
+        for item in required:
+            schema[item]['required'] = True
+    if dependencies:
+        for item in dependencies:
+            schema[item]['dependencies'] = dependencies[item]
+    if v.validate(input, schema) is True:
+        print([True, v.document, v.normalized])
+        return [True, v.document, v.normalized]
+    print(v.errors)
+    return [v.errors]
+
+
+def measure(fn, iterations):
+    with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+        return min(timeit.repeat(fn, number=iterations, repeat=3)) / iterations
+
+
+def main():
+    parser = argparse.ArgumentParser(description='validation cost per request, before and after')
+    parser.add_argument('--iterations', type=int, default=20000)
+    args = parser.parse_args()
+
+    validation.remember(['p1', 'p2'])
+    print('%-26s %14s %14s %8s' % ('route', 'rebuild (us)', 'compiled (us)', 'speedup'))
+    for route, (input, required, dependencies) in routes.items():
+        before = measure(lambda: legacyValidate(dict(input), required, dependencies), args.iterations)
+        after = measure(lambda: validation.validate(dict(input), required, dependencies), args.iterations)
+        print('%-26s %14.1f %14.1f %7.1fx' % (route, before * 1e6, after * 1e6, before / after))
+
+
+if __name__ == '__main__':
+    main()
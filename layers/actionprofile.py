@@ -0,0 +1,85 @@
+"""
+Per-player action counts kept on the player vertex.
+
+Every player has an `action_edge` to each action vertex it has taken, and the
+popular actions have an in edge from a large share of all players. Queries that
+hop player -> action -> player therefore scan those supernodes. Instead,
+interactionUpsert() also increments an `act_<name>` property on the player
+(`act_chat` for `action_chat`), and the prediction queries filter on it with
+took(). backfill() sets the properties from the existing `action_edge` counts,
+e.g. after a bulk load. The properties have hour and day buckets (see
+timebuckets.py), so took() can also be limited to a recent window.
+"""
+
+import logging
+
+from gremlin_python.process.graph_traversal import __
+from gremlin_python.process.traversal import T
+from gremlin_python.process.traversal import P
+from gremlin_python.process.traversal import TextP
+from gremlin_python.process.traversal import Cardinality
+
+import connection
+import timebuckets
+
+g = connection.g
+
+logger = logging.getLogger(__name__)
+
+prefix = 'act_'
+
+
+def propertyName(action):
+    return prefix + (action[len('action_'):] if action.startswith('action_') else action)
+
+def propertyNames(action, window = None):
+    """The properties to sum for the number of times a player took `action` within `window`."""
+    if window is None:
+        return [propertyName(action)]
+    return [bucket for bucket, age in timebuckets.buckets(propertyName(action), window)]
+
+def took(action, window = None):
+    """Filter for players that have taken `action` at least once, within `window` if given."""
+    if window is None:
+        return __.has(propertyName(action), P.gt(0))
+    return timebuckets.within(propertyName(action), window)
+
+def tookAny(actions, window = None):
+    return __.or_(*[took(action, window) for action in actions])
+
+def counters():
+    """The bucketed counters, as timebuckets.compact() takes them: each action on interaction edges and on players."""
+    actions = g.V().hasLabel('action').id().toList()
+    return [(action, False) for action in actions] + [(propertyName(action), True) for action in actions]
+
+def backfill(writeSize = 100):
+    """Sets every player's act_ properties from its action_edge counts. Returns the number of players updated."""
+    def write(players):
+        traversal = g.inject(0)
+        for player in players:
+            names = {propertyName(action): count for action, count in player['counts'].items()}
+            traversal = traversal.V(player['id']).sideEffect(
+                __.properties().hasKey(TextP.startingWith(prefix)).hasKey(TextP.notContaining(timebuckets.separator)).hasKey(P.without(*names)).drop()
+            )
+            for name, count in names.items():
+                traversal = traversal.property(Cardinality.single, name, count)
+        traversal.iterate()
+
+    # one streamed traversal reads the counts of every player, written back
+    # writeSize players at a time as they arrive
+    query = g.V().hasLabel('player').project('id', 'counts')                                       \
+        .by(T.id)                                                                                  \
+        .by(__.outE('action_edge').group().by(__.inV().id()).by(__.values('count').sum()))
+    updated = 0
+    pending = []
+    for chunk in connection.stream(query):
+        pending.extend(chunk)
+        while len(pending) >= writeSize:
+            write(pending[:writeSize])
+            del pending[:writeSize]
+            updated += writeSize
+    if pending:
+        write(pending)
+        updated += len(pending)
+    logger.info('action profiles backfilled for %d players', updated)
+    return updated
@@ -0,0 +1,372 @@
+"""
+Shared Gremlin connection for the API handlers and the validation layer.
+
+The remote connection is opened on first use and then kept for the life of the
+container, so a cold start pays for one websocket handshake and warm invocations
+reuse the same pool. Handlers and validation both use `connection.g`.
+
+A request that cannot be written because the socket has died is sent again on
+a new connection. Once it has gone out, only a read-only traversal is sent
+again after a connection failure: the server may already have applied a write,
+and the counter increments would be counted twice.
+
+Read-only handlers use `connection.reader` instead. `NeptuneReaderEndpoint`
+lists reader endpoints, separated by commas, and their requests go to the
+readers in turn. A reader whose connection fails is skipped for
+`ReaderRetryAfter` seconds (default 30) and the request is retried on the next
+one; with no reader left, reads go to the writer. Without reader endpoints
+`connection.reader` is the writer.
+
+Replicas lag the writer slightly. A read that must see a write the caller has
+just made uses forRead(writtenAt), which returns the writer when `writtenAt`
+(see writtenAt()) is less than `ReplicaLagWindow` seconds ago (default 5).
+"""
+
+import asyncio
+import logging
+import os
+import threading
+import time
+
+from gremlin_python.structure.graph import Graph
+from gremlin_python.driver import client
+from gremlin_python.driver.remote_connection import RemoteConnection
+from gremlin_python.driver.remote_connection import RemoteStrategy
+from gremlin_python.driver.remote_connection import RemoteTraversal
+from gremlin_python.process.strategies import OptionsStrategy
+from gremlin_python.process.traversal import Bytecode
+from gremlin_python.process.traversal import Traversal
+from gremlin_python.process.traversal import Traverser
+
+import instrumentation
+
+try:
+    from aiohttp import ClientError
+except ImportError:
+    ClientError = OSError
+
+logger = logging.getLogger(__name__)
+
+poolSize = int(os.environ.get('NeptunePoolSize', '1'))
+
+readerEndpoints = [endpoint.strip() for endpoint in os.environ.get('NeptuneReaderEndpoint', '').split(',') if endpoint.strip()]
+readerRetryAfter = float(os.environ.get('ReaderRetryAfter', '30'))
+replicaLagWindow = float(os.environ.get('ReplicaLagWindow', '5'))
+
+# Errors raised by the transport when the socket is gone. GremlinServerError is
+# deliberately not here; a server side failure is returned to the caller as is.
+connectionErrors = (OSError, RuntimeError, asyncio.TimeoutError, ClientError)
+
+# steps that change the graph; a traversal without them can be sent again
+writeSteps = frozenset(['addV', 'addE', 'property', 'drop', 'mergeV', 'mergeE'])
+
+# request options the server takes from an OptionsStrategy
+optionKeys = ('evaluationTimeout', 'scriptEvaluationTimeout', 'batchSize', 'requestId', 'userAgent')
+
+# time.monotonic() by which the current request must be done, set by the API
+# router (api/router.py); every Gremlin request is sent with an
+# evaluationTimeout that ends by then
+deadline = None
+
+
+def readOnly(bytecode):
+    """True if no step of the traversal, or of a traversal nested in it, changes the graph."""
+    for instruction in bytecode.step_instructions:
+        if instruction[0] in writeSteps:
+            return False
+        for argument in instruction[1:]:
+            nested = argument.bytecode if isinstance(argument, Traversal) else argument
+            if isinstance(nested, Bytecode) and not readOnly(nested):
+                return False
+    return True
+
+
+def requestOptions(bytecode):
+    options = None
+    for instruction in bytecode.source_instructions:
+        if instruction[0] == 'withStrategies' and isinstance(instruction[1], OptionsStrategy):
+            configuration = instruction[1].configuration
+            options = {key: configuration[key] for key in optionKeys if key in configuration}
+            break
+    if deadline is not None:
+        remaining = max(1, int((deadline - time.monotonic()) * 1000))
+        options = options or {}
+        options['evaluationTimeout'] = min(options.get('evaluationTimeout', remaining), remaining)
+    return options
+
+
+def endpointUrl(endpoint):
+    # a full url (e.g. ws://localhost:8182/gremlin) is used as given so the
+    # handlers can run against a local Gremlin Server
+    if '://' in endpoint:
+        return endpoint
+    return 'wss://' + endpoint + ':8182/gremlin'
+
+
+class PooledConnection(RemoteConnection):
+    """RemoteConnection that opens its pool lazily and reopens it when the socket dies."""
+
+    def __init__(self, url, traversal_source='g', pool_size=1):
+        super(PooledConnection, self).__init__(url, traversal_source)
+        self.poolSize = pool_size
+        self.client = None
+        self.connectTime = None
+        self.connects = 0
+        self.reconnects = 0
+        self.requests = 0
+        # threads share the connection (tools/bulkload.py), so only one of
+        # them opens or replaces the client
+        self.lock = threading.RLock()
+
+    def connect(self):
+        with self.lock:
+            if not self.is_closed():
+                return self.client
+            start = time.perf_counter()
+            with instrumentation.phase('connect'):
+                conn = client.Client(self._url, self._traversal_source, pool_size=self.poolSize)
+                # the driver only handshakes on a connection's first request, send
+                # one on every pooled connection up front so the cost shows up in
+                # connectTime instead of the first query
+                try:
+                    pending = [conn.submit_async(handshake.bytecode) for i in range(self.poolSize)]
+                    for request in pending:
+                        request.result().all().result()
+                except Exception:
+                    conn.close()
+                    raise
+            self.client = conn
+            self.connectTime = time.perf_counter() - start
+            self.connects += 1
+            logger.info('connected to %s in %.3fs (pool size %d)', self._url, self.connectTime, self.poolSize)
+            return conn
+
+    def close(self):
+        with self.lock:
+            if self.client is not None:
+                try:
+                    self.client.close()
+                except Exception as e:
+                    logger.warning('error closing connection: %s', e)
+                self.client = None
+
+    def discard(self, failed):
+        """Closes the client `failed`, unless another thread has already replaced it."""
+        with self.lock:
+            if self.client is failed:
+                self.close()
+
+    def reconnect(self, failed = None):
+        with self.lock:
+            if failed is None or self.client is failed:
+                self.close()
+                self.reconnects += 1
+            return self.connect()
+
+    def send(self, bytecode, conn = None):
+        """
+        Writes the request and returns its ResultSet. The request has not
+        reached the server when the write fails, so it is sent again on a new
+        connection.
+        """
+        conn = self.connect() if conn is None else conn
+        self.requests += 1
+        instrumentation.count('gremlinRequests')
+        options = requestOptions(bytecode)
+        try:
+            return conn.submit(bytecode, request_options = options)
+        except connectionErrors as e:
+            logger.warning('connection to %s failed (%s), reconnecting', self._url, e)
+            return self.reconnect(conn).submit(bytecode, request_options = options)
+
+    def submit(self, bytecode):
+        with instrumentation.phase('traversal'):
+            conn = self.connect()
+            try:
+                results = self.send(bytecode, conn).all().result()
+            except connectionErrors as e:
+                # the server may have applied a write before the connection
+                # failed, and sending it again would count its increments
+                # twice; only reads are sent again
+                self.discard(conn)
+                if not readOnly(bytecode):
+                    raise
+                logger.warning('connection to %s failed (%s), reading again', self._url, e)
+                results = self.send(bytecode).all().result()
+        instrumentation.count('resultItems', sum(getattr(result, 'bulk', 1) for result in results))
+        return RemoteTraversal(iter(results))
+
+    def stream(self, bytecode):
+        """
+        Yields the results of `bytecode` one response message at a time as they
+        arrive, instead of collecting the whole result like submit().
+        """
+        chunks = iter(self.send(bytecode))
+        while True:
+            # only the wait for each response message is traversal time; the
+            # consumer's work between them is timed by its own phase
+            with instrumentation.phase('traversal'):
+                results = next(chunks, None)
+            if results is None:
+                break
+            items = []
+            for result in results:
+                if isinstance(result, Traverser):
+                    items.extend([result.object] * result.bulk)
+                else:
+                    items.append(result)
+            instrumentation.count('resultItems', len(items))
+            yield items
+
+    def is_closed(self):
+        return self.client is None or self.client.is_closed()
+
+
+class ReaderPool(RemoteConnection):
+    """RemoteConnection that spreads requests over the readers and fails over to the next one, then the writer."""
+
+    def __init__(self, urls, writer, traversal_source='g', pool_size=1):
+        super(ReaderPool, self).__init__(urls[0], traversal_source)
+        self.readers = [PooledConnection(url, traversal_source, pool_size) for url in urls]
+        self.writer = writer
+        self.downUntil = [0.0] * len(self.readers)
+        self.turn = 0
+        self.failovers = 0
+
+    def candidates(self):
+        # healthy readers starting from this request's turn, then the writer
+        now = time.time()
+        start, self.turn = self.turn, (self.turn + 1) % len(self.readers)
+        order = [(start + i) % len(self.readers) for i in range(len(self.readers))]
+        return [index for index in order if self.downUntil[index] <= now] + [None]
+
+    def attempt(self, call):
+        for index in self.candidates():
+            if index is None:
+                return call(self.writer)
+            reader = self.readers[index]
+            try:
+                return call(reader)
+            except connectionErrors as e:
+                logger.warning('reader %s failed (%s), skipping it for %ds', reader._url, e, readerRetryAfter)
+                reader.close()
+                self.downUntil[index] = time.time() + readerRetryAfter
+                self.failovers += 1
+
+    def submit(self, bytecode):
+        return self.attempt(lambda conn: conn.submit(bytecode))
+
+    def stream(self, bytecode):
+        # a request can only move to another endpoint until its first results
+        # have arrived, so the first chunk is read inside attempt()
+        def first(conn):
+            chunks = conn.stream(bytecode)
+            return next(chunks, None), chunks
+        items, chunks = self.attempt(first)
+        if items is None:
+            return
+        yield items
+        yield from chunks
+
+    def close(self):
+        for reader in self.readers:
+            reader.close()
+
+    def is_closed(self):
+        return all(reader.is_closed() for reader in self.readers)
+
+
+class LazyTraversalSource(object):
+    """Stands in for `g` at import time; the connection is opened on first use."""
+
+    def __init__(self, factory):
+        self.factory = factory
+
+    def __getattr__(self, name):
+        return getattr(self.factory(), name)
+
+
+graph = Graph()
+handshake = graph.traversal().inject(0)
+remoteConn = None
+source = None
+readerConn = None
+readerSource = None
+
+
+def remote():
+    global remoteConn
+    if remoteConn is None:
+        remoteConn = PooledConnection(endpointUrl(os.environ['NeptuneEndpoint']), 'g', poolSize)
+    return remoteConn
+
+
+def traversal():
+    global source
+    if source is None:
+        source = graph.traversal().withRemote(remote())
+    return source
+
+
+def readers():
+    global readerConn
+    if readerConn is None:
+        readerConn = ReaderPool([endpointUrl(endpoint) for endpoint in readerEndpoints], remote(), 'g', poolSize)
+    return readerConn
+
+
+def readerTraversal():
+    global readerSource
+    if not readerEndpoints:
+        return traversal()
+    if readerSource is None:
+        readerSource = graph.traversal().withRemote(readers())
+    return readerSource
+
+
+def writtenAt():
+    """Token for a write that has just been made: the time in milliseconds."""
+    return int(time.time() * 1000)
+
+
+def forRead(writtenAt = None):
+    """The reader, or the writer if `writtenAt` is recent enough that a replica may not have the write yet."""
+    if writtenAt is not None and time.time() * 1000 - writtenAt < replicaLagWindow * 1000:
+        return g
+    return reader
+
+
+def remoteOf(query):
+    for strategy in query.traversal_strategies.traversal_strategies:
+        if isinstance(strategy, RemoteStrategy):
+            return strategy.remote_connection
+    return remote()
+
+
+def stream(query):
+    # results of the traversal `query` in chunks from the endpoint its source
+    # is connected to, see PooledConnection.stream()
+    return remoteOf(query).stream(query.bytecode)
+
+
+def stats():
+    conn = remoteConn
+    return {
+        'poolSize': poolSize,
+        'connected': conn is not None and not conn.is_closed(),
+        'connectTime': conn.connectTime if conn else None,
+        'connects': conn.connects if conn else 0,
+        'reconnects': conn.reconnects if conn else 0,
+        'requests': conn.requests if conn else 0,
+        'readers': [{
+            'url': reader._url,
+            'connected': not reader.is_closed(),
+            'healthy': down <= time.time(),
+            'requests': reader.requests
+        } for reader, down in zip(readerConn.readers, readerConn.downUntil)] if readerConn else [],
+        'readerFailovers': readerConn.failovers if readerConn else 0
+    }
+
+
+g = LazyTraversalSource(traversal)
+reader = LazyTraversalSource(readerTraversal)
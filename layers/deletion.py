@@ -0,0 +1,139 @@
+"""
+Cascade deletes in bounded batches.
+
+A player or campaign with thousands of edges cannot be dropped in one
+transaction within the Lambda timeout. A transaction that long also holds locks
+that concurrent counter upserts wait on. run() drops the vertex's edges
+`DeleteBatchSize` at a time (default 500), each batch in its own short
+transaction, and drops the vertex last.
+
+Progress is kept on a `delete_job` vertex with id `delete-<vertex id>`. It is
+updated in the same transaction as each batch, so an interrupted delete resumes
+where it stopped. The job vertex also answers the status endpoint. When run()
+is out of time it returns with the job still `running`, and the caller queues a
+`delete` event for the aggregator worker to continue it.
+"""
+
+import logging
+import os
+import time
+
+from gremlin_python.process.graph_traversal import __
+from gremlin_python.process.traversal import T
+from gremlin_python.process.traversal import P
+from gremlin_python.process.traversal import Cardinality
+
+import connection
+import eventqueue
+import resultcache
+import retry
+import validation
+
+g = connection.g
+
+logger = logging.getLogger(__name__)
+
+batchSize = int(os.environ.get('DeleteBatchSize', '500'))
+
+# finished jobs are kept this long so their status can still be read
+jobTtl = int(os.environ.get('DeleteJobTtl', '86400'))
+
+# stop starting batches with this much of the invocation left
+timeMarginMillis = float(os.environ.get('DeleteTimeMargin', '1000'))
+
+statusFields = ['target', 'targetLabel', 'status', 'edgesDropped', 'startedAt', 'updatedAt', 'finishedAt', 'error']
+
+
+def jobId(vertexId):
+    return 'delete-' + vertexId
+
+def start(vertexId, label):
+    """Creates the job for deleting `vertexId`, or returns the existing one."""
+    now = int(time.time())
+    g.V(jobId(vertexId)).fold().coalesce(
+        __.unfold(),
+        __.addV('delete_job').property(T.id, jobId(vertexId))
+            .property('target', vertexId)
+            .property('targetLabel', label)
+            .property('status', 'pending')
+            .property('edgesDropped', 0)
+            .property('startedAt', now)
+            .property('updatedAt', now)
+    ).iterate()
+    return status(vertexId)
+
+def status(vertexId):
+    """The job's fields, or None if there is no job for `vertexId`."""
+    found = g.V(jobId(vertexId)).valueMap(*statusFields).toList()
+    if not found:
+        return None
+    return {key: value[0] for key, value in found[0].items()}
+
+def setStatus(vertexId, state, **fields):
+    traversal = g.V(jobId(vertexId)).property(Cardinality.single, 'status', state).property(Cardinality.single, 'updatedAt', int(time.time()))
+    for key, value in fields.items():
+        traversal = traversal.property(Cardinality.single, key, value)
+    traversal.iterate()
+
+def dropBatch(vertexId):
+    # the batch and the job's progress are one transaction, so edgesDropped
+    # never counts a batch that was rolled back
+    return g.V(vertexId).bothE().limit(batchSize).sideEffect(__.drop()).count().as_('dropped') \
+        .V(jobId(vertexId))                                                                      \
+        .property(Cardinality.single, 'edgesDropped', __.union(__.values('edgesDropped'), __.select('dropped')).sum()) \
+        .property(Cardinality.single, 'updatedAt', int(time.time()))                            \
+        .select('dropped').next()
+
+def outOfTime(context):
+    return context is not None and context.get_remaining_time_in_millis() < timeMarginMillis
+
+def run(vertexId, context = None):
+    """
+    Drops the edges of `vertexId` a batch at a time and then the vertex. Returns
+    the job status: `done`, `failed`, or `running` if the invocation ran out of
+    time first.
+    """
+    setStatus(vertexId, 'running')
+    try:
+        while True:
+            if outOfTime(context):
+                return status(vertexId)
+            if retry.withRetry(lambda: dropBatch(vertexId)) < batchSize:
+                break
+        retry.withRetry(lambda: g.V(vertexId).drop().iterate())
+    except Exception as e:
+        logger.warning('delete of %s failed: %s', vertexId, e)
+        setStatus(vertexId, 'failed', error = str(e))
+        return status(vertexId)
+    validation.evict(vertexId)
+    # the vertex's edges are gone from results that span many players too
+    resultcache.invalidate([vertexId, resultcache.endpointTag('badActors'), resultcache.endpointTag('relatedUsers')])
+    now = int(time.time())
+    setStatus(vertexId, 'done', finishedAt = now, expiresAt = now + jobTtl)
+    return status(vertexId)
+
+def enqueue(vertexId):
+    """Hands the rest of the delete to the aggregator worker."""
+    eventqueue.queue().send([eventqueue.event({'delete': vertexId})])
+
+def dropExpiredJobs(limit = 1000):
+    return g.V().hasLabel('delete_job').has('expiresAt', P.lt(int(time.time()))).limit(limit).sideEffect(__.drop()).count().next()
+
+def delete(vertexId, label, context = None, asynchronous = False):
+    """
+    Starts or resumes the delete of `vertexId`. With `asynchronous`, or when
+    the invocation runs out of time, the rest is queued for the worker.
+    Returns the job status.
+    """
+    job = start(vertexId, label)
+    if job['status'] == 'done':
+        # the id has been reused since the last delete
+        setStatus(vertexId, 'pending', edgesDropped = 0)
+    elif job['status'] == 'failed':
+        setStatus(vertexId, 'pending')
+    job = status(vertexId)
+    if not asynchronous:
+        job = run(vertexId, context)
+    if job['status'] in ('pending', 'running'):
+        enqueue(vertexId)
+    return job
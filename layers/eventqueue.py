@@ -0,0 +1,154 @@
+"""
+Queues for write-behind interaction and campaign events.
+
+`InteractionQueue` selects the backend:
+
+    memory            in-process queue, for tests and the local runner
+    file:<path>       JSON lines file shared by processes on one machine
+    sqs:<queue url>   Amazon SQS, used when deployed
+
+Every backend has send(events), receive(maxEvents) and ack(batch). A received
+batch stays unacknowledged until ack() is called, so events are delivered at
+least once; the aggregator makes the writes idempotent with the event ids.
+"""
+
+import collections
+import fcntl
+import json
+import os
+import uuid
+
+
+class Batch(object):
+
+    def __init__(self, events, token = None):
+        self.events = events
+        self.token = token
+
+
+class MemoryQueue(object):
+
+    def __init__(self):
+        self.pending = collections.deque()
+
+    def send(self, events):
+        self.pending.extend(events)
+
+    def receive(self, maxEvents):
+        events = []
+        while self.pending and len(events) < maxEvents:
+            events.append(self.pending.popleft())
+        return Batch(events, events)
+
+    def ack(self, batch):
+        pass
+
+    def nack(self, batch):
+        self.pending.extendleft(reversed(batch.token))
+
+
+class FileQueue(object):
+    """Appends events to a JSON lines file; the read position is kept in `<path>.offset`."""
+
+    def __init__(self, path):
+        self.path = path
+        self.offsetPath = path + '.offset'
+
+    def send(self, events):
+        with open(self.path, 'a') as f:
+            fcntl.flock(f, fcntl.LOCK_EX)
+            f.write(''.join(json.dumps(event) + '\n' for event in events))
+            f.flush()
+            fcntl.flock(f, fcntl.LOCK_UN)
+
+    def offset(self):
+        try:
+            with open(self.offsetPath) as f:
+                return int(f.read() or 0)
+        except FileNotFoundError:
+            return 0
+
+    def receive(self, maxEvents):
+        start = self.offset()
+        events = []
+        try:
+            with open(self.path) as f:
+                f.seek(start)
+                while len(events) < maxEvents:
+                    line = f.readline()
+                    # a line without its newline is still being written
+                    if not line.endswith('\n'):
+                        break
+                    events.append(json.loads(line))
+                end = f.tell() if events else start
+        except FileNotFoundError:
+            end = start
+        return Batch(events, end)
+
+    def ack(self, batch):
+        with open(self.offsetPath + '.tmp', 'w') as f:
+            f.write(str(batch.token))
+        os.replace(self.offsetPath + '.tmp', self.offsetPath)
+
+    def nack(self, batch):
+        pass
+
+
+class SqsQueue(object):
+
+    def __init__(self, url):
+        import boto3
+        self.url = url
+        self.sqs = boto3.client('sqs')
+
+    def send(self, events):
+        for start in range(0, len(events), 10):
+            response = self.sqs.send_message_batch(QueueUrl = self.url, Entries = [
+                {'Id': str(i), 'MessageBody': json.dumps(event)}
+                for i, event in enumerate(events[start:start + 10])
+            ])
+            if response.get('Failed'):
+                # a batch can be partly rejected without raising
+                raise RuntimeError('could not send {} events: {}'.format(len(response['Failed']), response['Failed'][0].get('Message')))
+
+    def receive(self, maxEvents):
+        messages = []
+        while len(messages) < maxEvents:
+            response = self.sqs.receive_message(QueueUrl = self.url, MaxNumberOfMessages = min(10, maxEvents - len(messages)))
+            if not response.get('Messages'):
+                break
+            messages.extend(response['Messages'])
+        return Batch([json.loads(message['Body']) for message in messages], [message['ReceiptHandle'] for message in messages])
+
+    def ack(self, batch):
+        for start in range(0, len(batch.token), 10):
+            self.sqs.delete_message_batch(QueueUrl = self.url, Entries = [
+                {'Id': str(i), 'ReceiptHandle': handle}
+                for i, handle in enumerate(batch.token[start:start + 10])
+            ])
+
+    def nack(self, batch):
+        # left to the visibility timeout
+        pass
+
+
+def event(fields):
+    return {**fields, 'eventId': str(uuid.uuid4())}
+
+def fromSpec(spec):
+    if spec == 'memory':
+        return MemoryQueue()
+    kind, _, target = spec.partition(':')
+    if kind == 'file':
+        return FileQueue(target)
+    elif kind == 'sqs':
+        return SqsQueue(target)
+    raise ValueError('unknown queue ' + spec)
+
+interactionQueue = None
+
+def queue():
+    global interactionQueue
+    if interactionQueue is None:
+        interactionQueue = fromSpec(os.environ.get('InteractionQueue', 'memory'))
+    return interactionQueue
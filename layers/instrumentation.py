@@ -0,0 +1,185 @@
+"""
+Per-invocation timing and round-trip metrics for the handlers.
+
+`@instrumentation.instrumented` wraps a Lambda handler. While it runs, the
+layers time their phases with phase():
+
+    connect       opening the Gremlin websockets (connection.py)
+    validation    schema validation (validation.py)
+    existence     existence checks, including their Gremlin requests
+    traversal     waiting for Gremlin results (connection.py)
+    serialize     encoding results as JSON (paging.py, serializer.py)
+
+Phases are exclusive: time spent in a nested phase is not counted in the one
+around it, and the rest of the invocation is reported as `OtherMs`. The wrapper
+also counts Gremlin requests, result items, response bytes, and write retries
+and lost updates (see retry.py), and tags the first invocation in a container
+as a cold start. It prints one line per invocation in CloudWatch Embedded Metric
+Format, so the numbers become metrics in the `MetricsNamespace` namespace
+(default `CohortModeler`) without any API calls. Set `Instrumentation` to `off`
+to disable the line.
+
+`profile=true` in the query string captures the server-side profile of the
+traversals passed to capture() and adds it to the response body as `profile`.
+The prediction cache is bypassed for these requests.
+"""
+
+import contextlib
+import functools
+import json
+import os
+import time
+
+namespace = os.environ.get('MetricsNamespace', 'CohortModeler')
+enabled = os.environ.get('Instrumentation', 'on') != 'off'
+
+# phases whose nested phases are counted in them rather than separately, e.g.
+# the Gremlin request made by an existence check
+absorbing = frozenset(['connect', 'existence'])
+
+phaseNames = ['connect', 'validation', 'existence', 'traversal', 'serialize']
+
+coldStart = True
+current = None
+
+
+class Invocation(object):
+
+    def __init__(self, route, requestId, profile):
+        self.route = route
+        self.requestId = requestId
+        self.profile = profile
+        self.started = time.perf_counter()
+        self.phases = dict.fromkeys(phaseNames, 0.0)
+        self.stack = []
+        self.counters = {'gremlinRequests': 0, 'resultItems': 0, 'writeRetries': 0, 'lostUpdates': 0}
+        self.queries = []
+
+
+@contextlib.contextmanager
+def phase(name):
+    invocation = current
+    if invocation is None or (invocation.stack and invocation.stack[-1][0] in absorbing):
+        yield
+        return
+    now = time.perf_counter()
+    if invocation.stack:
+        parent = invocation.stack[-1]
+        invocation.phases[parent[0]] = invocation.phases.get(parent[0], 0.0) + now - parent[1]
+    entry = [name, now]
+    invocation.stack.append(entry)
+    try:
+        yield
+    finally:
+        now = time.perf_counter()
+        invocation.stack.pop()
+        invocation.phases[name] = invocation.phases.get(name, 0.0) + now - entry[1]
+        if invocation.stack:
+            invocation.stack[-1][1] = now
+
+def count(name, amount = 1):
+    if current is not None:
+        current.counters[name] = current.counters.get(name, 0) + amount
+
+def profiling():
+    return current is not None and current.profile
+
+def capture(query):
+    """Notes a traversal to profile when the request asked for profile=true."""
+    if profiling():
+        current.queries.append(query)
+
+def serverProfile(query):
+    import connection
+
+    endpoint = os.environ.get('NeptuneEndpoint', '')
+    if '://' not in endpoint:
+        # Neptune does not support the profile() step; its profile API takes
+        # the traversal as a Gremlin string
+        import urllib.request
+        from gremlin_python.process.translator import Translator
+        request = urllib.request.Request(
+            'https://' + endpoint + ':8182/gremlin/profile',
+            data = json.dumps({'gremlin': Translator('g').translate(query.bytecode)}).encode('utf-8'),
+            headers = {'Content-Type': 'application/json'}
+        )
+        with urllib.request.urlopen(request, timeout = 30) as response:
+            return response.read().decode('utf-8')
+    return query.clone().profile().next()
+
+def route(event, context, handler):
+    if isinstance(event, dict) and event.get('httpMethod'):
+        return event['httpMethod'] + ' ' + event.get('resource', '')
+    if context is not None and getattr(context, 'function_name', None):
+        return context.function_name
+    return handler.__module__
+
+def requestedProfile(event):
+    params = event.get('queryStringParameters') if isinstance(event, dict) else None
+    return str((params or {}).get('profile', '')).lower() in ('true', '1')
+
+def addProfiles(response, queries):
+    profiles = []
+    for query in queries:
+        try:
+            profiles.append(serverProfile(query))
+        except Exception as e:
+            profiles.append({'error': str(e)})
+    try:
+        body = json.loads(response.get('body') or '{}')
+    except ValueError:
+        body = {'body': response.get('body')}
+    if not isinstance(body, dict):
+        body = {'items': body}
+    body['profile'] = profiles
+    return {**response, 'body': json.dumps(body, default = str)}
+
+def metrics(invocation, response, duration):
+    phases = {name.capitalize() + 'Ms': round(seconds * 1000, 3) for name, seconds in invocation.phases.items()}
+    other = duration - sum(invocation.phases.values())
+    body = response.get('body') if isinstance(response, dict) else None
+    values = {
+        'DurationMs': round(duration * 1000, 3),
+        **phases,
+        'OtherMs': round(max(other, 0) * 1000, 3),
+        'GremlinRequests': invocation.counters['gremlinRequests'],
+        'ResultItems': invocation.counters['resultItems'],
+        'WriteRetries': invocation.counters['writeRetries'],
+        'LostUpdates': invocation.counters['lostUpdates'],
+        'ResponseBytes': len(body.encode('utf-8')) if isinstance(body, str) else 0
+    }
+    units = {name: 'Milliseconds' if name.endswith('Ms') else ('Bytes' if name.endswith('Bytes') else 'Count') for name in values}
+    return {
+        '_aws': {
+            'Timestamp': int(time.time() * 1000),
+            'CloudWatchMetrics': [{
+                'Namespace': namespace,
+                'Dimensions': [['Route'], ['Route', 'ColdStart']],
+                'Metrics': [{'Name': name, 'Unit': unit} for name, unit in units.items()]
+            }]
+        },
+        'Route': invocation.route,
+        'ColdStart': str(invocation.coldStart).lower(),
+        'RequestId': invocation.requestId,
+        'StatusCode': response.get('statusCode') if isinstance(response, dict) else None,
+        **values
+    }
+
+def instrumented(handler):
+    @functools.wraps(handler)
+    def wrapper(event, context):
+        global coldStart, current
+        invocation = Invocation(route(event, context, handler), getattr(context, 'aws_request_id', None), requestedProfile(event))
+        invocation.coldStart, coldStart = coldStart, False
+        current = invocation
+        response = None
+        try:
+            response = handler(event, context)
+            if invocation.profile and invocation.queries and isinstance(response, dict):
+                response = addProfiles(response, invocation.queries)
+            return response
+        finally:
+            current = None
+            if enabled:
+                print(json.dumps(metrics(invocation, response if isinstance(response, dict) else {'statusCode': 500}, time.perf_counter() - invocation.started), separators = (',', ':')))
+    return wrapper
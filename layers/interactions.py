@@ -0,0 +1,241 @@
+"""
+Write traversals for player interactions, campaign events and counter
+attributes.
+
+The upserts are appended to a traversal rather than executed here, so a single
+interaction is one round trip and the batch endpoints can chain many of them
+into one request.
+"""
+
+import json
+import os
+import time
+
+from gremlin_python.process.graph_traversal import __
+from gremlin_python.process.traversal import T
+from gremlin_python.process.traversal import P
+from gremlin_python.process.traversal import Cardinality
+
+import actionprofile
+import connection
+import reputation
+import resultcache
+import retry
+import timebuckets
+
+g = connection.g
+
+chunkSize = int(os.environ.get('InteractionChunkSize', '25'))
+
+# With a Lambda context, applyDeltas() stops starting chunks once less than
+# this many milliseconds (plus the time the last chunk took) are left.
+timeMargin = float(os.environ.get('InteractionTimeMargin', '2000'))
+
+# Write-behind events leave a marker vertex in the same transaction as their
+# increments, so a redelivered event can be recognised and skipped.
+markerTtl = int(os.environ.get('WriteMarkerTtl', '172800'))
+
+# Bumped on a player whenever it writes an interaction with another player, so
+# results cached per player (e.g. recommendations) can tell they are stale.
+versionProperty = 'interactionVersion'
+
+# Properties of each action vertex, added to the acting player on every
+# interaction. Action vertices change rarely, so they are cached per container
+# instead of being read back with valueMap() on every write.
+actionTtl = float(os.environ.get('ActionCacheTtl', '300'))
+actionProperties = {}
+
+def actionValues(action):
+    cached = actionProperties.get(action)
+    if cached is not None and cached[0] > time.monotonic():
+        return cached[1]
+    values = {}
+    for valueMap in g.V(action).valueMap().toList():
+        for key, value in valueMap.items():
+            if isinstance(value[0], (int, float)) and not isinstance(value[0], bool):
+                values[key] = value[0]
+    actionProperties[action] = (time.monotonic() + actionTtl, values)
+    return values
+
+def increment(key, incrementBy):
+    return __.union(__.values(key), __.constant(incrementBy)).sum()
+
+def interactionUpsert(traversal, player, action, targetPlayer = None, incrementBy = 1, label = ''):
+    # `label` keeps step labels unique when several upserts share a traversal
+    a, p, t = 'a' + label, 'p' + label, 't' + label
+    traversal = traversal.V(action).fold().coalesce(
+        __.unfold(),
+        __.addV('action').property(T.id, action)
+    ).as_(a).V(player).as_(p).coalesce(
+        __.outE('action_edge').where(__.inV().has(T.id, action)).property('count', increment('count', incrementBy)),
+        __.addE('action_edge').to(a).property('count', incrementBy)
+    )
+
+    if targetPlayer is not None:
+        traversal = traversal.V(targetPlayer).as_(t).select(p).coalesce(
+            __.outE('interaction_edge').where(__.inV().has(T.id, targetPlayer)).property(action, increment(action, incrementBy)),
+            __.addE('interaction_edge').to(t).property(action, incrementBy)
+        )
+        traversal = timebuckets.record(traversal, action, incrementBy, vertex = False)
+
+    profile = actionprofile.propertyName(action)
+    traversal = traversal.select(p).property(Cardinality.single, profile, increment(profile, incrementBy))
+    traversal = timebuckets.record(traversal, profile, incrementBy)
+    if targetPlayer is not None:
+        traversal = traversal.property(Cardinality.single, versionProperty, increment(versionProperty, 1))
+    values = actionValues(action)
+    for key, value in values.items():
+        traversal = traversal.property(Cardinality.single, key, increment(key, value * incrementBy))
+    if reputation.attribute in values:
+        traversal = reputation.maintain(traversal, player, label)
+    return traversal
+
+def campaignUpsert(traversal, player, campaign, campaignAction, incrementBy = 1, label = ''):
+    c, p = 'c' + label, 'p' + label
+    return traversal.V(campaign).as_(c).V(player).as_(p).coalesce(
+        __.outE('campaign_edge').where(__.inV().has(T.id, campaign)).property(campaignAction, increment(campaignAction, incrementBy)),
+        __.addE('campaign_edge').to(c).property(campaignAction, incrementBy)
+    ).select(p)
+
+def attributeUpsert(traversal, vertex, attribute, incrementBy, player = True, label = ''):
+    traversal = traversal.V(vertex).property(Cardinality.single, attribute, increment(attribute, incrementBy))
+    if player and attribute == reputation.attribute:
+        traversal = reputation.maintain(traversal, vertex, label)
+    return traversal
+
+def parseEvents(body):
+    # a JSON array of events, or one JSON event per line
+    body = body.strip()
+    if body.startswith('['):
+        return json.loads(body)
+    return [json.loads(line) for line in body.splitlines() if line.strip()]
+
+def eventKey(event):
+    if 'campaign' in event:
+        return ('campaign', event['player'], event['campaign'], event['campaignAction'])
+    return ('interaction', event['player'], event['action'], event.get('targetPlayer'))
+
+def combine(events):
+    # events with the same (player, action, targetPlayer) or (player, campaign,
+    # campaignAction) become one write of their summed increments
+    deltas = {}
+    for event in events:
+        key = eventKey(event)
+        deltas[key] = deltas.get(key, 0) + event.get('incrementBy', 1)
+    return deltas
+
+def upsert(traversal, key, incrementBy, label = ''):
+    # keys are eventKey()s, or ('playerAttribute'|'campaignAttribute', vertex, attribute)
+    if key[0] == 'campaign':
+        return campaignUpsert(traversal, key[1], key[2], key[3], incrementBy, label)
+    if key[0] in ('playerAttribute', 'campaignAttribute'):
+        return attributeUpsert(traversal, key[1], key[2], incrementBy, key[0] == 'playerAttribute', label)
+    return interactionUpsert(traversal, key[1], key[2], key[3], incrementBy, label)
+
+def cacheTags(keys):
+    """
+    Tags of the cached results that are stale after writing `keys`: the players
+    written, and the endpoint tags of the results that span many players.
+    badActors depends on the action and on reputations, relatedUsers on every
+    action and player attribute.
+    """
+    tags = []
+    for key in keys:
+        if key[0] == 'interaction':
+            tags += [key[1], key[3], resultcache.endpointTag('badActors', key[2]), resultcache.endpointTag('triadicClosure', key[2]), resultcache.endpointTag('relatedUsers')]
+            if reputation.attribute in actionValues(key[2]):
+                tags.append(resultcache.endpointTag('badActors'))
+        elif key[0] == 'playerAttribute':
+            tags += [key[1], resultcache.endpointTag('relatedUsers')]
+            if key[2] == reputation.attribute:
+                tags.append(resultcache.endpointTag('badActors'))
+        elif key[0] == 'campaign':
+            tags.append(key[1])
+    return tags
+
+def write(vertex, deltas):
+    """
+    Writes `deltas` ({upsert key: incrementBy}) in one traversal, retrying
+    conflicts. `vertex` is the hot vertex the writes contend on; with hot key
+    serialization on, concurrent writes to it in this process are merged (see
+    retry.serialized()).
+    """
+    def upsertAll(merged):
+        traversal = g
+        for i, (key, incrementBy) in enumerate(merged.items()):
+            traversal = upsert(traversal, key, incrementBy, str(i))
+        traversal.iterate()
+    retry.serialized(vertex, deltas, upsertAll)
+
+def markerId(eventId):
+    return 'written-' + eventId
+
+def markWritten(traversal, eventIds):
+    expiresAt = int(time.time()) + markerTtl
+    for eventId in eventIds:
+        traversal = traversal.sideEffect(__.addV('write_marker').property(T.id, markerId(eventId)).property('expiresAt', expiresAt))
+    return traversal
+
+def writtenEvents(eventIds):
+    if not eventIds:
+        return set()
+    written = g.V(*[markerId(eventId) for eventId in eventIds]).id().toList()
+    return {vertexId[len('written-'):] for vertexId in written}
+
+def dropExpiredMarkers(limit = 1000):
+    return g.V().hasLabel('write_marker').has('expiresAt', P.lt(int(time.time()))).limit(limit).sideEffect(__.drop()).count().next()
+
+def remainingMillis(context):
+    if context is None or not hasattr(context, 'get_remaining_time_in_millis'):
+        return float('inf')
+    return context.get_remaining_time_in_millis()
+
+def applyDeltas(deltas, size = None, markers = None, context = None):
+    """
+    Writes combined deltas, `size` upserts per traversal. Returns a dict of key
+    to None when the delta was applied or an error message when it was not.
+    `markers` maps a key to the event ids merged into it; their markers are
+    written in the same traversal as the increments. With a Lambda `context`,
+    it stops before the invocation runs out of time, and the keys it did not
+    get to are left out of the result.
+    """
+    size = size or chunkSize
+    markers = markers or {}
+    results = {}
+    elapsed = 0
+
+    def chunkTraversal(chunk):
+        # each upsert runs inside its own by() so a missing vertex only empties
+        # that entry of the projection instead of the rest of the chunk
+        traversal = markWritten(g.inject(0), [eventId for key in chunk for eventId in markers.get(key, ())])
+        traversal = traversal.project(*[str(i) for i in range(len(chunk))])
+        for i, key in enumerate(chunk):
+            traversal = traversal.by(upsert(__, key, deltas[key], str(i)).count())
+        return traversal
+
+    keys = list(deltas)
+    for start in range(0, len(keys), size):
+        if remainingMillis(context) <= timeMargin + elapsed:
+            break
+        chunk = keys[start:start + size]
+        started = time.monotonic()
+        try:
+            applied = retry.withRetry(lambda: chunkTraversal(chunk).next())
+            applied = [applied[str(i)] for i in range(len(chunk))]
+        except Exception:
+            # the chunk was rolled back as a whole, write its deltas one by one
+            # to find the one that failed
+            applied = []
+            for key in chunk:
+                try:
+                    applied.append(retry.withRetry(lambda: chunkTraversal([key]).next()['0']))
+                except Exception as e:
+                    applied.append(str(e))
+        for key, result in zip(chunk, applied):
+            if isinstance(result, str):
+                results[key] = result
+            else:
+                results[key] = None if result else 'vertex does not exist'
+        elapsed = (time.monotonic() - started) * 1000
+    resultcache.invalidate(cacheTags(key for key, error in results.items() if error is None))
+    return results
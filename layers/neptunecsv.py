@@ -0,0 +1,103 @@
+"""
+Streaming reader for Neptune bulk load CSV files.
+
+Headers use the Neptune load format: system columns `~id`, `~label`, `~from` and
+`~to`, and property columns written `name:Type` or `name:Type[]`. Rows are read
+one at a time, so files of any size can be processed in constant memory.
+"""
+
+import csv
+import datetime
+
+
+class Column(object):
+
+    def __init__(self, header):
+        name, _, kind = header.partition(':')
+        self.header = header
+        self.name = name
+        self.isArray = kind.endswith('[]')
+        self.type = (kind[:-2] if self.isArray else kind).lower() or 'string'
+        self.isSystem = name.startswith('~')
+
+    def convert(self, value):
+        if value == '':
+            return None
+        if self.isArray:
+            return [convertValue(item, self.type) for item in value.split(';') if item != '']
+        return convertValue(value, self.type)
+
+
+def convertValue(value, kind):
+    if kind in ('int', 'long', 'short', 'byte'):
+        return int(value)
+    elif kind in ('float', 'double'):
+        return float(value)
+    elif kind in ('bool', 'boolean'):
+        return value.lower() == 'true'
+    elif kind == 'date':
+        return datetime.datetime.fromisoformat(value.replace('Z', '+00:00'))
+    return value
+
+
+class Reader(object):
+    """
+    Iterates the rows of one file as (id, label, properties) for vertex files or
+    (id, label, from, to, properties) for edge files. `offset` is the byte
+    position just after the last row returned, for resuming with `start`.
+    """
+
+    def __init__(self, path, start = None):
+        self.path = path
+        self.file = open(path, newline = '', encoding = 'utf-8')
+        self.offset = 0
+        self.columns = [Column(header) for header in next(csv.reader(self.lines()))]
+        self.names = [column.name for column in self.columns]
+        self.isEdge = '~from' in self.names
+        if start is not None and start > self.offset:
+            self.file.seek(start)
+            self.offset = start
+        self.records = csv.reader(self.lines())
+
+    def lines(self):
+        while True:
+            line = self.file.readline()
+            if not line:
+                return
+            self.offset += len(line.encode('utf-8'))
+            yield line
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        record = next(self.records)
+        values = {}
+        properties = {}
+        for column, value in zip(self.columns, record):
+            if column.isSystem:
+                values[column.name] = value
+            else:
+                converted = column.convert(value)
+                if converted is not None:
+                    properties[column.name] = converted
+        if self.isEdge:
+            return (values.get('~id') or None, values.get('~label'), values['~from'], values['~to'], properties)
+        return (values['~id'], values.get('~label'), properties)
+
+    def close(self):
+        self.file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def header(path):
+    with open(path, newline = '', encoding = 'utf-8') as f:
+        return [Column(name) for name in next(csv.reader(f))]
+
+def isEdgeFile(path):
+    return any(column.name == '~from' for column in header(path))
@@ -0,0 +1,148 @@
+"""
+Cursor pagination and incrementally written JSON bodies for list results.
+
+A page is fetched with range(offset, offset + limit + 1): the extra result only
+tells whether another page follows. The cursor returned with a page is an
+opaque token for the next offset. Queries that sort a large result page on a
+keyset instead: the cursor holds the sort key of the last row, the handler
+starts the query after it (see after()) and the page is its first limit + 1
+rows, so no page sorts or skips the rows of the pages before it. Results are
+encoded as they arrive from the driver, one response message at a time, so a
+handler never holds more than one page of results and its JSON text.
+"""
+
+import base64
+import io
+import json
+import os
+
+from gremlin_python.process.graph_traversal import __
+from gremlin_python.process.traversal import P
+
+import connection
+import instrumentation
+import serializer
+
+defaultLimit = int(os.environ.get('PageDefaultLimit', '1000'))
+maxLimit = int(os.environ.get('PageMaxLimit', '10000'))
+
+
+class CursorError(ValueError):
+    pass
+
+
+def encodeCursor(offset):
+    return base64.urlsafe_b64encode(json.dumps({'offset': offset}).encode('utf-8')).decode('ascii').rstrip('=')
+
+def decodeCursor(cursor):
+    if not cursor:
+        return 0
+    try:
+        offset = json.loads(base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4)))['offset']
+    except (ValueError, TypeError, KeyError):
+        raise CursorError('invalid cursor')
+    if not isinstance(offset, int) or offset < 0:
+        raise CursorError('invalid cursor')
+    return offset
+
+def encodeKeyCursor(key):
+    return base64.urlsafe_b64encode(json.dumps({'after': key}).encode('utf-8')).decode('ascii').rstrip('=')
+
+def decodeKeyCursor(cursor):
+    """The sort key of the last row of the previous page, or None for the first page."""
+    if not cursor:
+        return None
+    try:
+        key = json.loads(base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4)))['after']
+    except (ValueError, TypeError, KeyError):
+        raise CursorError('invalid cursor')
+    if not isinstance(key, list) or not key:
+        raise CursorError('invalid cursor')
+    return key
+
+def after(keys, last):
+    """Filter for where(): rows whose values of `keys`, in order, sort after `last`."""
+    if len(keys) == 1:
+        return __.select(keys[0]).is_(P.gt(last[0]))
+    return __.or_(
+        __.select(keys[0]).is_(P.gt(last[0])),
+        __.and_(__.select(keys[0]).is_(P.eq(last[0])), after(keys[1:], last[1:]))
+    )
+
+class Limited(object):
+    """Passes on at most `limit` streamed items and notes whether any were left over."""
+
+    def __init__(self, chunks, limit):
+        self.chunks = chunks
+        self.limit = limit
+        self.more = False
+        self.last = None
+
+    def __iter__(self):
+        remaining = self.limit
+        for chunk in self.chunks:
+            if len(chunk) > remaining:
+                self.more = True
+            if remaining > 0 and chunk:
+                passed = chunk[:remaining]
+                self.last = passed[-1]
+                yield passed
+                remaining -= len(passed)
+
+
+def writeItems(chunks, out, convert = serializer.encode):
+    """Writes a JSON array of the items in `chunks` to `out`. Returns the item count."""
+    count = 0
+    out.write('[')
+    for chunk in chunks:
+        if not chunk:
+            continue
+        # a response message at a time, as one array without its brackets
+        items = serializer.encode(chunk) if convert is serializer.encode else [convert(item) for item in chunk]
+        if count:
+            out.write(',')
+        out.write(serializer.text(items)[1:-1])
+        count += len(items)
+    out.write(']')
+    return count
+
+def page(query, limit = None, cursor = None, convert = serializer.encode, key = 'items', columnar = False, project = None, sortKey = None):
+    """
+    Runs one page of the traversal `query` and returns the JSON body
+    {key: [...], "nextCursor": ...}. `nextCursor` is null on the last page.
+    With `columnar`, the items are written as {column: [...]} instead.
+    `project` is mapped over the page's rows only, after they are selected.
+    With `sortKey`, a function from a row to its sort key, the page is keyset
+    paged: `query` already starts after decodeKeyCursor(cursor).
+    """
+    with instrumentation.phase('serialize'):
+        return writePage(query, limit, cursor, convert, key, columnar, project, sortKey)
+
+def writePage(query, limit, cursor, convert, key, columnar, project = None, sortKey = None):
+    limit = min(limit or defaultLimit, maxLimit)
+    if sortKey is None:
+        offset = decodeCursor(cursor)
+        query = query.range(offset, offset + limit + 1)
+    else:
+        query = query.limit(limit + 1)
+    if project is not None:
+        query = query.map(project)
+    items = Limited(connection.stream(query), limit)
+
+    out = io.StringIO()
+    out.write('{"%s":' % key)
+    if columnar:
+        # columns need every item of the page, which is at most `limit` long
+        rows = [convert(item) for chunk in items for item in chunk]
+        count = len(rows)
+        out.write(serializer.text(serializer.columnar(rows)))
+    else:
+        count = writeItems(items, out, convert)
+    if not items.more:
+        nextCursor = None
+    elif sortKey is None:
+        nextCursor = encodeCursor(offset + count)
+    else:
+        nextCursor = encodeKeyCursor(sortKey(items.last))
+    out.write(',"nextCursor":%s}' % json.dumps(nextCursor))
+    return out.getvalue()
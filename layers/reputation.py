@@ -0,0 +1,111 @@
+"""
+Index of players with a negative `ea_reputation`.
+
+The index is split over `ReputationIndexPartitions` `player_index` vertices
+(default 64), and each one has a `flagged` edge to the players whose reputation
+is below zero and whose id hashes to it. Writes that change `ea_reputation`
+append maintain() to their traversal, which adds or drops the player's edge in
+the same request. Spreading the edges keeps any one index vertex from becoming
+a supernode that every reputation change contends on. badActors then starts
+from the flagged players instead of scanning every player. rebuild() repairs
+drift, e.g. after a bulk load, and moves the edges when the number of
+partitions changes.
+"""
+
+import logging
+import os
+import zlib
+
+from gremlin_python.process.graph_traversal import __
+from gremlin_python.process.traversal import T
+from gremlin_python.process.traversal import P
+
+import connection
+
+g = connection.g
+
+logger = logging.getLogger(__name__)
+
+indexId = 'index-negative-reputation'
+indexLabel = 'player_index'
+flagLabel = 'flagged'
+attribute = 'ea_reputation'
+
+partitions = int(os.environ.get('ReputationIndexPartitions', '64'))
+
+
+def partitionId(player):
+    # crc32 rather than hash(), which differs between processes
+    return '%s-%d' % (indexId, zlib.crc32(str(player).encode('utf-8')) % partitions)
+
+def partitionIds():
+    return ['%s-%d' % (indexId, partition) for partition in range(partitions)]
+
+def indexVertex(vertexId):
+    return __.V(vertexId).fold().coalesce(
+        __.unfold(),
+        __.addV(indexLabel).property(T.id, vertexId)
+    )
+
+def maintain(traversal, player, label = ''):
+    """Appended to a traversal positioned at `player`; leaves it at the player."""
+    flagged = 'flagged' + label
+    return traversal.sideEffect(
+        __.choose(
+            __.has(attribute, P.lt(0)),
+            __.coalesce(
+                __.inE(flagLabel),
+                __.as_(flagged).map(indexVertex(partitionId(player))).addE(flagLabel).to(flagged)
+            ),
+            __.inE(flagLabel).drop()
+        )
+    )
+
+def flaggedPlayers(traversal):
+    # the flagged players, or every player if the index has not been built yet
+    return traversal.V(*partitionIds()).fold().choose(
+        __.unfold(),
+        __.unfold().out(flagLabel),
+        __.V().hasLabel('player')
+    ).has(attribute, P.lt(0))
+
+def dropStale(batchSize):
+    # index vertices of another partition count, or the single vertex the
+    # index used to be, are emptied and dropped
+    dropped = 0
+    current = partitionIds()
+    for vertexId in g.V().hasLabel(indexLabel).id().toList():
+        if vertexId in current:
+            continue
+        while True:
+            edges = g.V(vertexId).outE(flagLabel).limit(batchSize).id().toList()
+            if not edges:
+                break
+            g.E(*edges).drop().iterate()
+            dropped += len(edges)
+        g.V(vertexId).drop().iterate()
+    while True:
+        stale = g.V(*current).outE(flagLabel).not_(__.inV().has(attribute, P.lt(0))).limit(batchSize).id().toList()
+        if not stale:
+            return dropped
+        g.E(*stale).drop().iterate()
+        dropped += len(stale)
+
+def rebuild(batchSize = 1000):
+    """Makes the index match the graph. Returns the number of edges added and dropped."""
+    for vertexId in partitionIds():
+        g.inject(0).map(indexVertex(vertexId)).iterate()
+    dropped = dropStale(batchSize)
+    added = 0
+    while True:
+        missing = g.V().hasLabel('player').has(attribute, P.lt(0)).not_(__.inE(flagLabel)).limit(batchSize).id().toList()
+        if not missing:
+            break
+        byPartition = {}
+        for player in missing:
+            byPartition.setdefault(partitionId(player), []).append(player)
+        for vertexId, players in byPartition.items():
+            g.V(*players).as_('p').V(vertexId).addE(flagLabel).to('p').iterate()
+        added += len(missing)
+    logger.info('reputation index rebuilt: %d added, %d dropped', added, dropped)
+    return {'added': added, 'dropped': dropped}
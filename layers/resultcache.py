@@ -0,0 +1,251 @@
+"""
+Read-through cache for prediction results.
+
+Results are keyed on the endpoint and its normalized parameters. They expire
+after `PredictionCacheTtl` seconds (default 60), and the least recently used are
+evicted past `PredictionCacheSize` entries (default 1000). An entry can be
+tagged with the players it was computed for. Write handlers call
+invalidate(players) to drop every entry tagged with those players. Results that
+span many players are tagged with an endpointTag() instead, which the writes
+that can change them invalidate as well.
+
+`PredictionCache` selects where entries are kept:
+
+    memory            in the Lambda container only (default)
+    sqlite:<path>     also in a SQLite file shared by every process on one
+                      machine, a local stand-in for a shared cache
+
+With a shared backend, invalidations are recorded there as well, and each
+process drops its own copies of invalidated entries on its next lookup.
+stats() reports hits, misses, evictions, expirations and invalidations.
+"""
+
+import collections
+import json
+import os
+import sqlite3
+import time
+
+import instrumentation
+
+defaultTtl = float(os.environ.get('PredictionCacheTtl', '60'))
+defaultSize = int(os.environ.get('PredictionCacheSize', '1000'))
+
+
+class MemoryStore(object):
+
+    def __init__(self, maxEntries):
+        self.maxEntries = maxEntries
+        self.entries = collections.OrderedDict()
+        self.tagged = {}
+
+    def __len__(self):
+        return len(self.entries)
+
+    def get(self, key, now):
+        """Returns ((expires, tags, value), expired); the entry is None on a miss."""
+        entry = self.entries.get(key)
+        if entry is None:
+            return None, False
+        if entry[0] <= now:
+            self.discard(key)
+            return None, True
+        self.entries.move_to_end(key)
+        return entry, False
+
+    def put(self, key, value, expires, tags):
+        """Stores an entry and returns the number of entries evicted to make room."""
+        self.discard(key)
+        self.entries[key] = (expires, tags, value)
+        for tag in tags:
+            self.tagged.setdefault(tag, set()).add(key)
+        evicted = 0
+        while len(self.entries) > self.maxEntries:
+            self.discard(next(iter(self.entries)))
+            evicted += 1
+        return evicted
+
+    def discard(self, key):
+        entry = self.entries.pop(key, None)
+        if entry is not None:
+            for tag in entry[1]:
+                keys = self.tagged.get(tag)
+                keys.discard(key)
+                if not keys:
+                    del self.tagged[tag]
+
+    def invalidate(self, tags):
+        keys = set(key for tag in tags for key in self.tagged.get(tag, ()))
+        for key in keys:
+            self.discard(key)
+        return len(keys)
+
+
+class SqliteStore(object):
+    """Entries, their tags and published invalidations in one SQLite file."""
+
+    # invalidations older than this are pruned; a process idle for longer
+    # clears its local entries instead of replaying them
+    invalidationRetention = 3600
+
+    def __init__(self, path, maxEntries):
+        self.maxEntries = maxEntries
+        self.db = sqlite3.connect(path, timeout = 30, isolation_level = None)
+        self.db.execute('PRAGMA journal_mode=WAL')
+        self.db.execute('CREATE TABLE IF NOT EXISTS entries (key TEXT PRIMARY KEY, value TEXT, tags TEXT, expires REAL, used REAL)')
+        self.db.execute('CREATE TABLE IF NOT EXISTS tags (tag TEXT, key TEXT)')
+        self.db.execute('CREATE INDEX IF NOT EXISTS tagsByTag ON tags (tag)')
+        self.db.execute('CREATE INDEX IF NOT EXISTS tagsByKey ON tags (key)')
+        self.db.execute('CREATE TABLE IF NOT EXISTS invalidations (seq INTEGER PRIMARY KEY AUTOINCREMENT, tag TEXT, at REAL)')
+
+    def get(self, key, now):
+        row = self.db.execute('SELECT expires, tags, value FROM entries WHERE key = ?', (key,)).fetchone()
+        if row is None:
+            return None, False
+        if row[0] <= now:
+            self.delete([key])
+            return None, True
+        self.db.execute('UPDATE entries SET used = ? WHERE key = ?', (now, key))
+        return (row[0], tuple(json.loads(row[1])), json.loads(row[2])), False
+
+    def put(self, key, value, expires, tags):
+        with self.db:
+            self.db.execute('BEGIN IMMEDIATE')
+            self.db.execute('DELETE FROM tags WHERE key = ?', (key,))
+            self.db.execute('INSERT OR REPLACE INTO entries VALUES (?, ?, ?, ?, ?)', (key, json.dumps(value), json.dumps(tags), expires, time.time()))
+            self.db.executemany('INSERT INTO tags VALUES (?, ?)', [(tag, key) for tag in tags])
+            stale = [row[0] for row in self.db.execute('SELECT key FROM entries ORDER BY used DESC LIMIT -1 OFFSET ?', (self.maxEntries,))]
+            self.delete(stale)
+        return len(stale)
+
+    def delete(self, keys):
+        for start in range(0, len(keys), 500):
+            chunk = keys[start:start + 500]
+            marks = ','.join('?' * len(chunk))
+            self.db.execute('DELETE FROM entries WHERE key IN (%s)' % marks, chunk)
+            self.db.execute('DELETE FROM tags WHERE key IN (%s)' % marks, chunk)
+
+    def invalidate(self, tags):
+        now = time.time()
+        with self.db:
+            self.db.execute('BEGIN IMMEDIATE')
+            marks = ','.join('?' * len(tags))
+            keys = [row[0] for row in self.db.execute('SELECT DISTINCT key FROM tags WHERE tag IN (%s)' % marks, tags)]
+            self.delete(keys)
+            self.db.executemany('INSERT INTO invalidations (tag, at) VALUES (?, ?)', [(tag, now) for tag in tags])
+            self.db.execute('DELETE FROM invalidations WHERE at < ?', (now - self.invalidationRetention,))
+        return len(keys)
+
+    def invalidationsSince(self, seq):
+        """Returns (latest sequence number, tags invalidated after `seq`), or (latest, None) if some were pruned."""
+        rows = self.db.execute('SELECT seq, tag FROM invalidations WHERE seq > ? ORDER BY seq', (seq,)).fetchall()
+        if rows:
+            oldest = self.db.execute('SELECT MIN(seq) FROM invalidations').fetchone()[0]
+            return rows[-1][0], (None if seq and oldest > seq + 1 else [row[1] for row in rows])
+        latest = self.db.execute('SELECT MAX(seq) FROM invalidations').fetchone()[0]
+        return latest or seq, []
+
+
+class ResultCache(object):
+
+    def __init__(self, shared = None, ttl = defaultTtl, maxEntries = defaultSize):
+        self.local = MemoryStore(maxEntries)
+        self.shared = shared
+        self.ttl = ttl
+        self.seq = shared.invalidationsSince(0)[0] if shared is not None else 0
+        self.counters = dict.fromkeys(['hits', 'sharedHits', 'misses', 'evictions', 'expirations', 'invalidations'], 0)
+
+    def key(self, endpoint, params):
+        return json.dumps([endpoint, {name: value for name, value in params.items() if value is not None}], sort_keys = True, separators = (',', ':'))
+
+    def sync(self):
+        # drop local copies of entries another process has invalidated
+        if self.shared is None:
+            return
+        self.seq, tags = self.shared.invalidationsSince(self.seq)
+        if tags is None:
+            self.local = MemoryStore(self.local.maxEntries)
+        elif tags:
+            self.local.invalidate(tags)
+
+    def get(self, endpoint, params):
+        self.sync()
+        key = self.key(endpoint, params)
+        now = time.time()
+        entry, expired = self.local.get(key, now)
+        self.counters['expirations'] += expired
+        if entry is None and self.shared is not None:
+            entry, expired = self.shared.get(key, now)
+            self.counters['expirations'] += expired
+            if entry is not None:
+                self.counters['sharedHits'] += 1
+                self.counters['evictions'] += self.local.put(key, entry[2], entry[0], entry[1])
+        self.counters['hits' if entry is not None else 'misses'] += 1
+        return None if entry is None else entry[2]
+
+    def put(self, endpoint, params, value, tags = (), ttl = None):
+        key = self.key(endpoint, params)
+        expires = time.time() + (self.ttl if ttl is None else ttl)
+        tags = tuple(tag for tag in tags if tag is not None)
+        self.counters['evictions'] += self.local.put(key, value, expires, tags)
+        if self.shared is not None:
+            self.counters['evictions'] += self.shared.put(key, value, expires, tags)
+
+    def invalidate(self, tags):
+        tags = list(dict.fromkeys(tag for tag in tags if tag is not None))
+        if not tags:
+            return 0
+        dropped = self.local.invalidate(tags)
+        if self.shared is not None:
+            dropped = max(dropped, self.shared.invalidate(tags))
+        self.counters['invalidations'] += dropped
+        return dropped
+
+    def stats(self):
+        return {**self.counters, 'size': len(self.local)}
+
+
+def fromSpec(spec):
+    if spec == 'memory':
+        return ResultCache()
+    kind, _, target = spec.partition(':')
+    if kind == 'sqlite':
+        return ResultCache(SqliteStore(target, defaultSize))
+    raise ValueError('unknown prediction cache ' + spec)
+
+predictionCache = None
+
+def cache():
+    global predictionCache
+    if predictionCache is None:
+        predictionCache = fromSpec(os.environ.get('PredictionCache', 'memory'))
+    return predictionCache
+
+def endpointTag(endpoint, *qualifiers):
+    # not a vertex id, so it cannot collide with a player's tag
+    return ':'.join(('endpoint', endpoint) + qualifiers)
+
+def response(endpoint, params, compute, tags = ()):
+    """
+    The cached handler response for `endpoint` and `params`, or the result of
+    compute() if there is none. Only 200 responses are cached, with `tags`, or
+    the tags `tags()` returns if it is a function. The response's X-Cache
+    header says whether it was a hit. Requests with profile=true are always
+    computed, so that there is a traversal to profile.
+    """
+    if instrumentation.profiling():
+        return compute()
+    cached = cache().get(endpoint, params)
+    if cached is not None:
+        return {**cached, 'headers': {'X-Cache': 'hit'}}
+    result = compute()
+    if result.get('statusCode') == 200:
+        cache().put(endpoint, params, result, tags() if callable(tags) else tags)
+    return {**result, 'headers': {**result.get('headers', {}), 'X-Cache': 'miss'}}
+
+def invalidate(tags):
+    """Drops the cached results of `tags`, players or endpointTag()s; called by the write handlers."""
+    return cache().invalidate(tags)
+
+def stats():
+    return cache().stats()
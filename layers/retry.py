@@ -0,0 +1,173 @@
+"""
+Retries for counter writes that conflict on hot vertices.
+
+Neptune rejects a transaction that touches a vertex another transaction is
+writing with a ConcurrentModificationException. The write itself is fine and
+succeeds when tried again. retryable() recognises these errors and the other
+transient ones Neptune reports (throttling, a writer failover). A query that
+ran out of memory would usually do so again, so it is not retried. withRetry() retries them up to `WriteRetries` times (default 5),
+sleeping a random time of up to `RetryBaseMillis` (default 50) doubled on every
+attempt and capped at `RetryMaxMillis` (default 2000). A write that still fails
+is a lost update; the handlers answer it with 503 so the caller can send it
+again.
+
+With `HotKeySerialization` set to `on`, serialized() also lets only one write
+per key run at a time within a process. Increments that arrive while it runs
+are merged and written together by the next write, so a popular player costs
+one write per round trip rather than one conflict per event. Each caller writes
+at most one merged batch, then hands the key to a caller of the next one, so
+no caller's latency grows with the other callers' traffic.
+
+stats() reports the attempts, retries, conflicts, lost updates and merged
+increments of the process. Retries and lost updates are also counted in each
+invocation's metrics.
+"""
+
+import logging
+import os
+import random
+import threading
+import time
+
+import instrumentation
+
+logger = logging.getLogger(__name__)
+
+writeRetries = int(os.environ.get('WriteRetries', '5'))
+baseMillis = float(os.environ.get('RetryBaseMillis', '50'))
+maxMillis = float(os.environ.get('RetryMaxMillis', '2000'))
+hotKeySerialization = os.environ.get('HotKeySerialization', 'off') == 'on'
+
+# error codes of failures that a later attempt of the same write can get past
+conflictCodes = ('ConcurrentModificationException',)
+transientCodes = ('ThrottlingException', 'TooManyRequestsException', 'ReadOnlyViolationException')
+
+counters = dict.fromkeys(['attempts', 'retries', 'conflicts', 'lostUpdates', 'merged'], 0)
+
+
+def classify(e):
+    """'conflict', 'transient', or None if retrying `e` would not help. `e` may be an error message."""
+    message = str(e)
+    if any(code in message for code in conflictCodes):
+        return 'conflict'
+    if any(code in message for code in transientCodes):
+        return 'transient'
+    return None
+
+def retryable(e):
+    return classify(e) is not None
+
+def backoff(attempt):
+    # full jitter, so writers that conflicted once do not collide again
+    return random.uniform(0, min(maxMillis, baseMillis * 2 ** attempt)) / 1000
+
+def withRetry(write):
+    for attempt in range(writeRetries + 1):
+        counters['attempts'] += 1
+        try:
+            return write()
+        except Exception as e:
+            kind = classify(e)
+            if kind == 'conflict':
+                counters['conflicts'] += 1
+            if kind is None:
+                raise
+            if attempt == writeRetries:
+                counters['lostUpdates'] += 1
+                instrumentation.count('lostUpdates')
+                logger.warning('write failed after %d attempts: %s', attempt + 1, e)
+                raise
+            counters['retries'] += 1
+            instrumentation.count('writeRetries')
+            time.sleep(backoff(attempt))
+
+def statusCode(e):
+    # 503 tells the caller to send a write that lost to its conflicts again
+    return 503 if retryable(e) else 400
+
+
+class Batch(object):
+    """Increments to one key waiting for the same write."""
+
+    def __init__(self, write):
+        # every caller for a key writes the same way, the first one's is used
+        self.write = write
+        self.deltas = {}
+        self.callers = 0
+        # set when the batch is written, or when one of its callers is to write it
+        self.wake = threading.Event()
+        self.handedOff = False
+        self.claimed = False
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class KeySerializer(object):
+    """Runs one write per key at a time and merges the increments that queue up behind it."""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.waiting = {}
+        self.running = set()
+
+    def submit(self, key, deltas, write):
+        with self.lock:
+            batch = self.waiting.get(key)
+            if batch is None:
+                batch = self.waiting[key] = Batch(write)
+            for name, amount in deltas.items():
+                batch.deltas[name] = batch.deltas.get(name, 0) + amount
+            batch.callers += 1
+            leader = key not in self.running
+            if leader:
+                self.running.add(key)
+        if not leader:
+            batch.wake.wait()
+            with self.lock:
+                # the previous writer handed the key to this batch; one of its
+                # callers writes it
+                leader = batch.handedOff and not batch.claimed
+                batch.claimed = batch.claimed or leader
+        if leader:
+            self.writeNext(key)
+        batch.done.wait()
+        if batch.error is not None:
+            raise batch.error
+        return batch.result
+
+    def writeNext(self, key):
+        # writes the batch waiting for the key, then hands the key to the batch
+        # that queued up behind it, if any
+        with self.lock:
+            batch = self.waiting.pop(key)
+        counters['merged'] += batch.callers - 1
+        try:
+            batch.result = batch.write(batch.deltas)
+        except Exception as e:
+            batch.error = e
+        batch.done.set()
+        batch.wake.set()
+        with self.lock:
+            following = self.waiting.get(key)
+            if following is None:
+                self.running.discard(key)
+            else:
+                following.handedOff = True
+                following.wake.set()
+
+
+serializer = KeySerializer()
+
+def serialized(key, deltas, write):
+    """
+    Calls write(deltas) with retries. With `HotKeySerialization` on, deltas
+    ({name: increment}) for a `key` that is already being written are merged
+    with any others waiting and written once the running write is done.
+    """
+    if not hotKeySerialization:
+        return withRetry(lambda: write(deltas))
+    return serializer.submit(key, deltas, lambda merged: withRetry(lambda: write(merged)))
+
+def stats():
+    return dict(counters)
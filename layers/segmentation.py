@@ -0,0 +1,275 @@
+"""
+Cohort segmentation over columnar player attributes.
+
+Segmenting players with has() filters costs a Neptune scan per cohort. Columns
+instead keeps the numeric player attributes whose names start with one of
+`SegmentationPrefixes` (default `ea_,stat_`) as float64 NumPy arrays, NaN where
+a player has no value, with the players sorted by id. columns() loads them from
+`SegmentationSource` and loads them again every `SegmentationRefresh` seconds
+(default 300):
+
+    columns:<path>     columns saved by publish(), a local path or s3://bucket/key
+    snapshot:<path>    a snapshot saved by tools/snapshot.py
+    graph              read from the reader endpoint in the calling process
+
+Deployed, the segmentation worker (workers/segmentation/app.py) reads the
+columns from the graph on a schedule and publishes them to S3, so no request
+waits on a scan of every player.
+
+A cohort is defined by a condition on the attributes:
+
+    {"attribute": "ea_malice", "gte": 5}         also gt, lt, lte, eq and ne
+    {"attribute": "stat_idleMinutes", "between": [10, 60]}
+    {"attribute": "ea_atrisk", "missing": true}
+    {"and": [...]}, {"or": [...]}, {"not": {...}}
+
+Several tests in one condition must all hold. evaluate() takes any number of
+cohorts and evaluates them in one pass: each distinct comparison is computed
+once, and all the thresholds compared with one attribute by the same operator
+are applied to its column together by broadcasting. A cohort's members are kept
+as a bitset, one bit per player in id order (np.packbits).
+"""
+
+import base64
+import io
+import os
+import time
+
+import numpy as np
+
+import snapshot
+
+prefixes = tuple(prefix for prefix in os.environ.get('SegmentationPrefixes', 'ea_,stat_').split(',') if prefix)
+refreshSeconds = float(os.environ.get('SegmentationRefresh', '300'))
+
+comparisons = {
+    'gt': np.greater,
+    'gte': np.greater_equal,
+    'lt': np.less,
+    'lte': np.less_equal,
+    'eq': np.equal,
+    'ne': np.not_equal
+}
+
+
+def segmented(name):
+    # time buckets (see timebuckets.py) are never attributes
+    return name.startswith(prefixes) and '@' not in name
+
+
+class Unavailable(Exception):
+    """The columns have not been published yet."""
+
+
+class Columns(object):
+    """The segmented attributes of every player, one array per attribute, players in id order."""
+
+    def __init__(self, ids, columns, refreshedAt = None):
+        order = np.argsort(np.asarray(ids, dtype = str), kind = 'stable')
+        self.ids = np.asarray(ids, dtype = object)[order]
+        self.columns = {name: np.asarray(values, dtype = np.float64)[order] for name, values in columns.items()}
+        self.refreshedAt = time.time() if refreshedAt is None else refreshedAt
+
+    def __len__(self):
+        return len(self.ids)
+
+    def column(self, name):
+        try:
+            return self.columns[name]
+        except KeyError:
+            raise ValueError('unknown attribute ' + str(name))
+
+    def save(self, f):
+        arrays = {'ids': np.asarray(self.ids, dtype = str), 'refreshedAt': np.float64(self.refreshedAt)}
+        for name, values in self.columns.items():
+            arrays['column/' + name] = values
+        np.savez_compressed(f, **arrays)
+
+
+def fromArrays(f):
+    """Reads columns written by Columns.save()."""
+    with np.load(f) as arrays:
+        columns = {key[len('column/'):]: arrays[key] for key in arrays.files if key.startswith('column/')}
+        return Columns(arrays['ids'].tolist(), columns, float(arrays['refreshedAt']))
+
+
+class Cohort(object):
+
+    def __init__(self, mask):
+        self.count = len(mask)
+        self.size = int(np.count_nonzero(mask))
+        self.bits = np.packbits(mask)
+
+    def mask(self):
+        return np.unpackbits(self.bits, count = self.count).astype(bool)
+
+    def members(self, ids, offset = 0, limit = None):
+        positions = np.flatnonzero(self.mask())
+        end = None if limit is None else offset + limit
+        return ids[positions[offset:end]].tolist()
+
+    def encoded(self):
+        return base64.b64encode(self.bits.tobytes()).decode('ascii')
+
+
+class Plan(object):
+    """The distinct comparisons the cohorts of one evaluate() call need."""
+
+    def __init__(self):
+        self.tests = {}
+
+    def test(self, attribute, op, value = None):
+        return ('test', self.tests.setdefault((attribute, op, value), len(self.tests)))
+
+    def compile(self, condition):
+        """The condition as a tree of ('and'|'or', [nodes]), ('not', node) and ('test', index) nodes."""
+        if not isinstance(condition, dict) or not condition:
+            raise ValueError('a condition must be a non-empty object, got ' + repr(condition))
+        for kind in ('and', 'or'):
+            if kind in condition:
+                if not isinstance(condition[kind], list) or not condition[kind] or len(condition) > 1:
+                    raise ValueError('"%s" must be the only key and a non-empty list' % kind)
+                return (kind, [self.compile(child) for child in condition[kind]])
+        if 'not' in condition:
+            if len(condition) > 1:
+                raise ValueError('"not" must be the only key')
+            return ('not', self.compile(condition['not']))
+        attribute = condition.get('attribute')
+        if not isinstance(attribute, str) or len(condition) < 2:
+            raise ValueError('a test needs an attribute and at least one of %s, between or missing' % ', '.join(comparisons))
+        nodes = []
+        for op, value in condition.items():
+            if op == 'attribute':
+                continue
+            if op in comparisons:
+                nodes.append(self.test(attribute, op, number(value)))
+            elif op == 'between':
+                if not isinstance(value, list) or len(value) != 2:
+                    raise ValueError('between takes [low, high]')
+                nodes.append(self.test(attribute, 'gte', number(value[0])))
+                nodes.append(self.test(attribute, 'lte', number(value[1])))
+            elif op == 'missing':
+                if not isinstance(value, bool):
+                    raise ValueError('missing takes true or false')
+                missing = self.test(attribute, 'missing')
+                nodes.append(missing if value else ('not', missing))
+            else:
+                raise ValueError('unknown test ' + str(op))
+        return nodes[0] if len(nodes) == 1 else ('and', nodes)
+
+    def run(self, columns):
+        """A boolean mask for every test."""
+        masks = [None] * len(self.tests)
+        groups = {}
+        for (attribute, op, value), index in self.tests.items():
+            groups.setdefault((attribute, op), []).append((value, index))
+        for (attribute, op), tests in groups.items():
+            column = columns.column(attribute)
+            if op == 'missing':
+                masks[tests[0][1]] = np.isnan(column)
+                continue
+            # shape (thresholds, players); NaN, a missing value, fails every comparison
+            thresholds = np.array([value for value, index in tests])
+            results = comparisons[op](column[np.newaxis, :], thresholds[:, np.newaxis])
+            if op == 'ne':
+                results &= ~np.isnan(column)
+            for row, (value, index) in enumerate(tests):
+                masks[index] = results[row]
+        return masks
+
+
+def number(value):
+    if isinstance(value, bool) or not isinstance(value, (int, float)):
+        raise ValueError('expected a number, got ' + repr(value))
+    return float(value)
+
+def combine(node, masks):
+    if node[0] == 'test':
+        return masks[node[1]]
+    if node[0] == 'not':
+        return ~combine(node[1], masks)
+    parts = [combine(child, masks) for child in node[1]]
+    return np.logical_and.reduce(parts) if node[0] == 'and' else np.logical_or.reduce(parts)
+
+def evaluate(cohorts, columns):
+    """{name: Cohort} for `cohorts`, {name: condition}. Raises ValueError for a malformed condition."""
+    plan = Plan()
+    trees = {name: plan.compile(condition) for name, condition in cohorts.items()}
+    masks = plan.run(columns)
+    return {name: Cohort(combine(tree, masks)) for name, tree in trees.items()}
+
+def fromSnapshot(graph):
+    players = graph.players()
+    return Columns(graph.ids[players], {name: values[players] for name, values in graph.properties.items() if segmented(name)})
+
+def fromGraph(g, pageSize = 10000):
+    """Reads the segmented attributes of every player through the traversal source `g` in one streamed traversal."""
+    from gremlin_python.process.graph_traversal import __
+    from gremlin_python.process.traversal import T
+    from gremlin_python.process.traversal import TextP
+
+    # only the segmented properties are sent, not the act_ counters and buckets
+    keys = TextP.startingWith(prefixes[0])
+    for prefix in prefixes[1:]:
+        keys = keys.or_(TextP.startingWith(prefix))
+    builder = snapshot.Builder({}, {})
+    query = g.V().hasLabel('player').project('id', 'properties')                                     \
+        .by(T.id)                                                                                    \
+        .by(__.properties().hasKey(keys).group().by(T.key).by(__.value()))
+    for page in snapshot.pages(query, pageSize):
+        builder.addVertices([vertex['id'] for vertex in page], ['player'] * len(page), snapshot.pageColumns([vertex['properties'] for vertex in page]))
+    return fromSnapshot(builder.build())
+
+def s3Location(path):
+    bucket, _, key = path[len('s3://'):].partition('/')
+    return bucket, key
+
+def publish(columns, path):
+    """Saves `columns` for columns() to load from `columns:<path>`."""
+    if not path.startswith('s3://'):
+        with open(path, 'wb') as f:
+            columns.save(f)
+        return
+    import boto3
+    buffer = io.BytesIO()
+    columns.save(buffer)
+    bucket, key = s3Location(path)
+    boto3.client('s3').put_object(Bucket = bucket, Key = key, Body = buffer.getvalue())
+
+def fromPublished(path):
+    if not path.startswith('s3://'):
+        try:
+            return fromArrays(path)
+        except FileNotFoundError:
+            raise Unavailable('no columns published to ' + path + ' yet')
+    import boto3
+    s3 = boto3.client('s3')
+    bucket, key = s3Location(path)
+    try:
+        body = s3.get_object(Bucket = bucket, Key = key)['Body'].read()
+    except s3.exceptions.NoSuchKey:
+        raise Unavailable('no columns published to ' + path + ' yet')
+    return fromArrays(io.BytesIO(body))
+
+def load(source):
+    if source == 'graph':
+        import connection
+        return fromGraph(connection.reader)
+    kind, _, target = source.partition(':')
+    if kind == 'columns':
+        return fromPublished(target)
+    if kind == 'snapshot':
+        return fromSnapshot(snapshot.load(target))
+    raise ValueError('unknown segmentation source ' + source)
+
+loaded = None
+loadedAt = 0
+
+def columns():
+    global loaded, loadedAt
+    # timed from the load, not from refreshedAt, which published columns carry
+    # from when the worker read them
+    if loaded is None or time.time() - loadedAt > refreshSeconds:
+        loaded = load(os.environ.get('SegmentationSource', 'graph'))
+        loadedAt = time.time()
+    return loaded
@@ -0,0 +1,414 @@
+"""
+In-memory snapshot of the cohort graph for offline analysis.
+
+Vertices are remapped to integers 0..n-1. Each edge label is stored as CSR
+adjacency: `indptr` and `indices` arrays, plus one NumPy column per numeric
+edge property in the same order. Numeric vertex properties (`ea_*`, `stat_*`,
+...) are float64 columns with NaN where a vertex has no value. A snapshot is
+built from Neptune load format CSV files or exported from a live graph through
+Gremlin. It answers the prediction queries over the whole player base without
+Neptune.
+
+The sample data uses different labels from the API (`Interactions` rather than
+`interaction_edge`, for example). `labelAliases` and `propertyAliases` map them
+to the API names on the way in.
+"""
+
+import csv
+import itertools
+import json
+import os
+
+import numpy as np
+
+import neptunecsv
+
+labelAliases = {
+    'Interactions': 'interaction_edge',
+    'EngagedIn': 'action_edge',
+    'CustomerMarketingInteractions': 'campaign_edge'
+}
+propertyAliases = {
+    'iterations': 'count'
+}
+
+# weight of each action count on an interaction edge for collaborativeFilter,
+# as in the API handler, which takes them from `RecommendationWeights` as well
+recommendationWeights = json.loads(os.environ.get('RecommendationWeights') or 'null') or {
+    'action_chat': 1,
+    'action_partyjoin': 5,
+    'action_randomheal': 3,
+    'action_endorse': 10
+}
+
+# actions the relatedUsers prediction treats as bad behaviour
+badActions = ['action_report', 'action_badimage', 'action_badlanguage', 'action_badname', 'action_sharepii']
+
+numericTypes = ('int', 'long', 'short', 'byte', 'float', 'double', 'bool', 'boolean')
+
+
+class Adjacency(object):
+    """Edges of one label in CSR form, sorted by source vertex."""
+
+    def __init__(self, vertexCount, sources, targets, properties = None):
+        sources = np.asarray(sources, dtype = np.int64)
+        targets = np.asarray(targets, dtype = np.int64)
+        order = np.argsort(sources, kind = 'stable')
+        self.indptr = np.zeros(vertexCount + 1, dtype = np.int64)
+        np.cumsum(np.bincount(sources, minlength = vertexCount), out = self.indptr[1:])
+        self.indices = targets[order]
+        self.properties = {name: np.asarray(values, dtype = np.float64)[order] for name, values in (properties or {}).items()}
+        self.transposed = None
+
+    def __len__(self):
+        return len(self.indices)
+
+    def neighbours(self, vertex):
+        return self.indices[self.indptr[vertex]:self.indptr[vertex + 1]]
+
+    def sources(self):
+        # source vertex of every edge, in CSR order
+        return np.repeat(np.arange(len(self.indptr) - 1), np.diff(self.indptr))
+
+    def reverse(self):
+        # in-edges, built on first use
+        if self.transposed is None:
+            self.transposed = Adjacency(len(self.indptr) - 1, self.indices, self.sources(), self.properties)
+        return self.transposed
+
+
+def ranges(starts, ends):
+    # positions starts[0]..ends[0]-1, starts[1]..ends[1]-1, ... without a Python loop
+    lengths = ends - starts
+    offsets = np.repeat(starts - np.cumsum(lengths) + lengths, lengths)
+    return offsets + np.arange(lengths.sum())
+
+
+class Snapshot(object):
+
+    def __init__(self, ids, labels, properties, edges):
+        self.ids = np.asarray(ids, dtype = object)
+        self.index = {vertexId: i for i, vertexId in enumerate(ids)}
+        self.labels = np.asarray(labels, dtype = object)
+        self.properties = properties
+        self.edges = edges
+
+    def __len__(self):
+        return len(self.ids)
+
+    def vertex(self, vertexId):
+        try:
+            return self.index[vertexId]
+        except KeyError:
+            raise KeyError('vertex %s is not in the snapshot' % vertexId)
+
+    def adjacency(self, label):
+        if label not in self.edges:
+            self.edges[label] = Adjacency(len(self), [], [])
+        return self.edges[label]
+
+    def column(self, name):
+        return self.properties.get(name, np.full(len(self), np.nan))
+
+    def players(self):
+        return self.labels == 'player'
+
+    def engaged(self, action):
+        """Boolean mask of the vertices with an action_edge to `action`."""
+        mask = np.zeros(len(self), dtype = bool)
+        if action in self.index:
+            mask[self.adjacency('action_edge').reverse().neighbours(self.index[action])] = True
+        return mask
+
+    def badActors(self, action):
+        """
+        [player, target] id pairs where the player has negative reputation,
+        engaged in `action` and interacted with the target, and the target also
+        engaged in `action`. Ordered by the two ids, as the badActors API pages
+        them.
+        """
+        engaged = self.engaged(action)
+        bad = self.players() & (self.column('ea_reputation') < 0) & engaged
+        interactions = self.adjacency('interaction_edge')
+        sources = interactions.sources()
+        keep = bad[sources] & engaged[interactions.indices]
+        return sorted([self.ids[p], self.ids[q]] for p, q in zip(sources[keep], interactions.indices[keep]))
+
+    def interactionWeights(self, weights = None):
+        # weight of every interaction edge in CSR order: its action counts times
+        # the action weights, missing counts as 0
+        interactions = self.adjacency('interaction_edge')
+        total = np.zeros(len(interactions))
+        for action, weight in (weights or recommendationWeights).items():
+            if action in interactions.properties:
+                total += weight * np.nan_to_num(interactions.properties[action])
+        return total
+
+    def collaborativeFilter(self, player, top = None, weights = None):
+        """
+        Players two interaction_edge hops from `player` that are not the player
+        or one of its direct out-neighbours, with their scores, highest first.
+        """
+        return next(self.collaborativeFilters([player], top, weights))[1]
+
+    def collaborativeFilters(self, players = None, top = None, weights = None, blockSize = 2000):
+        """
+        collaborativeFilter() for many players at once, every player by default.
+        Yields (player, {candidate: score}); players are processed a block at a
+        time so the two-hop expansion stays bounded in memory.
+
+        As in the collaborativeFilter API, a candidate's score is the sum over
+        the paths player -> friend -> candidate of the product of the two edges'
+        weights, candidates without a positive score are left out and ties are
+        ordered by id. Unlike the API, every edge is followed, not a sample.
+        """
+        interactions = self.adjacency('interaction_edge')
+        indptr, indices = interactions.indptr, interactions.indices
+        edgeWeights = self.interactionWeights(weights)
+        n = len(self)
+        rank = np.empty(n, dtype = np.int64)
+        rank[np.argsort(np.asarray(self.ids, dtype = str), kind = 'stable')] = np.arange(n)
+        starts = np.flatnonzero(self.players()) if players is None else np.array([self.vertex(player) for player in players], dtype = np.int64)
+        for block in range(0, len(starts), blockSize):
+            owners = starts[block:block + blockSize]
+            first = ranges(indptr[owners], indptr[owners + 1])
+            friendOwners = np.repeat(owners, indptr[owners + 1] - indptr[owners])
+            friends = indices[first]
+            lengths = indptr[friends + 1] - indptr[friends]
+            second = ranges(indptr[friends], indptr[friends + 1])
+            reached = indices[second]
+            reachedOwners = np.repeat(friendOwners, lengths)
+            scores = np.repeat(edgeWeights[first], lengths) * edgeWeights[second]
+            # one int64 key per (player, candidate) pair, so exclusion and summing are set operations
+            keys = reachedOwners * n + reached
+            keep = (reached != reachedOwners) & ~np.isin(keys, friendOwners * n + friends)
+            keys, inverse = np.unique(keys[keep], return_inverse = True)
+            totals = np.bincount(inverse, weights = scores[keep], minlength = len(keys))
+            positive = totals > 0
+            keys, totals = keys[positive], totals[positive]
+            keyOwners, candidates = keys // n, keys % n
+            order = np.lexsort((rank[candidates], -totals, keyOwners))
+            totals, keyOwners, candidates = totals[order], keyOwners[order], candidates[order]
+            bounds = np.searchsorted(keyOwners, owners, side = 'left'), np.searchsorted(keyOwners, owners, side = 'right')
+            for owner, first, last in zip(owners, *bounds):
+                if top is not None:
+                    last = min(last, first + top)
+                yield self.ids[owner], {self.ids[candidate]: float(score) for candidate, score in zip(candidates[first:last], totals[first:last])}
+
+    def relatedUsers(self, playerAttribute, actions = badActions):
+        """
+        Paths player -interaction_edge-> target -action_edge-> action for players
+        with a negative `playerAttribute` who took the same bad action as the
+        target, in the shape the relatedUsers API returns.
+        """
+        players = self.players() & (self.column(playerAttribute) < 0)
+        interactions = self.adjacency('interaction_edge')
+        sources = interactions.sources()
+        keep = players[sources]
+        sources, targets = sources[keep], interactions.indices[keep]
+        paths = []
+        for action in actions:
+            if action not in self.index:
+                continue
+            engaged = self.engaged(action)
+            both = engaged[sources] & engaged[targets]
+            paths.extend(
+                [self.ids[p], 'interaction_edge', self.ids[q], 'action_edge', action, 'action_edge', self.ids[p]]
+                for p, q in zip(sources[both], targets[both])
+            )
+        return paths
+
+    def triadicClosure(self, action, player = None):
+        """
+        Players the player interacted with where both engaged in `action`. With
+        no player, returns {player: [targets]} for every player that has any.
+        """
+        engaged = self.engaged(action)
+        interactions = self.adjacency('interaction_edge')
+        if player is not None:
+            start = self.vertex(player)
+            if not engaged[start]:
+                return []
+            return [self.ids[q] for q in interactions.neighbours(start) if engaged[q]]
+        sources = interactions.sources()
+        keep = engaged[sources] & engaged[interactions.indices]
+        result = {}
+        for p, q in zip(sources[keep], interactions.indices[keep]):
+            result.setdefault(self.ids[p], []).append(self.ids[q])
+        return result
+
+    def save(self, path):
+        arrays = {
+            'ids': np.asarray(self.ids, dtype = str),
+            'labels': np.asarray(self.labels, dtype = str)
+        }
+        for name, values in self.properties.items():
+            arrays['vertex/' + name] = values
+        for label, adjacency in self.edges.items():
+            arrays['edges/%s/indptr' % label] = adjacency.indptr
+            arrays['edges/%s/indices' % label] = adjacency.indices
+            for name, values in adjacency.properties.items():
+                arrays['edges/%s/property/%s' % (label, name)] = values
+        np.savez_compressed(path, **arrays)
+
+
+class Builder(object):
+    """Accumulates vertices and edges a chunk at a time, then packs them into a Snapshot."""
+
+    def __init__(self, labels = None, properties = None):
+        self.labelNames = labelAliases if labels is None else labels
+        self.propertyNames = propertyAliases if properties is None else properties
+        self.ids = []
+        self.index = {}
+        self.labels = []
+        self.columns = {}
+        self.edges = {}
+
+    def vertices(self, vertexIds):
+        indexes = np.empty(len(vertexIds), dtype = np.int64)
+        for position, vertexId in enumerate(vertexIds):
+            i = self.index.get(vertexId)
+            if i is None:
+                i = self.index[vertexId] = len(self.ids)
+                self.ids.append(vertexId)
+                self.labels.append(None)
+            indexes[position] = i
+        return indexes
+
+    def addVertices(self, vertexIds, labels, columns):
+        """`columns` maps property names to float arrays aligned with `vertexIds`, NaN where missing."""
+        indexes = self.vertices(vertexIds)
+        for i, label in zip(indexes, labels):
+            self.labels[i] = self.labelNames.get(label, label)
+        for name, values in columns.items():
+            self.columns.setdefault(self.propertyNames.get(name, name), []).append((indexes, values))
+
+    def addEdges(self, labels, fromIds, toIds, columns):
+        sources = self.vertices(fromIds)
+        targets = self.vertices(toIds)
+        labels = np.asarray([self.labelNames.get(label, label) for label in labels], dtype = object)
+        for label in set(labels):
+            keep = labels == label
+            self.edges.setdefault(label, []).append((
+                sources[keep],
+                targets[keep],
+                {self.propertyNames.get(name, name): values[keep] for name, values in columns.items()}
+            ))
+
+    def build(self):
+        n = len(self.ids)
+        properties = {}
+        for name, chunks in self.columns.items():
+            column = np.full(n, np.nan)
+            for indexes, values in chunks:
+                column[indexes] = values
+            properties[name] = column
+        edges = {}
+        for label, chunks in self.edges.items():
+            names = set(name for chunk in chunks for name in chunk[2])
+            columns = {
+                name: np.concatenate([chunk[2].get(name, np.full(len(chunk[0]), np.nan)) for chunk in chunks])
+                for name in names
+            }
+            sources = np.concatenate([chunk[0] for chunk in chunks])
+            targets = np.concatenate([chunk[1] for chunk in chunks])
+            edges[label] = Adjacency(n, sources, targets, columns)
+        labels = [label or 'vertex' for label in self.labels]
+        return Snapshot(self.ids, labels, properties, edges)
+
+
+def numericColumn(values, kind):
+    if kind in ('bool', 'boolean'):
+        return np.array([value.lower() == 'true' if value else np.nan for value in values], dtype = np.float64)
+    return np.array([value or 'nan' for value in values], dtype = np.float64)
+
+def fromCsv(paths, labels = None, properties = None, chunkSize = 100000):
+    """Builds a snapshot from Neptune load format files. Vertex files are read first."""
+    builder = Builder(labels, properties)
+    for path in sorted(paths, key = neptunecsv.isEdgeFile):
+        columns = neptunecsv.header(path)
+        positions = {column.name: i for i, column in enumerate(columns) if column.isSystem}
+        # only the system columns and numeric properties are kept
+        numeric = [(i, column) for i, column in enumerate(columns) if not column.isSystem and column.type in numericTypes and not column.isArray]
+        with open(path, newline = '', encoding = 'utf-8') as f:
+            records = csv.reader(f)
+            next(records)
+            while True:
+                chunk = list(itertools.islice(records, chunkSize))
+                if not chunk:
+                    break
+                rows = list(zip(*chunk))
+                values = {column.name: numericColumn(rows[i], column.type) for i, column in numeric}
+                label = rows[positions['~label']] if '~label' in positions else [None] * len(chunk)
+                if '~from' in positions:
+                    builder.addEdges(label, rows[positions['~from']], rows[positions['~to']], values)
+                else:
+                    builder.addVertices(rows[positions['~id']], label, values)
+    return builder.build()
+
+def isNumeric(value):
+    # bools count, as 0 and 1
+    return isinstance(value, (int, float))
+
+def pageColumns(properties):
+    # numeric valueMap() entries of a page as float columns; vertex properties
+    # come as lists. Time buckets (`<counter>@h<hour>`, see timebuckets.py) are
+    # left out, the totals are kept.
+    properties = [{key: value[0] if isinstance(value, list) else value for key, value in entry.items() if value != [] and '@' not in key} for entry in properties]
+    names = set(key for entry in properties for key, value in entry.items() if isNumeric(value))
+    return {
+        name: np.array([float(entry[name]) if isNumeric(entry.get(name)) else np.nan for entry in properties])
+        for name in names
+    }
+
+def pages(query, pageSize):
+    """The results of the traversal `query`, streamed, in lists of about `pageSize`."""
+    import connection
+
+    page = []
+    for chunk in connection.stream(query):
+        page.extend(chunk)
+        if len(page) >= pageSize:
+            yield page
+            page = []
+    if page:
+        yield page
+
+def fromGremlin(g, pageSize = 10000, labels = None, properties = None):
+    """Exports the graph behind traversal source `g` into a snapshot, streaming one traversal for the vertices and one for the edges."""
+    from gremlin_python.process.graph_traversal import __
+    from gremlin_python.process.traversal import T
+
+    builder = Builder(labels, properties)
+    for page in pages(g.V().project('id', 'label', 'properties').by(T.id).by(T.label).by(__.valueMap()), pageSize):
+        builder.addVertices([vertex['id'] for vertex in page], [vertex['label'] for vertex in page], pageColumns([vertex['properties'] for vertex in page]))
+    for page in pages(g.E().project('label', 'from', 'to', 'properties').by(T.label).by(__.outV().id()).by(__.inV().id()).by(__.valueMap()), pageSize):
+        builder.addEdges([edge['label'] for edge in page], [edge['from'] for edge in page], [edge['to'] for edge in page], pageColumns([edge['properties'] for edge in page]))
+    return builder.build()
+
+def load(path):
+    """Reads a snapshot written by Snapshot.save()."""
+    with np.load(path) as arrays:
+        ids = arrays['ids'].tolist()
+        labels = arrays['labels'].tolist()
+        properties = {}
+        edges = {}
+        for key in arrays.files:
+            parts = key.split('/')
+            if parts[0] == 'vertex':
+                properties[parts[1]] = arrays[key]
+            elif parts[0] == 'edges':
+                edges.setdefault(parts[1], {'properties': {}})
+                if parts[2] == 'property':
+                    edges[parts[1]]['properties'][parts[3]] = arrays[key]
+                else:
+                    edges[parts[1]][parts[2]] = arrays[key]
+    snapshot = Snapshot(ids, labels, properties, {})
+    for label, data in edges.items():
+        adjacency = Adjacency.__new__(Adjacency)
+        adjacency.indptr = data['indptr']
+        adjacency.indices = data['indices']
+        adjacency.properties = data['properties']
+        adjacency.transposed = None
+        snapshot.edges[label] = adjacency
+    return snapshot
@@ -0,0 +1,192 @@
+"""
+Hour and day buckets of the interaction counters.
+
+The `action_*` counts on `interaction_edge` and the `act_*` properties of
+players only ever grow, so they cannot tell a recent interaction from an old
+one. Every interaction therefore also increments an hour bucket next to each
+counter, named `<counter>@h<hours since the epoch>`, e.g. `act_report@h494113`.
+
+compact() rolls hour buckets older than `BucketHourRetention` hours (default 48)
+into day buckets, `<counter>@d<days since the epoch>`, and drops day buckets
+older than `BucketDayRetention` days (default 30), so an element keeps at most
+about that many buckets per counter. Its progress is kept on a
+`bucket_compaction` vertex; the aggregator worker runs it hourly.
+
+A window such as `24h` or `7d` selects the buckets that cover it: hour buckets
+for hour windows, and for day windows the day buckets plus the hour buckets not
+rolled up yet. count() sums them and score() weighs each bucket down by its
+age, halving every `BucketHalfLife` hours (default 24). Windows can be at most
+`BucketHourRetention` hours or `BucketDayRetention` days long.
+"""
+
+import logging
+import os
+import re
+import time
+
+from gremlin_python.process.graph_traversal import __
+from gremlin_python.process.traversal import T
+from gremlin_python.process.traversal import P
+from gremlin_python.process.traversal import TextP
+from gremlin_python.process.traversal import Cardinality
+from gremlin_python.process.traversal import Column
+
+import connection
+import retry
+
+g = connection.g
+
+logger = logging.getLogger(__name__)
+
+hourRetention = int(os.environ.get('BucketHourRetention', '48'))
+dayRetention = int(os.environ.get('BucketDayRetention', '30'))
+halfLife = float(os.environ.get('BucketHalfLife', '24'))
+
+# hour buckets this many hours past the retention are still read by day
+# windows, in case compaction has fallen behind
+compactionSlack = 24
+
+# stop compacting with this much of the invocation left
+timeMarginMillis = 2000
+
+separator = '@'
+compactionId = 'bucket-compaction'
+windowPattern = re.compile(r'^([1-9][0-9]*)([hd])$')
+
+
+def hourName(name, hour):
+    return name + separator + 'h' + str(hour)
+
+def dayName(name, day):
+    return name + separator + 'd' + str(day)
+
+def isBucket(key):
+    return separator in key
+
+def currentHour(now = None):
+    return int((time.time() if now is None else now) // 3600)
+
+def elementMap(edge = False):
+    """
+    elementMap() of the element at the traverser without its bucket properties,
+    which would otherwise add up to a few hundred keys per counter.
+    """
+    ends = lambda end: end.project('id', 'label').by(T.id).by(T.label)
+    fixed = __.project('id', 'label', 'IN', 'OUT').by(T.id).by(T.label).by(ends(__.inV())).by(ends(__.outV())) if edge else ends(__)
+    properties = __.properties().hasKey(TextP.notContaining(separator)).group().by(T.key).by(__.value())
+    return __.local(__.union(fixed, properties).unfold().group().by(Column.keys).by(__.select(Column.values)))
+
+def increment(key, incrementBy):
+    return __.union(__.values(key), __.constant(incrementBy)).sum()
+
+def record(traversal, name, incrementBy, vertex = True, now = None):
+    """Appended where `name` is incremented, at the same element; increments its hour bucket."""
+    key = hourName(name, currentHour(now))
+    if vertex:
+        return traversal.property(Cardinality.single, key, increment(key, incrementBy))
+    return traversal.property(key, increment(key, incrementBy))
+
+def parseWindow(window):
+    """(number, 'h' or 'd') for a window such as 24h; raises ValueError if it is malformed or too long."""
+    match = windowPattern.match(window or '')
+    if match is None:
+        raise ValueError('window must be a number of hours or days, such as 24h or 7d')
+    length, unit = int(match.group(1)), match.group(2)
+    if unit == 'h' and length > hourRetention:
+        raise ValueError('hour windows can be at most %dh, use days' % hourRetention)
+    if unit == 'd' and length > dayRetention:
+        raise ValueError('windows can be at most %dd' % dayRetention)
+    return length, unit
+
+def buckets(name, window, now = None):
+    """[(bucket name, age in hours)] of the buckets of `name` that cover `window`."""
+    now = time.time() if now is None else now
+    length, unit = parseWindow(window)
+    hour = currentHour(now)
+    age = lambda start, hours: max(0.0, (now - (start + hours / 2.0) * 3600) / 3600)
+    if unit == 'h':
+        return [(hourName(name, h), age(h, 1)) for h in range(hour - length + 1, hour + 1)]
+    day = hour // 24
+    first = day - length + 1
+    days = [(dayName(name, d), age(d * 24, 24)) for d in range(first, day + 1)]
+    hours = range(max(first * 24, hour - hourRetention - compactionSlack), hour + 1)
+    return days + [(hourName(name, h), age(h, 1)) for h in hours]
+
+def count(name, window):
+    """The number of `name` increments in `window`, for the element at the traverser."""
+    return __.values(*[bucket for bucket, age in buckets(name, window)]).sum()
+
+def within(name, window):
+    """Filter for where(): elements with at least one `name` increment in `window`."""
+    return count(name, window).is_(P.gt(0))
+
+def decayed(name, window, factor = 1):
+    # one term per bucket for a union(...).sum(), so several counters can be
+    # summed into one score
+    return [__.values(bucket).math('_ * %.6g' % (factor * 0.5 ** (age / halfLife))) for bucket, age in buckets(name, window)]
+
+def score(name, window, factor = 1):
+    return __.union(*decayed(name, window, factor)).sum()
+
+def compactionState():
+    found = g.V(compactionId).valueMap('hoursThrough', 'daysThrough').toList()
+    return {key: value[0] for key, value in found[0].items()} if found else {}
+
+def setCompactionState(**fields):
+    traversal = g.V(compactionId).fold().coalesce(__.unfold(), __.addV('bucket_compaction').property(T.id, compactionId))
+    for key, value in fields.items():
+        traversal = traversal.property(Cardinality.single, key, value)
+    traversal.iterate()
+
+def elements(vertex):
+    return g.V().hasLabel('player') if vertex else g.E().hasLabel('interaction_edge')
+
+def rollUpBatch(name, hour, vertex, batchSize):
+    hourKey, dayKey = hourName(name, hour), dayName(name, hour // 24)
+    total = __.union(__.values(dayKey), __.values(hourKey)).sum()
+    rollUp = __.property(Cardinality.single, dayKey, total) if vertex else __.property(dayKey, total)
+    # the day total and the dropped hour are one transaction per batch
+    return elements(vertex).has(hourKey).limit(batchSize).sideEffect(rollUp.properties(hourKey).drop()).count().next()
+
+def dropBatch(key, vertex, batchSize):
+    return elements(vertex).has(key).limit(batchSize).sideEffect(__.properties(key).drop()).count().next()
+
+def repeatBatches(batch, batchSize):
+    done = 0
+    while True:
+        dropped = retry.withRetry(batch)
+        done += dropped
+        if dropped < batchSize:
+            return done
+
+def outOfTime(context):
+    return context is not None and context.get_remaining_time_in_millis() < timeMarginMillis
+
+def compact(names, context = None, batchSize = 500, now = None, fromHour = None):
+    """
+    Rolls up hour buckets past the retention and drops expired day buckets of
+    the counters `names`, [(name, True if it is kept on players, False if on
+    interaction edges)]. Stops early when the invocation is about to time out
+    and continues from there on the next run. The first run starts at
+    `fromHour`, by default the oldest hour bucket buckets() still reads.
+    Returns the numbers of buckets rolled up and dropped.
+    """
+    hour = currentHour(now)
+    state = compactionState()
+    rolledUp = dropped = 0
+    firstHour = hour - hourRetention - compactionSlack if fromHour is None else fromHour
+    for h in range(state.get('hoursThrough', firstHour - 1) + 1, hour - hourRetention + 1):
+        if outOfTime(context):
+            return {'rolledUp': rolledUp, 'dropped': dropped}
+        for name, vertex in names:
+            rolledUp += repeatBatches(lambda: rollUpBatch(name, h, vertex, batchSize), batchSize)
+        setCompactionState(hoursThrough = h)
+    day = hour // 24
+    for d in range(state.get('daysThrough', firstHour // 24 - 1) + 1, day - dayRetention + 1):
+        if outOfTime(context):
+            break
+        for name, vertex in names:
+            dropped += repeatBatches(lambda: dropBatch(dayName(name, d), vertex, batchSize), batchSize)
+        setCompactionState(daysThrough = d)
+    logger.info('bucket compaction rolled up %d and dropped %d buckets', rolledUp, dropped)
+    return {'rolledUp': rolledUp, 'dropped': dropped}
@@ -1,98 +1,231 @@
 from cerberus import Validator
+from cerberus.schema import DefinitionSchema
+import copy
+import logging
 import os
+import time
 
 from gremlin_python import statics
-from gremlin_python.structure.graph import Graph
 from gremlin_python.process.graph_traversal import __
 from gremlin_python.process.strategies import *
-from gremlin_python.driver.driver_remote_connection import DriverRemoteConnection
 from gremlin_python.process.traversal import T
 from gremlin_python.driver.protocol import GremlinServerError
 from gremlin_python.process.traversal import Cardinality
 
-neptuneEndpoint = os.environ['NeptuneEndpoint']
-neptuneEndpoint = 'wss://' + neptuneEndpoint + ':8182/gremlin'
+import connection
+import instrumentation
 
-graph = Graph()
-remoteConn = DriverRemoteConnection(neptuneEndpoint,'g')
-g = graph.traversal().withRemote(remoteConn)
+g = connection.g
 
-def playerCheck(field, value, error):
-    try:
-        player = g.V(value).next()
-    except Exception as e:
-        error(field, 'player does not exist')
-        
-def campaignCheck(field, value, error):
-    try:
-        player = g.V(value).next()
-    except Exception as e:
-        error(field, 'campaign does not exist')
-        
+logger = logging.getLogger(__name__)
 
+# Ids known to exist, mapped to the time their cache entry expires. Delete
+# handlers evict ids from here so a removed vertex is not reported as present.
+cacheTtl = float(os.environ.get('ValidationCacheTtl', '60'))
+knownVertices = {}
 
-required = {'required', True}
-def validate(input = None, required = None, dependencies = None):
-    v = Validator()
-    v.allow_unknown = True  
-    to_bool = lambda v: v.lower() in ('true', '1')
-    schema = {
-        'player': {
-            'type': 'string',
-            'check_with': playerCheck
-        },
-        'targetPlayer': {
-            'type': 'string',
-            'check_with': playerCheck,
-        },
-        'action': {
-            'type': 'string',
-            'allowed': ['action_chat', 'action_sharepii', 'action_partyjoin', 'action_randomheal', 'action_grief', 'action_badname', 'action_harass', 'action_stalk', 'action_badlanguage', 'action_endorse', 'action_report', 'action_badimage']
-        },
-        'playerAttribute': {
-            'type': 'string',
-            'allowed': ['ea_reputation', 'ea_altruism','ea_duty','ea_mischief','ea_malice','ea_atrisk']
-        },
-        'playerStat': {
-            'type': 'string',
-            'allowed': ['stat_uuid','status','stat_joinedDate','stat_lastPlayed','stat_totalSkinPurchases']
-        },
-        'incrementBy': {
-            'type': 'integer',
-            'coerce': int
-        },
-        'bidirectional': {
-            'type': 'boolean',
-            'coerce': (str, to_bool),
-            'default': False
-        },
-        'relationshipOrder': {
-            'type': 'integer',
-            'default': 1
-        },
-        'campaign': {
-            'type': 'string',
-            'check_with': campaignCheck
-        },
-        'campaignAction': {
-            'type': 'string',
-            'allowed': ['campaign_login', 'campaign_emailOpened', 'campaign_linkClicked']
-        },
-        'campaignAttribute': {
-            'type': 'string',
-            'allowed': ['stat_totalEmailOpened','stat_messagesSent','stat_messagesDelivered','stat_dailyActive','stat_newPlayers']
-        }
+existenceErrors = {
+    'player': 'player does not exist',
+    'targetPlayer': 'player does not exist',
+    'campaign': 'campaign does not exist'
+}
+
+def remember(ids):
+    expires = time.monotonic() + cacheTtl
+    for vertexId in ids:
+        knownVertices[vertexId] = expires
+
+def evict(*ids):
+    for vertexId in ids:
+        knownVertices.pop(vertexId, None)
+
+def missingVertices(ids):
+    # one g.V(id1, id2, ...) round trip for every id not already in the cache
+    now = time.monotonic()
+    unknown = [vertexId for vertexId in dict.fromkeys(ids) if knownVertices.get(vertexId, 0) <= now]
+    if not unknown:
+        return set()
+    with instrumentation.phase('existence'):
+        found = g.V(*unknown).id().toList()
+    remember(found)
+    return set(unknown) - set(found)
+
+def existenceCheckAll(documents):
+    # existence errors for each document, from a single query across all of them
+    fields = [[field for field in existenceErrors if isinstance(document.get(field), str)] for document in documents]
+    missing = missingVertices([document[field] for document, names in zip(documents, fields) for field in names])
+    return [{field: [existenceErrors[field]] for field in names if document[field] in missing} for document, names in zip(documents, fields)]
+
+def existenceCheck(document):
+    return existenceCheckAll([document])[0]
+
+
+to_bool = lambda v: v.lower() in ('true', '1')
+actionNames = ['action_chat', 'action_sharepii', 'action_partyjoin', 'action_randomheal', 'action_grief', 'action_badname', 'action_harass', 'action_stalk', 'action_badlanguage', 'action_endorse', 'action_report', 'action_badimage']
+schema = {
+    'player': {
+        'type': 'string'
+    },
+    'targetPlayer': {
+        'type': 'string'
+    },
+    'action': {
+        'type': 'string',
+        'allowed': actionNames
+    },
+    'players': {
+        'type': 'list',
+        'minlength': 1,
+        'schema': {'type': 'string'}
+    },
+    'actions': {
+        'type': 'list',
+        'minlength': 1,
+        'schema': {'type': 'string', 'allowed': actionNames}
+    },
+    'playerAttribute': {
+        'type': 'string',
+        'allowed': ['ea_reputation', 'ea_altruism','ea_duty','ea_mischief','ea_malice','ea_atrisk']
+    },
+    'playerStat': {
+        'type': 'string',
+        'allowed': ['stat_uuid','status','stat_joinedDate','stat_lastPlayed','stat_totalSkinPurchases']
+    },
+    'incrementBy': {
+        'type': 'integer',
+        'coerce': int
+    },
+    'bidirectional': {
+        'type': 'boolean',
+        'coerce': (str, to_bool),
+        'default': False
+    },
+    'relationshipOrder': {
+        'type': 'integer',
+        'coerce': int,
+        'min': 1,
+        'default': 1
+    },
+    'fanOut': {
+        'type': 'integer',
+        'coerce': int,
+        'min': 1
+    },
+    'limit': {
+        'type': 'integer',
+        'coerce': int,
+        'min': 1
+    },
+    'cursor': {
+        'type': 'string'
+    },
+    'format': {
+        'type': 'string',
+        'allowed': ['rows', 'columnar'],
+        'default': 'rows'
+    },
+    'countOnly': {
+        'type': 'boolean',
+        'coerce': (str, to_bool),
+        'default': False
+    },
+    'async': {
+        'type': 'boolean',
+        'coerce': (str, to_bool),
+        'default': False
+    },
+    'profile': {
+        'type': 'boolean',
+        'coerce': (str, to_bool),
+        'default': False
+    },
+    'cohorts': {
+        'type': 'dict',
+        'minlength': 1,
+        'keysrules': {'type': 'string'},
+        'valuesrules': {'type': 'dict'}
+    },
+    'members': {
+        'type': 'integer',
+        'min': 0
+    },
+    'offset': {
+        'type': 'integer',
+        'min': 0
+    },
+    'bitset': {
+        'type': 'boolean',
+        'default': False
+    },
+    'window': {
+        'type': 'string',
+        'regex': '^[1-9][0-9]*[hd]$'
+    },
+    'writtenAt': {
+        'type': 'integer',
+        'coerce': int,
+        'min': 0
+    },
+    'campaign': {
+        'type': 'string'
+    },
+    'campaignAction': {
+        'type': 'string',
+        'allowed': ['campaign_login', 'campaign_emailOpened', 'campaign_linkClicked']
+    },
+    'campaignAttribute': {
+        'type': 'string',
+        'allowed': ['stat_totalEmailOpened','stat_messagesSent','stat_messagesDelivered','stat_dailyActive','stat_newPlayers']
     }
+}
+
+# Cerberus validates and compiles a schema when a Validator is built, so build
+# one per (required, dependencies) combination and reuse it on warm invocations.
+validators = {}
+
+class CompiledSchema(DefinitionSchema):
+    # Normalization copies the schema for every document, and each copy rebuilds
+    # a schema validator and re-hashes every rule. Route schemas are validated
+    # once in compiledValidator(), so the copies can skip both.
+    def validate(self, schema = None):
+        pass
+
+    def copy(self):
+        clone = object.__new__(self.__class__)
+        clone.__dict__.update(self.__dict__)
+        clone.schema = self.schema.copy()
+        return clone
+
+def compiledValidator(required = None, dependencies = None):
+    key = (tuple(required or ()), tuple(sorted((item, repr(dependencies[item])) for item in dependencies or ())))
+    v = validators.get(key)
+    if v is None:
+        routeSchema = copy.deepcopy(schema)
+        if required:
+            for item in required:
+                routeSchema[item]['required'] = True
+        if dependencies:
+            for item in dependencies:
+                routeSchema[item]['dependencies'] = dependencies[item]
+        v = Validator(routeSchema, allow_unknown = True)
+        v.schema = CompiledSchema(v, v.schema.schema)
+        validators[key] = v
+    return v
+
+required = {'required', True}
+def validate(input = None, required = None, dependencies = None, exists = True):
+    with instrumentation.phase('validation'):
+        return validateInput(input, required, dependencies, exists)
 
-    if required:
-        for item in required:
-            schema[item]['required']= True
-    if dependencies:
-        for item in dependencies:
-            schema[item]['dependencies'] = dependencies[item]
-    if v.validate(input, schema) is True:
-        print ([True, v.document, v.normalized])
-        return [True, v.document, v.normalized]
+def validateInput(input, required, dependencies, exists):
+    v = compiledValidator(required, dependencies)
+    if v.validate(input) is True:
+        errors = existenceCheck(v.document) if exists else {}
+        if not errors:
+            logger.debug('valid document: %s', v.document)
+            return [True, v.document, v.normalized]
+        logger.info('validation errors: %s', errors)
+        return [errors]
     else:
-        print(v.errors)
-        return [v.errors]
\ No newline at end of file
+        logger.info('validation errors: %s', v.errors)
+        return [v.errors]
@@ -0,0 +1,34 @@
+"""
+Backfills the act_ properties that the prediction queries read instead of
+traversing the action vertices.
+
+Sets `act_<name>` on every player to the count on its `action_edge` to
+`action_<name>`, and removes act_ properties for actions the player no longer
+has an edge to. Run it once after upgrading, and after bulk loads or other
+writes that bypass the API.
+
+    python tools/actionprofile.py --endpoint ws://localhost:8182/gremlin
+"""
+
+import argparse
+import json
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'layers'))
+
+
+def main():
+    parser = argparse.ArgumentParser(description = 'backfill the act_ properties of every player')
+    parser.add_argument('--endpoint', default = os.environ.get('NeptuneEndpoint', 'ws://localhost:8182/gremlin'))
+    parser.add_argument('--write-size', type = int, default = 100, help = 'players updated per traversal')
+    args = parser.parse_args()
+
+    os.environ['NeptuneEndpoint'] = args.endpoint
+    import actionprofile
+    print(json.dumps({'players': actionprofile.backfill(args.write_size)}))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,242 @@
+"""
+Parallel loader for Neptune bulk load CSV files.
+
+Streams each file, groups rows into batches and writes every batch as a single
+upsert traversal from a pool of worker threads. At most `--in-flight` batches
+are queued at once, so reading never runs ahead of the writers. Progress is
+checkpointed after each contiguous run of completed batches and a rerun resumes
+from the checkpoint. Vertex files are loaded before edge files.
+
+    python tools/bulkload.py --endpoint ws://localhost:8182/gremlin data/*.csv
+"""
+
+import argparse
+import concurrent.futures
+import glob
+import json
+import os
+import sys
+import threading
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'layers'))
+
+from gremlin_python.process.graph_traversal import __
+from gremlin_python.process.traversal import T
+from gremlin_python.process.traversal import Cardinality
+
+import neptunecsv
+
+
+def vertexUpsert(traversal, vertexId, label, properties):
+    upsert = __.V(vertexId).fold().coalesce(
+        __.unfold(),
+        __.addV(label or 'vertex').property(T.id, vertexId)
+    )
+    for key, value in properties.items():
+        for item in (value if isinstance(value, list) else [value]):
+            upsert = upsert.property(Cardinality.set_ if isinstance(value, list) else Cardinality.single, key, item)
+    return traversal.sideEffect(upsert)
+
+def edgeUpsert(traversal, edgeId, label, fromId, toId, properties):
+    edgeId = edgeId or '%s-%s-%s' % (fromId, label, toId)
+    upsert = __.V(fromId).coalesce(
+        __.outE(label or 'edge').hasId(edgeId),
+        __.addE(label or 'edge').to(__.V(toId)).property(T.id, edgeId)
+    )
+    for key, value in properties.items():
+        upsert = upsert.property(key, value)
+    return traversal.sideEffect(upsert)
+
+
+class Checkpoint(object):
+    """Byte offset of the last contiguous completed batch in each file."""
+
+    def __init__(self, path):
+        self.path = path
+        self.offsets = {}
+        self.lock = threading.Lock()
+        self.saved = 0
+        if path and os.path.exists(path):
+            with open(path) as f:
+                self.offsets = json.load(f)
+
+    def get(self, file):
+        return self.offsets.get(os.path.abspath(file), {}).get('offset')
+
+    def set(self, file, offset, rows, force = False):
+        with self.lock:
+            self.offsets[os.path.abspath(file)] = {'offset': offset, 'rows': rows}
+            if self.path and (force or time.monotonic() - self.saved > 1):
+                with open(self.path + '.tmp', 'w') as f:
+                    json.dump(self.offsets, f)
+                os.replace(self.path + '.tmp', self.path)
+                self.saved = time.monotonic()
+
+
+class FileLoad(object):
+    """Tracks out of order batch completions and advances the checkpoint watermark."""
+
+    def __init__(self, path, checkpoint, rows):
+        self.path = path
+        self.checkpoint = checkpoint
+        self.rows = rows
+        self.lock = threading.Lock()
+        self.pending = {}
+        self.nextBatch = 0
+        self.failed = 0
+
+    def done(self, index, offset, count, ok):
+        with self.lock:
+            if not ok:
+                self.failed += 1
+            self.pending[index] = (offset, count, ok)
+            watermark = None
+            while self.nextBatch is not None and self.nextBatch in self.pending:
+                offset, count, ok = self.pending.pop(self.nextBatch)
+                if not ok:
+                    # stop the watermark at the first failed batch so a rerun retries it
+                    self.nextBatch = None
+                    break
+                self.rows += count
+                self.nextBatch += 1
+                watermark = offset
+            if watermark is not None:
+                self.checkpoint.set(self.path, watermark, self.rows)
+
+
+def writeBatch(g, batch, isEdge, retries):
+    for attempt in range(retries + 1):
+        traversal = g.inject(0)
+        for row in batch:
+            traversal = edgeUpsert(traversal, *row) if isEdge else vertexUpsert(traversal, *row)
+        try:
+            traversal.iterate()
+            return True
+        except Exception as e:
+            if attempt == retries:
+                print('batch failed: %s' % e, file = sys.stderr)
+                return False
+            time.sleep(0.1 * 2 ** attempt)
+
+
+def loadFile(g, path, args, checkpoint, executor):
+    start = checkpoint.get(path)
+    previous = checkpoint.offsets.get(os.path.abspath(path), {}).get('rows', 0)
+    load = FileLoad(path, checkpoint, previous)
+    inFlight = threading.BoundedSemaphore(args.in_flight)
+    began = time.monotonic()
+    rows = 0
+
+    def submit(index, batch, offset, isEdge):
+        # blocks while `--in-flight` batches are waiting, which keeps the reader
+        # from getting ahead of the writers
+        inFlight.acquire()
+        future = executor.submit(writeBatch, g, batch, isEdge, args.retries)
+
+        def finished(f):
+            load.done(index, offset, len(batch), f.exception() is None and f.result())
+            inFlight.release()
+        future.add_done_callback(finished)
+
+    with neptunecsv.Reader(path, start) as reader:
+        batch = []
+        index = 0
+        for row in reader:
+            if reader.isEdge:
+                edgeId, label, fromId, toId, properties = row
+                row = (edgeId, args.labels.get(label, label), fromId, toId, rename(properties, args.properties))
+            else:
+                vertexId, label, properties = row
+                row = (vertexId, args.labels.get(label, label), rename(properties, args.properties))
+            batch.append(row)
+            rows += 1
+            if len(batch) == args.batch_size:
+                submit(index, batch, reader.offset, reader.isEdge)
+                batch = []
+                index += 1
+            if args.progress and rows % (args.batch_size * 50) == 0:
+                print('%s: %d rows, %.0f rows/s' % (os.path.basename(path), rows, rows / (time.monotonic() - began)), file = sys.stderr)
+        if batch:
+            submit(index, batch, reader.offset, reader.isEdge)
+            index += 1
+
+    # wait for the last batches by taking every in-flight slot
+    for i in range(args.in_flight):
+        inFlight.acquire()
+    for i in range(args.in_flight):
+        inFlight.release()
+    elapsed = time.monotonic() - began
+    checkpoint.set(path, checkpoint.get(path) or 0, load.rows, force = True)
+    return {
+        'file': path,
+        'rows': rows,
+        'resumedAt': previous,
+        'batches': index,
+        'failedBatches': load.failed,
+        'seconds': round(elapsed, 3),
+        'rowsPerSecond': round(rows / elapsed, 1) if elapsed else None
+    }
+
+def rename(properties, names):
+    if not names:
+        return properties
+    return {names.get(key, key): value for key, value in properties.items()}
+
+def mapping(text):
+    return dict(item.split('=', 1) for item in text.split(',') if item) if text else {}
+
+def main():
+    parser = argparse.ArgumentParser(description = 'load Neptune bulk load CSV files through Gremlin')
+    parser.add_argument('files', nargs = '*', help = 'CSV files (default data/*.csv)')
+    parser.add_argument('--endpoint', default = os.environ.get('NeptuneEndpoint', 'ws://localhost:8182/gremlin'))
+    parser.add_argument('--workers', type = int, default = 8)
+    parser.add_argument('--batch-size', type = int, default = 100)
+    parser.add_argument('--in-flight', type = int, default = None, help = 'batches queued at once (default 2 x workers)')
+    parser.add_argument('--retries', type = int, default = 3)
+    parser.add_argument('--checkpoint', default = '.bulkload-checkpoint.json')
+    parser.add_argument('--report', help = 'write the throughput report to this JSON file')
+    parser.add_argument('--labels', type = mapping, default = {}, help = 'rename labels, e.g. Interactions=interaction_edge')
+    parser.add_argument('--properties', type = mapping, default = {}, help = 'rename properties, e.g. iterations=count')
+    parser.add_argument('--progress', action = 'store_true')
+    args = parser.parse_args()
+    args.in_flight = args.in_flight or args.workers * 2
+
+    files = args.files or sorted(glob.glob(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'data', '*.csv')))
+    # vertices first, so edges always find both ends
+    files = sorted(files, key = neptunecsv.isEdgeFile)
+
+    os.environ['NeptuneEndpoint'] = args.endpoint
+    import connection
+    connection.poolSize = args.workers
+    g = connection.traversal()
+    # opened here, before the workers share it
+    connection.remote().connect()
+
+    checkpoint = Checkpoint(args.checkpoint)
+    began = time.monotonic()
+    results = []
+    with concurrent.futures.ThreadPoolExecutor(max_workers = args.workers) as executor:
+        for path in files:
+            result = loadFile(g, path, args, checkpoint, executor)
+            results.append(result)
+            print('%(file)s: %(rows)d rows in %(seconds).1fs (%(rowsPerSecond)s rows/s), %(failedBatches)d failed batches' % result)
+
+    elapsed = time.monotonic() - began
+    total = sum(result['rows'] for result in results)
+    report = {
+        'files': results,
+        'rows': total,
+        'seconds': round(elapsed, 3),
+        'rowsPerSecond': round(total / elapsed, 1) if elapsed else None,
+        'connection': connection.stats()
+    }
+    print('total: %d rows in %.1fs (%s rows/s)' % (total, elapsed, report['rowsPerSecond']))
+    if args.report:
+        with open(args.report, 'w') as f:
+            json.dump(report, f, indent = 2)
+    return 1 if any(result['failedBatches'] for result in results) else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
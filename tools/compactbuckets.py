@@ -0,0 +1,37 @@
+"""
+Compacts the hour and day buckets of the interaction counters.
+
+Rolls hour buckets older than `BucketHourRetention` hours into day buckets and
+drops day buckets older than `BucketDayRetention` days, continuing from where
+the last compaction stopped. The aggregator worker does this every hour; run it
+by hand against a local Gremlin Server, or to catch up after the worker has not
+run for a while. The first compaction starts `BucketHourRetention` plus 24 hours
+back; `--from-hour` (hours since the epoch) starts it earlier.
+
+    python tools/compactbuckets.py --endpoint ws://localhost:8182/gremlin
+"""
+
+import argparse
+import json
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'layers'))
+
+
+def main():
+    parser = argparse.ArgumentParser(description = 'compact the time buckets of the interaction counters')
+    parser.add_argument('--endpoint', default = os.environ.get('NeptuneEndpoint', 'ws://localhost:8182/gremlin'))
+    parser.add_argument('--batch-size', type = int, default = 500, help = 'elements updated per traversal')
+    parser.add_argument('--from-hour', type = int, help = 'hour the first compaction starts at, in hours since the epoch')
+    args = parser.parse_args()
+
+    os.environ['NeptuneEndpoint'] = args.endpoint
+    import actionprofile
+    import timebuckets
+    print(json.dumps(timebuckets.compact(actionprofile.counters(), batchSize = args.batch_size, fromHour = args.from_hour)))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
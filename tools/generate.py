@@ -0,0 +1,292 @@
+"""
+Synthetic cohort graph generator.
+
+Writes the same seven Neptune load format files as
+notebook/CohortModelerGraphGenerator.ipynb, drawn from the same distributions,
+but vectorized with NumPy and streamed to disk one chunk of players at a time.
+Memory use depends on the chunk size, not the number of players, so 10M player
+/ 200M edge datasets can be generated on a laptop. Player and edge ids are
+derived from the seed and their index, so a given seed always produces the same
+files.
+
+    python tools/generate.py --players 10000000 --out /tmp/cohort
+"""
+
+import argparse
+import multiprocessing
+import os
+import sys
+import time
+
+import numpy as np
+
+actionTypes = ['action_chat', 'action_sharepii', 'action_partyjoin', 'action_randomheal', 'action_grief', 'action_badname', 'action_harass', 'action_stalk', 'action_badlanguage', 'action_endorse', 'action_report', 'action_badimage']
+
+userHeader = ['~id', '~label', 'playerId:String', 'status:String', 'joinedDate:Date', 'lastPlayed:Date', 'ea_reputation:Int', 'ea_altruism:Int', 'ea_duty:Int', 'ea_mischief:Int', 'ea_malice:Int', 'ea_atrisk:Int', 'stat_totalSkinPurchases:Int', 'stat_totalCurrencyPurchases:Int', 'stat_idleMinutes:Int', 'stat_marketingEmailClickThroughs:Int', 'stat_lastChatTimestamp:Int', 'stat_lastGameSession:Int', 'stat_lastGameSessionLength:Int', 'stat_longestGameSessionLength:Int', 'stat_shortestGameSessionLength:Int', 'stat_medianGameSessionLength:Int']
+interactionHeader = ['~from', '~to', '~label', '~id', 'action_chat:Int', 'action_sharepii:Int', 'action_partyjoin:Int', 'action_randomheal:Int', 'action_endorse:Int', 'action_report:Int']
+engagementHeader = ['~from', '~to', '~id', '~label', 'iterations:Int']
+campaignHeader = ['~id', '~label', 'name:String', 'stat_totalEmailOpened:Int', 'stat_messagesSent:Int', 'stat_messagesDelivered:Int', 'stat_dailyActive:Int', 'stat_newPlayers:Int']
+campaignEdgeHeader = ['~from', '~to', '~label', '~id']
+campaignBidirectionalHeader = ['~from', '~to', '~id', '~label', 'campaign_login:Int', 'campaign_emailOpened:Int', 'campaign_linkClicked:Int']
+
+# (mean, standard deviation, absolute value) for each player attribute, as in the notebook
+userColumns = [
+    ('ea_reputation', 0, 25, False),
+    ('ea_altruism', 0, 10, True),
+    ('ea_duty', 0, 3, True),
+    ('ea_mischief', 0, 1.5, False),
+    ('ea_malice', 0, 1, True),
+    ('ea_atrisk', 0, 1, True),
+    ('stat_totalSkinPurchases', 15, 5, True),
+    ('stat_totalCurrencyPurchases', 1000, 200, True),
+    ('stat_idleMinutes', 360, 120, True),
+    ('stat_marketingEmailClickThroughs', 15, 4, True),
+    ('stat_lastChatTimestamp', 1621279571, 1296000, True),
+    ('stat_lastGameSession', 1621279571, 1296000, True),
+    ('stat_lastGameSessionLength', 180, 60, True),
+    ('stat_longestGameSessionLength', 480, 120, True),
+    ('stat_shortestGameSessionLength', 10, 5, True),
+    ('stat_medianGameSessionLength', 60, 10, True)
+]
+interactionColumns = [('action_chat', 2000, 2000), ('action_sharepii', 1, 1), ('action_partyjoin', 4, 5), ('action_randomheal', 0.4, 1.4), ('action_endorse', 3, 6), ('action_report', 0.2, 0.5)]
+
+# id namespaces, so players, campaigns and each kind of edge get distinct ids
+PLAYER, CAMPAIGN, INTERACTION, ENGAGEMENT, CAMPAIGN_EDGE, CAMPAIGN_BIDIRECTIONAL = range(6)
+
+# an id's index has indexBits bits; edge indexes are (chunk << chunkShift) + position
+indexBits = 56
+chunkShift = 32
+
+words = ['amber', 'bold', 'crisp', 'dusk', 'ember', 'frost', 'glint', 'hollow', 'iron', 'jade', 'keen', 'lunar', 'moss', 'nova', 'onyx', 'pale', 'quill', 'rune', 'sable', 'thorn', 'umber', 'vale', 'wisp', 'zephyr']
+
+
+hexDigits = np.frombuffer(b'0123456789abcdef', dtype = np.uint8)
+uuidColumns = [i for i in range(36) if i not in (8, 13, 18, 23)]
+
+def mix(x):
+    # splitmix64 finalizer, vectorized
+    with np.errstate(over = 'ignore'):
+        x = x + np.uint64(0x9E3779B97F4A7C15)
+        x = (x ^ (x >> np.uint64(30))) * np.uint64(0xBF58476D1CE4E5B9)
+        x = (x ^ (x >> np.uint64(27))) * np.uint64(0x94D049BB133111EB)
+        return x ^ (x >> np.uint64(31))
+
+def uuids(seed, namespace, indexes):
+    """Version 4 formatted uuids that depend only on (seed, namespace, index), index < 2^56."""
+    # the namespace sits above every index bit and the seed is mixed in as a
+    # whole, so mix(), a bijection, maps distinct (namespace, index) pairs of a
+    # seed to distinct ids
+    key = np.asarray(indexes, dtype = np.uint64) | np.uint64(namespace << indexBits)
+    hi = mix(key ^ mix(np.uint64(seed)))
+    lo = mix(hi ^ np.uint64(0x5851F42D4C957F2D))
+    hi = (hi & np.uint64(0xFFFFFFFFFFFF0FFF)) | np.uint64(0x0000000000004000)
+    lo = (lo & np.uint64(0x3FFFFFFFFFFFFFFF)) | np.uint64(0x8000000000000000)
+    raw = np.stack([hi, lo], axis = 1).astype('>u8').view(np.uint8).reshape(-1, 16)
+    # hex digits laid out as 8-4-4-4-12 characters, formatted without a Python loop per id
+    digits = np.empty((len(raw), 32), dtype = np.uint8)
+    digits[:, 0::2] = hexDigits[raw >> 4]
+    digits[:, 1::2] = hexDigits[raw & 15]
+    text = np.full((len(raw), 36), ord('-'), dtype = np.uint8)
+    text[:, uuidColumns] = digits
+    return text.view('S36').ravel().astype('U36').astype(object)
+
+def normals(rng, mean, sd, size, absolute = True):
+    # int() in the notebook truncates toward zero
+    values = np.trunc(rng.normal(mean, sd, size)).astype(np.int64)
+    return np.abs(values) if absolute else values
+
+def csvRows(columns):
+    columns = [column.astype(str) if isinstance(column, np.ndarray) and column.dtype != object else column for column in columns]
+    if not len(columns[0]):
+        return ''
+    return '\n'.join(map(','.join, zip(*columns))) + '\n'
+
+def dates(rng, start, end):
+    # uniform dates in [start, end], one per row
+    days = (end - start).astype(np.int64)
+    return start + (rng.random(len(days)) * (days + 1)).astype(np.int64)
+
+def uniqueTargets(rng, sources, players):
+    """Random targets for each source with no self loops and no repeated (source, target)."""
+    targets = rng.integers(0, players, len(sources))
+    while True:
+        keys = sources.astype(np.int64) * players + targets
+        order = np.argsort(keys, kind = 'stable')
+        repeated = np.zeros(len(keys), dtype = bool)
+        repeated[order[1:]] = keys[order[1:]] == keys[order[:-1]]
+        invalid = repeated | (targets == sources)
+        if not invalid.any():
+            return targets
+        targets[invalid] = rng.integers(0, players, int(invalid.sum()))
+
+
+def playerIds(seed, indexes):
+    return uuids(seed, PLAYER, indexes)
+
+def edgeIds(seed, namespace, chunk, count):
+    # unique across chunks without knowing how many edges the earlier chunks
+    # had: the chunk takes the index bits above the edge's position in it
+    if chunk >= 1 << (indexBits - chunkShift) or count > 1 << chunkShift:
+        raise ValueError('edge ids need chunk < 2^%d and at most 2^%d edges per chunk' % (indexBits - chunkShift, chunkShift))
+    return uuids(seed, namespace, np.arange(count, dtype = np.int64) + (chunk << chunkShift))
+
+def players(rng, seed, start, end, reference):
+    n = end - start
+    joined = dates(rng, np.full(n, reference - 5 * 365), np.full(n, reference))
+    lastPlayed = dates(rng, joined, np.full(n, reference))
+    names = np.array([words[i % len(words)] + words[(i // len(words)) % len(words)] + str(i) for i in range(start, end)], dtype = object)
+    columns = [
+        playerIds(seed, np.arange(start, end)),
+        np.full(n, 'player', dtype = object),
+        names,
+        np.where(rng.random(n) < 0.98, 'Active', 'Inactive').astype(object),
+        joined.astype(str).astype(object),
+        lastPlayed.astype(str).astype(object)
+    ]
+    columns += [normals(rng, mean, sd, n, absolute) for name, mean, sd, absolute in userColumns]
+    return csvRows(columns), n
+
+def engagements(rng, seed, chunk, start, end):
+    n = end - start
+    counts = np.minimum(normals(rng, 2, 3, n), len(actionTypes))
+    # unique actions per player: the first `count` entries of a random permutation
+    permutations = np.argsort(rng.random((n, len(actionTypes))), axis = 1)
+    mask = np.arange(len(actionTypes)) < counts[:, None]
+    sources = np.repeat(np.arange(start, end), counts)
+    return csvRows([
+        playerIds(seed, sources),
+        np.array(actionTypes, dtype = object)[permutations[mask]],
+        edgeIds(seed, ENGAGEMENT, chunk, len(sources)),
+        np.full(len(sources), 'EngagedIn', dtype = object),
+        normals(rng, 800, 2000, len(sources))
+    ]), len(sources)
+
+def interactions(rng, seed, chunk, start, end, total):
+    n = end - start
+    counts = np.minimum(np.maximum(np.trunc(rng.normal(20, 8, n)).astype(np.int64), 0), total - 1)
+    sources = np.repeat(np.arange(start, end), counts)
+    targets = uniqueTargets(rng, sources, total)
+    columns = [
+        playerIds(seed, sources),
+        playerIds(seed, targets),
+        np.full(len(sources), 'Interactions', dtype = object),
+        edgeIds(seed, INTERACTION, chunk, len(sources))
+    ]
+    columns += [normals(rng, mean, sd, len(sources)) for name, mean, sd in interactionColumns]
+    return csvRows(columns), len(sources)
+
+def playerChunk(job):
+    """Players, engagements and interactions for one chunk, as CSV text. Runs in a worker process."""
+    seed, chunk, start, end, total, reference = job
+    # each chunk has its own stream, so chunks can be generated in any order
+    rng = np.random.default_rng([seed, chunk + 1])
+    reference = np.datetime64(reference, 'D')
+    return {
+        'user_vertices': players(rng, seed, start, end, reference),
+        'engagement_edges': engagements(rng, seed, chunk, start, end),
+        'interaction_edges': interactions(rng, seed, chunk, start, end, total)
+    }
+
+
+class Generator(object):
+
+    def __init__(self, args):
+        self.args = args
+        self.rng = np.random.default_rng(args.seed)
+        self.counts = {}
+
+    def open(self, name, header):
+        f = open(os.path.join(self.args.out, name + '.csv'), 'w')
+        f.write(','.join(header) + '\n')
+        self.counts[name] = 0
+        return f
+
+    def campaigns(self):
+        rng = self.rng
+        seed = self.args.seed
+        n = self.args.campaigns
+        opened = normals(rng, 25, 1, n)
+        sent = np.minimum(normals(rng, 100, 0, n), self.args.players)
+        opened = np.minimum(opened, sent)
+        campaignIds = uuids(seed, CAMPAIGN, np.arange(n))
+        with self.open('campaign_vertices', campaignHeader) as f:
+            names = np.array(['%s %s.' % (words[rng.integers(len(words))].capitalize(), words[rng.integers(len(words))]) for i in range(n)], dtype = object)
+            f.write(csvRows([campaignIds, np.full(n, 'campaign', dtype = object), names, opened, sent, normals(rng, 60, 2, n), normals(rng, 60, 5, n), normals(rng, 5, 1, n)]))
+            self.counts['campaign_vertices'] = n
+
+        with self.open('campaign_edges', campaignEdgeHeader) as edges, self.open('campaign_bidirectional_edges', campaignBidirectionalHeader) as bidirectional:
+            for c in range(n):
+                recipients = rng.choice(self.args.players, int(sent[c]), replace = False)
+                edges.write(csvRows([
+                    np.full(len(recipients), campaignIds[c], dtype = object),
+                    playerIds(seed, recipients),
+                    np.full(len(recipients), 'MarketingInteractions', dtype = object),
+                    edgeIds(seed, CAMPAIGN_EDGE, c, len(recipients))
+                ]))
+                self.counts['campaign_edges'] += len(recipients)
+
+                # the openers are a subset of the recipients
+                openers = rng.choice(recipients, int(opened[c]), replace = False)
+                bidirectional.write(csvRows([
+                    playerIds(seed, openers),
+                    np.full(len(openers), campaignIds[c], dtype = object),
+                    edgeIds(seed, CAMPAIGN_BIDIRECTIONAL, c, len(openers)),
+                    np.full(len(openers), 'CustomerMarketingInteractions', dtype = object),
+                    rng.integers(0, 20, len(openers)),
+                    rng.integers(1, 5, len(openers)),
+                    rng.integers(0, 2, len(openers))
+                ]))
+                self.counts['campaign_bidirectional_edges'] += len(openers)
+
+    def run(self):
+        args = self.args
+        os.makedirs(args.out, exist_ok = True)
+        with self.open('action_vertices', ['~id', '~label']) as f:
+            f.write(csvRows([np.array(actionTypes, dtype = object), np.full(len(actionTypes), 'action', dtype = object)]))
+            self.counts['action_vertices'] = len(actionTypes)
+
+        jobs = [
+            (args.seed, chunk, start, min(start + args.chunk_size, args.players), args.players, args.reference_date)
+            for chunk, start in enumerate(range(0, args.players, args.chunk_size))
+        ]
+        files = {
+            'user_vertices': self.open('user_vertices', userHeader),
+            'engagement_edges': self.open('engagement_edges', engagementHeader),
+            'interaction_edges': self.open('interaction_edges', interactionHeader)
+        }
+        with multiprocessing.Pool(args.processes) as pool:
+            # imap keeps the chunk order, so the files are the same for any number of processes
+            for job, chunk in zip(jobs, pool.imap(playerChunk, jobs)):
+                for name, (text, count) in chunk.items():
+                    files[name].write(text)
+                    self.counts[name] += count
+                if args.progress:
+                    print('%d/%d players' % (job[3], args.players), file = sys.stderr)
+        for f in files.values():
+            f.close()
+
+        self.campaigns()
+        return self.counts
+
+
+def main():
+    parser = argparse.ArgumentParser(description = 'generate a synthetic cohort graph in Neptune load format')
+    parser.add_argument('--players', type = int, default = 1000)
+    parser.add_argument('--campaigns', type = int, default = 10)
+    parser.add_argument('--seed', type = int, default = 1234)
+    parser.add_argument('--reference-date', default = '2021-07-01', help = 'dates are drawn from the five years before this day')
+    parser.add_argument('--chunk-size', type = int, default = 20000, help = 'players generated per chunk')
+    parser.add_argument('--processes', type = int, default = None, help = 'worker processes (default one per CPU)')
+    parser.add_argument('--out', default = '.')
+    parser.add_argument('--progress', action = 'store_true')
+    args = parser.parse_args()
+
+    began = time.monotonic()
+    counts = Generator(args).run()
+    for name, count in counts.items():
+        print('%s.csv: %d rows' % (name, count))
+    print('%.1fs' % (time.monotonic() - began))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,31 @@
+"""
+Rebuilds the negative reputation index used by the badActors prediction.
+
+Flags every player whose `ea_reputation` is below zero and unflags the rest.
+Run it after bulk loads or other writes that bypass the API.
+
+    python tools/reputationindex.py --endpoint ws://localhost:8182/gremlin
+"""
+
+import argparse
+import json
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'layers'))
+
+
+def main():
+    parser = argparse.ArgumentParser(description = 'rebuild the negative reputation index')
+    parser.add_argument('--endpoint', default = os.environ.get('NeptuneEndpoint', 'ws://localhost:8182/gremlin'))
+    parser.add_argument('--batch-size', type = int, default = 1000)
+    args = parser.parse_args()
+
+    os.environ['NeptuneEndpoint'] = args.endpoint
+    import reputation
+    print(json.dumps(reputation.rebuild(args.batch_size)))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,96 @@
+"""
+Runs the prediction queries over an in-memory snapshot of the whole graph.
+
+Builds the snapshot from Neptune load format CSV files, a saved snapshot, or a
+Gremlin endpoint, optionally saves it, then answers one query for one player or
+for every player. Results are written as JSON lines.
+
+    python tools/snapshot.py data/*.csv --save cohort.npz
+    python tools/snapshot.py --load cohort.npz --query triadicClosure --action action_report
+    python tools/snapshot.py --load cohort.npz --query collaborativeFilter --top 10
+    python tools/snapshot.py --load cohort.npz --query cohorts --cohorts cohorts.json
+"""
+
+import argparse
+import glob
+import json
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'layers'))
+
+import segmentation
+import snapshot
+
+
+def results(graph, args):
+    if args.query == 'badActors':
+        for pair in graph.badActors(args.action):
+            yield pair
+    elif args.query == 'relatedUsers':
+        for path in graph.relatedUsers(args.player_attribute):
+            yield path
+    elif args.query == 'triadicClosure':
+        if args.player:
+            yield {args.player: graph.triadicClosure(args.action, args.player)}
+        else:
+            for player, targets in graph.triadicClosure(args.action).items():
+                yield {player: targets}
+    elif args.query == 'collaborativeFilter':
+        for player, candidates in graph.collaborativeFilters([args.player] if args.player else None, args.top):
+            yield {player: candidates}
+    elif args.query == 'cohorts':
+        with open(args.cohorts) as f:
+            definitions = json.load(f)
+        columns = segmentation.fromSnapshot(graph)
+        for name, cohort in segmentation.evaluate(definitions, columns).items():
+            yield {name: {'size': cohort.size, 'members': cohort.members(columns.ids, 0, args.top)}}
+
+def main():
+    parser = argparse.ArgumentParser(description = 'run prediction queries over a graph snapshot')
+    parser.add_argument('--query', choices = ['badActors', 'cohorts', 'collaborativeFilter', 'relatedUsers', 'triadicClosure'])
+    parser.add_argument('files', nargs = '*', help = 'CSV files (default data/*.csv)')
+    parser.add_argument('--load', help = 'read a snapshot saved with --save')
+    parser.add_argument('--endpoint', help = 'export the snapshot from this Gremlin endpoint')
+    parser.add_argument('--save', help = 'write the snapshot to this .npz file')
+    parser.add_argument('--player')
+    parser.add_argument('--action', default = 'action_report')
+    parser.add_argument('--player-attribute', default = 'ea_reputation')
+    parser.add_argument('--top', type = int, default = None, help = 'collaborativeFilter: keep the top N candidates per player; cohorts: the first N members')
+    parser.add_argument('--cohorts', help = 'cohorts: JSON file of {name: condition}, see layers/segmentation.py')
+    parser.add_argument('--output', help = 'write results here instead of stdout')
+    args = parser.parse_args()
+
+    began = time.monotonic()
+    if args.load:
+        graph = snapshot.load(args.load)
+    elif args.endpoint:
+        os.environ['NeptuneEndpoint'] = args.endpoint
+        import connection
+        graph = snapshot.fromGremlin(connection.traversal())
+    else:
+        files = args.files or sorted(glob.glob(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'data', '*.csv')))
+        graph = snapshot.fromCsv(files)
+    edges = sum(len(adjacency) for adjacency in graph.edges.values())
+    print('snapshot: %d vertices, %d edges in %.1fs' % (len(graph), edges, time.monotonic() - began), file = sys.stderr)
+
+    if args.save:
+        graph.save(args.save)
+    if not args.query:
+        return 0
+
+    began = time.monotonic()
+    out = open(args.output, 'w') if args.output else sys.stdout
+    count = 0
+    for result in results(graph, args):
+        out.write(json.dumps(result, default = str) + '\n')
+        count += 1
+    if args.output:
+        out.close()
+    print('%s: %d results in %.1fs' % (args.query, count, time.monotonic() - began), file = sys.stderr)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
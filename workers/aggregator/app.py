@@ -0,0 +1,132 @@
+"""
+Write-behind aggregator for interaction and campaign events.
+
+Drains events enqueued by `PUT /data/player/{player}/interaction` when
+`InteractionWriteMode` is `async`, merges the counter increments and writes them
+with the same chunked upserts as the batch endpoint. It also continues player
+and campaign deletes that were queued as `delete` events (see
+layers/deletion.py), and its hourly run compacts the counters' time buckets
+(see layers/timebuckets.py). Deployed, it is fed by the SQS event source.
+Locally, `PYTHONPATH=layers python workers/aggregator/app.py`
+drains the queue named by `InteractionQueue` (e.g. `file:/tmp/events.jsonl`).
+"""
+
+from __future__  import print_function  # Python 2/3 compatibility
+
+
+import json
+import logging
+import os
+import actionprofile
+import deletion
+import eventqueue
+import instrumentation
+import interactions
+import retry
+import timebuckets
+
+
+logger = logging.getLogger(__name__)
+
+batchSize = int(os.environ.get('AggregatorBatchSize', '1000'))
+
+# stop draining with this much of the invocation left
+drainMarginMillis = 2000
+
+def continueDeletes(events, context):
+    """
+    Runs the queued deletes. Returns the ids of events whose delete could not be
+    handed on and should be delivered again.
+    """
+    failed = []
+    for event in events:
+        job = deletion.run(event['delete'], context)
+        if job is None or job['status'] == 'failed':
+            logger.warning('delete of %s failed: %s', event['delete'], job and job.get('error'))
+        elif job['status'] != 'done':
+            # out of time; a new event carries on from the job's progress
+            try:
+                deletion.enqueue(event['delete'])
+            except Exception as e:
+                logger.warning('could not requeue the delete of %s: %s', event['delete'], e)
+                failed.append(event['eventId'])
+    return failed
+
+def aggregate(events, context = None):
+    """
+    Writes `events` once each. Returns the ids of events that could not be written
+    because of a retryable conflict and should be delivered again.
+    """
+    events = list({event['eventId']: event for event in events}.values())
+    deletesFailed = continueDeletes([event for event in events if 'delete' in event], context)
+    events = [event for event in events if 'delete' not in event]
+    written = interactions.writtenEvents([event['eventId'] for event in events])
+    pending = [event for event in events if event['eventId'] not in written]
+
+    deltas = interactions.combine(pending)
+    markers = {}
+    for event in pending:
+        markers.setdefault(interactions.eventKey(event), []).append(event['eventId'])
+    results = interactions.applyDeltas(deltas, markers = markers)
+
+    failed = []
+    for key, error in results.items():
+        if error is None:
+            continue
+        elif retry.retryable(error):
+            failed.extend(markers[key])
+        else:
+            logger.warning('dropping %d events for %s: %s', len(markers[key]), key, error)
+
+    logger.info('aggregated %d events (%d already written) into %d writes, %d to retry', len(events), len(written), len(deltas), len(failed))
+    return deletesFailed + failed
+
+def drain(context):
+    queue = eventqueue.queue()
+    processed = 0
+    while context is None or context.get_remaining_time_in_millis() > drainMarginMillis:
+        batch = queue.receive(batchSize)
+        if not batch.events:
+            break
+        failed = set(aggregate(batch.events, context))
+        if failed:
+            # requeued with their event ids, so a retry cannot double count
+            try:
+                queue.send([event for event in batch.events if event['eventId'] in failed])
+            except Exception as e:
+                # leave the whole batch to be delivered again; written events are skipped then
+                logger.warning('could not requeue %d events: %s', len(failed), e)
+                queue.nack(batch)
+                break
+        queue.ack(batch)
+        processed += len(batch.events)
+    return processed
+
+@instrumentation.instrumented
+def handler(event, context):
+    if 'Records' in event:
+        # SQS event source: report the messages to redeliver
+        messages = {}
+        events = []
+        for record in event['Records']:
+            body = json.loads(record['body'])
+            messages[body['eventId']] = record['messageId']
+            events.append(body)
+        failed = aggregate(events, context)
+        return {
+            'batchItemFailures': [{'itemIdentifier': messages[eventId]} for eventId in failed]
+        }
+
+    processed = drain(context)
+    dropped = interactions.dropExpiredMarkers()
+    return {
+        'processed': processed,
+        'expiredMarkers': dropped,
+        'expiredDeleteJobs': deletion.dropExpiredJobs(),
+        'bucketCompaction': timebuckets.compact(actionprofile.counters(), context)
+    }
+
+
+if __name__ == '__main__':
+    logging.basicConfig(level = logging.INFO)
+    print(handler({}, None))
@@ -0,0 +1,38 @@
+"""
+Publishes the player attribute columns that POST /prediction/cohorts segments.
+
+Reads the segmented attributes of every player through the reader endpoint
+(see layers/segmentation.py) and saves them to `SegmentationArtifact`, an
+s3://bucket/key or a local path, where the API loads them from with
+`SegmentationSource=columns:<artifact>`. Deployed, it runs every 15 minutes.
+Locally, `PYTHONPATH=layers python workers/segmentation/app.py`.
+"""
+
+from __future__  import print_function  # Python 2/3 compatibility
+
+
+import logging
+import os
+import connection
+import instrumentation
+import segmentation
+
+
+logger = logging.getLogger(__name__)
+
+artifact = os.environ.get('SegmentationArtifact', '/tmp/segmentation.npz')
+
+@instrumentation.instrumented
+def handler(event, context):
+    columns = segmentation.fromGraph(connection.reader)
+    segmentation.publish(columns, artifact)
+    logger.info('published %d attributes of %d players to %s', len(columns.columns), len(columns), artifact)
+    return {
+        'players': len(columns),
+        'attributes': len(columns.columns)
+    }
+
+
+if __name__ == '__main__':
+    logging.basicConfig(level = logging.INFO)
+    print(handler({}, None))